@@ -0,0 +1,86 @@
+"""
+Benchmark of the data layer backends: PostgREST (SupabaseDB) against direct asyncpg (PostgresDB).
+
+Runs the hot queries of the digest pipeline for one existing user, many times and concurrently,
+against both backends and prints latency percentiles and throughput. The in-process cache of the
+backends is disabled, so every call goes to the database. Needs SUPABASE_URL/SUPABASE_KEY and
+DATABASE_URL of the same database.
+
+    python -m dev_scripts.db_benchmark --user-id 123456 --iterations 200 --concurrency 10
+
+With --writes it also records --batch delivered posts per iteration for the user under the channel
+"@db_benchmark" (they are removed by the regular retention of delivered_posts).
+"""
+import sys
+import os
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.data.database import create_db
+from src.data.cache import ReadThroughCache
+
+
+def hot_queries(db, user_id: int, args: argparse.Namespace):
+    """Returns name -> coroutine factory of the queries made for every digest."""
+    queries = {
+        "fetch_user_channels": lambda: db.fetch_user_channels(user_id),
+        "get_user_interval": lambda: db.get_user_interval(user_id),
+        "fetch_digest_state": lambda: db.fetch_digest_state(user_id),
+        "fetch_delivered_posts": lambda: db.fetch_delivered_posts(user_id, since="2000-01-01T00:00:00"),
+    }
+    if args.writes:
+        def save_delivered_posts():
+            posts = [
+                {"channel": "db_benchmark", "message_id": time.monotonic_ns() + index, "story_id": "db_benchmark"}
+                for index in range(args.batch)
+            ]
+            return db.save_delivered_posts(user_id, posts, datetime.utcnow().isoformat())
+        queries["save_delivered_posts"] = save_delivered_posts
+    return queries
+
+
+async def measure(factory, iterations: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_once():
+        async with semaphore:
+            started = time.perf_counter()
+            await factory()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_once() for _ in range(iterations)))
+    return sorted(latencies), time.perf_counter() - started
+
+
+async def main(args: argparse.Namespace) -> None:
+    for backend in args.backends:
+        db = create_db(backend)
+        # Кэш общий для класса: без TTL ничего не кэшируется, иначе после прогрева мерили бы словарь
+        type(db).cache = ReadThroughCache({})
+        print(f"== {backend}")
+        for name, factory in hot_queries(db, args.user_id, args).items():
+            await factory()  # прогрев: соединения, prepared statements
+            latencies, elapsed = await measure(factory, args.iterations, args.concurrency)
+            print(f"{name:24} p50 {statistics.median(latencies) * 1000:8.1f}ms  "
+                  f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.1f}ms  "
+                  f"{args.iterations / elapsed:8.1f} req/s")
+        if hasattr(db, "close"):
+            await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True, help="existing user whose data is queried")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", default=["supabase", "postgres"])
+    parser.add_argument("--writes", action="store_true", help="also benchmark bulk writes of delivered posts")
+    parser.add_argument("--batch", type=int, default=50, help="delivered posts per write")
+    asyncio.run(main(parser.parse_args()))
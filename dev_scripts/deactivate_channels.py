@@ -0,0 +1,39 @@
+"""
+Admin tool: deactivates channels for all users (or the given ones) with one update.
+
+    python -m dev_scripts.deactivate_channels @spam_channel @closed_channel
+    python -m dev_scripts.deactivate_channels @spam_channel --users 123 456
+
+The script runs in its own process, so it can't drop the channel lists cached by the running bot:
+the bot keeps building digests from these channels until its "user_channels" cache entries expire,
+DB_CACHE_TTLS["user_channels"] seconds (10 minutes by default). Restart the bot to apply it at once.
+"""
+import sys
+import os
+import asyncio
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.data.database import create_db
+from src.config.config import DB_CACHE_TTLS
+
+
+async def main(args: argparse.Namespace) -> None:
+    db = create_db()
+    channels = [channel if channel.startswith("@") else f"@{channel}" for channel in args.channels]
+    deactivated = await db.deactivate_channels(channels, args.users)
+    if deactivated < 0:
+        print("failed, see the log")
+    else:
+        print(f"deactivated {deactivated} user-channel links; the running bot picks this up within "
+              f"{DB_CACHE_TTLS['user_channels'] // 60} minutes (cached channel lists) or after a restart")
+    if hasattr(db, "close"):
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("channels", nargs="+", help="channel names")
+    parser.add_argument("--users", type=int, nargs="+", help="only these users (default: everybody)")
+    asyncio.run(main(parser.parse_args()))
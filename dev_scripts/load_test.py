@@ -0,0 +1,129 @@
+"""
+Offline load test of the digest pipeline.
+
+Runs the story stage (StoryPool) and the LLM stages (Summarization) for many users at once against
+FakeBackend, with synthetic channels instead of Telegram, so no network and no API quota are needed.
+
+    python -m dev_scripts.load_test --users 200 --channels 50 --latency 0.8 --rate-limit 0.05
+"""
+import sys
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llm.backends import FakeBackend
+from src.llm.metrics import llm_context
+from src.llm.scheduler import FairScheduler
+from src.minhash import StoryIndex
+from src.stories import StoryPool
+from src.summarization import Summarization
+
+WORDS = ("биржа рынок ставка банк нефть газ выборы министр суд закон погода снег матч турнир клуб "
+         "компания запуск спутник вакцина больница школа метро транспорт цены рубль доллар сделка "
+         "санкции экспорт урожай завод забастовка пожар авария полиция фестиваль премьера сериал").split()
+
+
+class SyntheticDB:
+    async def save_channel_news_batch(self, channel_id, news):
+        return True
+
+
+class SyntheticScraper:
+    """Generates posts: each channel republishes some of the shared stories, so dedup has work to do."""
+
+    def __init__(self, channels: int, stories: int, posts_per_channel: int, seed: int = 0) -> None:
+        rng = random.Random(seed)
+        self.db = SyntheticDB()
+        self.writes = self.db
+        self.stories = [" ".join(rng.choices(WORDS, k=30)) for _ in range(stories)]
+        self.posts = {
+            f"@channel{index}": [
+                (message_id, f"{rng.choice(self.stories)} {' '.join(rng.choices(WORDS, k=3))}")
+                for message_id in range(1, posts_per_channel + 1)
+            ]
+            for index in range(channels)
+        }
+
+    async def scrape_messages(self, entity_name: str, limit: int = 100):
+        await asyncio.sleep(0.05)  # сетевая задержка Telegram
+        now = datetime.utcnow()
+        return [
+            {"message_id": message_id, "message": text, "message_date": now, "channel_title": entity_name}
+            for message_id, text in self.posts[entity_name][:limit]
+        ]
+
+
+async def run_user(pool: StoryPool, scraper: SyntheticScraper, summarizer: Summarization, user_id: int, channels) -> float:
+    with llm_context(user_id=user_id, digest_id=f"{user_id}:load-test"):
+        return await build_digest(pool, scraper, summarizer, channels)
+
+
+async def build_digest(pool: StoryPool, scraper: SyntheticScraper, summarizer: Summarization, channels) -> float:
+    started = time.monotonic()
+    stories = await pool.collect(scraper, channels, since=datetime.utcnow() - timedelta(hours=1))
+    await pool.summarize(stories, summarizer)
+    summaries = pool.render_summaries(stories)
+    async for _ in summarizer.stream_cluster_summaries(summaries):
+        pass
+    return time.monotonic() - started
+
+
+async def main(args: argparse.Namespace) -> None:
+    backend = FakeBackend(
+        latency=args.latency,
+        seconds_per_token=args.seconds_per_token,
+        rate_limit_probability=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    Summarization.configure(backend=backend, scheduler=FairScheduler(concurrency=args.concurrency))
+    summarizer = Summarization(api_key="fake")
+    scraper = SyntheticScraper(args.channels, args.stories, args.posts, seed=args.seed)
+    # Пауза между запросами к Telegram офлайн не нужна, задержку сети моделирует SyntheticScraper
+    pool = StoryPool(StoryIndex(), tick=timedelta(minutes=5), scrape_pause=0)
+
+    rng = random.Random(args.seed)
+    channel_names = list(scraper.posts)
+    users = [
+        [{"channel_name": name, "channel_id": index} for index, name in enumerate(rng.sample(channel_names, args.per_user))]
+        for _ in range(args.users)
+    ]
+
+    started = time.monotonic()
+    latencies = await asyncio.gather(*(run_user(pool, scraper, summarizer, user_id, channels) for user_id, channels in enumerate(users)))
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(latencies)
+    print(f"users: {args.users}, wall time: {elapsed:.2f}s, throughput: {args.users / elapsed:.1f} digests/s")
+    print(f"digest latency p50: {statistics.median(latencies):.2f}s, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1]:.2f}s, max: {latencies[-1]:.2f}s")
+    print(f"LLM calls: {backend.calls}, rate limited: {backend.rate_limited}, usage: {backend.usage}")
+    print(f"single-flight: {Summarization._singleflight.stats}, scheduler: {Summarization._scheduler.stats}")
+    for row in Summarization.metrics.summary():
+        print(row)
+    print("top users by LLM time:")
+    for user_id, usage in Summarization.metrics.top_users(limit=5):
+        print(user_id, usage)
+    print(f"shared between users: {Summarization.metrics.shared}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--channels", type=int, default=40, help="distinct channels")
+    parser.add_argument("--per-user", type=int, default=8, help="channels per user")
+    parser.add_argument("--stories", type=int, default=60, help="distinct stories across channels")
+    parser.add_argument("--posts", type=int, default=10, help="posts per channel")
+    parser.add_argument("--latency", type=float, default=0.5, help="median LLM latency, seconds")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probability of a 429 response")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent LLM requests")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -3,23 +3,80 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from src.commands import ALL_COMMANDS
-from src.config import TELEGRAM_BOT_TOKEN
+from src.config import (
+    TELEGRAM_BOT_TOKEN,
+    LLM_RESULT_CACHE_TTL,
+    LLM_STAGE_MODELS,
+    LLM_DEGRADATION_WINDOW,
+    LLM_RATE_LIMIT_THRESHOLD,
+    LLM_LATENCY_THRESHOLD,
+    LLM_QUEUE_THRESHOLD,
+    LLM_BREAKER_FAILURE_THRESHOLD,
+    LLM_BREAKER_MIN_CALLS,
+    LLM_BREAKER_WINDOW,
+    LLM_BREAKER_RESET_TIMEOUT,
+    LLM_BACKEND,
+    MISTRAL_KEY,
+    FAKE_LLM_LATENCY,
+    FAKE_LLM_RATE_LIMIT_PROBABILITY,
+    LLM_CONCURRENCY,
+    LLM_FAIR_QUANTUM,
+    LLM_HOURLY_TOKEN_BUDGET,
+    DB_RETENTION_DAYS,
+    DB_RETENTION_INTERVAL,
+    DB_RETENTION_BATCH_SIZE,
+    DB_RETENTION_MAX_BATCHES,
+)
 from src.handlers.channels import router as channels_router
-from src.data.database import supabase, SupabaseDB
+from src.data.database import create_db
+from src.data.retention import retention_loop
 from src.scraper import TelegramScraper, init_telethon_client, close_telethon_client
+from src.summarization import Summarization
+from src.llm.models import ModelSelector
+from src.llm.breaker import CircuitBreaker
+from src.llm.backends import create_backend
+from src.llm.scheduler import FairScheduler
+from src.llm.budget import TokenBudget
 # import src.handlers.keyboards as kb
 
-db = SupabaseDB(supabase)
+db = create_db()
 
 class DigestBot:
     def __init__(self):
         # Initialize bot and dispatcher
         self.bot = Bot(token=TELEGRAM_BOT_TOKEN)
         self.dp = Dispatcher(storage=MemoryStorage())
+        self.retention_task: asyncio.Task | None = None
 
         # Register routers
         self.dp.include_router(channels_router)
 
+        Summarization.configure(
+            result_cache_ttl=LLM_RESULT_CACHE_TTL,
+            selector=ModelSelector(
+                LLM_STAGE_MODELS,
+                window=LLM_DEGRADATION_WINDOW,
+                rate_limit_threshold=LLM_RATE_LIMIT_THRESHOLD,
+                latency_threshold=LLM_LATENCY_THRESHOLD,
+                queue_threshold=LLM_QUEUE_THRESHOLD,
+            ),
+            breaker=CircuitBreaker(
+                failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD,
+                min_calls=LLM_BREAKER_MIN_CALLS,
+                window=LLM_BREAKER_WINDOW,
+                reset_timeout=LLM_BREAKER_RESET_TIMEOUT,
+            ),
+            backend=create_backend(
+                LLM_BACKEND,
+                api_key=MISTRAL_KEY,
+                latency=FAKE_LLM_LATENCY,
+                rate_limit_probability=FAKE_LLM_RATE_LIMIT_PROBABILITY,
+            ),
+            scheduler=FairScheduler(concurrency=LLM_CONCURRENCY, quantum=LLM_FAIR_QUANTUM),
+            budget=TokenBudget(LLM_HOURLY_TOKEN_BUDGET, reference_model=LLM_STAGE_MODELS["summary"][0])
+            if LLM_HOURLY_TOKEN_BUDGET else None,
+        )
+
     def start(self):
         """Start the bot"""
         asyncio.run(self._start_polling())
@@ -49,18 +106,40 @@ class DigestBot:
 
         await init_telethon_client()
         if active_users:
+            # Каналы всех пользователей одним запросом, а не по запросу на каждого при первом дайджесте
+            users_channels = await db.fetch_users_channels([user["user_id"] for user in active_users.data])
             for user in active_users.data:
                 user_id = user["user_id"]
                 interval = await db.get_user_interval(user_id)  # Получаем интервал из БД
                 scraper = TelegramScraper(user_id)
-                task = asyncio.create_task(scraper.start_auto_news_check(user_id, interval=interval))
+                task = asyncio.create_task(scraper.start_auto_news_check(
+                    user_id, interval=interval, user_channels=users_channels.get(user_id)
+                ))
                 TelegramScraper.running_tasks[user_id] = task
 
         logging.info("Bot started successfully and tasks re-launched for active users")
 
+        # Одна фоновая очистка устаревших строк на весь бот, пачками ограниченного размера
+        self.retention_task = asyncio.create_task(retention_loop(
+            db, DB_RETENTION_DAYS, DB_RETENTION_INTERVAL,
+            batch_size=DB_RETENTION_BATCH_SIZE, max_batches=DB_RETENTION_MAX_BATCHES,
+        ))
+
     async def _on_shutdown(self, bot: Bot):
         logging.info("Bot is shutting down")
+        if self.retention_task is not None:
+            self.retention_task.cancel()
+        for row in Summarization.metrics.summary():
+            logging.info("LLM calls: %s", row)
+        for user_id, usage in Summarization.metrics.top_users(limit=10):
+            logging.info("LLM usage of user %s: %s", user_id, usage)
+        logging.info("LLM usage shared between users: %s", Summarization.metrics.shared)
+        for row in db.cache.report():
+            logging.info("DB cache: %s", row)
         await close_telethon_client()
+        await TelegramScraper.write_buffer.drain()  # дописываем отложенные записи до закрытия пула
+        if hasattr(db, "close"):
+            await db.close()  # пул соединений PostgresDB
         await bot.session.close()
 
 
@@ -6,9 +6,11 @@ ALL_COMMANDS = [
 
     BotCommand(command="receive_news", description="⭐️Получать дайджесты"),
     BotCommand(command="set_interval", description="⏲️Установить интервал отправки дайджестов"),
+    BotCommand(command="set_top_k", description="📰Сколько сюжетов в дайджесте"),
     BotCommand(command="delete_channels", description="🗑️Удалить каналы"),
     BotCommand(command="comment", description="💬Оставить комментарий"),
     BotCommand(command="show_channels", description="📋Показать список каналов"),
+    BotCommand(command="history", description="🗂Архив дайджестов"),
     BotCommand(command="stop_news", description="⛔️Остановить дайджесты"),
 
 ]
@@ -14,6 +14,51 @@ DEACTIVATE_USER = os.getenv("DEACTIVATE_USER", "False").lower() in ("true", "1")
 # Interval Variables
 NEWS_CHECK_INTERVAL = 3600  # интервал скрапинга в секундах
 DAY_RANGE_INTERVAL = 7     # интервал скрепинга в днях для определения темы канала
+TOPIC_CACHE_TTL = 7 * 24 * 3600  # время жизни кэша тем каналов в секундах
+TOPIC_SCRAPE_CONCURRENCY = 5     # сколько каналов скрапим одновременно при определении тем
+
+# Database configuration
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase")  # "supabase" (PostgREST по HTTP) или "postgres" (asyncpg напрямую)
+DATABASE_URL = os.getenv("DATABASE_URL")          # строка подключения к Postgres для DB_BACKEND=postgres
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", "10"))  # сколько запросов к БД выполняется одновременно (потоков или соединений пула)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))  # 0 - без prepared statements (pgbouncer в режиме transaction)
+# Сколько секунд держим в памяти редко меняющиеся строки; записи через SupabaseDB сбрасывают кэш сразу
+DB_CACHE_TTLS = {
+    "user": 3600,
+    "interval": 3600,
+    "top_k": 3600,
+    "channel_id": 24 * 3600,
+    "channel_name": 24 * 3600,
+    "user_channels": 600,
+}
+# Отложенная запись (архив дайджестов, посты каналов, флаг получения дайджестов)
+DB_WRITE_BEHIND_MAX_BATCH = 100       # сколько записей накапливаем, прежде чем сбросить их в БД досрочно
+DB_WRITE_BEHIND_FLUSH_INTERVAL = 5    # как часто (в секундах) сбрасываем накопленные записи
+DB_WRITE_BEHIND_MAX_RETRIES = 5       # сколько раз повторяем неудачную запись, прежде чем отбросить её
+
+# Dedup configuration
+DEDUP_SIMILARITY_THRESHOLD = float(os.getenv("DEDUP_SIMILARITY_THRESHOLD", "0.5"))  # косинусная близость TF-IDF для склейки дублей
+STORY_SIMILARITY_THRESHOLD = float(os.getenv("STORY_SIMILARITY_THRESHOLD", "0.5"))  # оценка Jaccard по MinHash для общего индекса сюжетов
+STORY_TICK_INTERVAL = 300  # как часто (в секундах) общий пул сюжетов заново скрапит один и тот же канал
+
+# Incremental digest configuration
+DIGEST_LOOKBACK_OVERLAP = 600        # запас (в секундах) перед прошлым запуском: посты, опубликованные с задержкой, не теряются
+DIGEST_MAX_LOOKBACK = 24 * 3600      # максимальная глубина (в секундах) дайджеста после долгого перерыва
+DELIVERED_POSTS_RETENTION_DAYS = 2   # сколько дней храним журнал доставленных постов
+
+# Retention configuration: сколько дней храним строки таблиц, старые удаляются пачками в фоне
+DB_RETENTION_DAYS = {
+    "channels_news": 1,
+    "delivered_posts": DELIVERED_POSTS_RETENTION_DAYS,
+    "digests": int(os.getenv("DIGESTS_RETENTION_DAYS", "30")),
+}
+DB_RETENTION_INTERVAL = 3600     # как часто (в секундах) запускается очистка
+DB_RETENTION_BATCH_SIZE = 5000   # сколько строк удаляет один запрос
+DB_RETENTION_MAX_BATCHES = 20    # сколько запросов на таблицу за один запуск; остальное удалит следующий запуск
+
+# Ranking configuration
+DIGEST_TOP_K = int(os.getenv("DIGEST_TOP_K", "30"))  # сколько сюжетов по умолчанию отправляем в LLM (0 - без ограничения)
+RANKING_HALF_LIFE = 6 * 3600  # за сколько секунд вклад новизны сюжета в рейтинг падает вдвое
 
 # Telegram configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -30,3 +75,35 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
 # LLM configuration
 MISTRAL_KEY = os.getenv('MISTRAL_KEY')
+LLM_RESULT_CACHE_TTL = 60  # сколько секунд переиспользуем ответ на идентичный запрос к LLM
+
+# Модели по этапам пайплайна: уровни через запятую, первый - предпочтительный
+LLM_STAGE_MODELS = {
+    "summary": os.getenv("MISTRAL_MODELS_SUMMARY", "mistral-large-latest,mistral-small-latest").split(","),
+    "cluster": os.getenv("MISTRAL_MODELS_CLUSTER", "mistral-large-latest,mistral-small-latest").split(","),
+    "topic": os.getenv("MISTRAL_MODELS_TOPIC", "mistral-small-latest,ministral-8b-latest").split(","),
+}
+LLM_DEGRADATION_WINDOW = 300        # окно (в секундах), по которому оцениваем состояние модели
+LLM_RATE_LIMIT_THRESHOLD = 0.3      # доля ответов 429, после которой переходим на следующий уровень
+LLM_LATENCY_THRESHOLD = 30          # средняя латентность (в секундах), после которой переходим на следующий уровень
+LLM_QUEUE_THRESHOLD = 20            # среднее ожидание перед запросом (в секундах), после которого переходим на следующий уровень
+
+# Circuit breaker для LLM API: при высокой доле ошибок перестаём обращаться к API и суммаризируем локально
+LLM_BREAKER_FAILURE_THRESHOLD = 0.5  # доля неудачных запросов в окне, после которой breaker открывается
+LLM_BREAKER_MIN_CALLS = 5            # минимальное число запросов в окне для принятия решения
+LLM_BREAKER_WINDOW = 60              # окно (в секундах), по которому считаем долю ошибок
+LLM_BREAKER_RESET_TIMEOUT = 120      # через сколько секунд после открытия пробуем API снова
+
+# LLM backend: "mistral" - Mistral API, "fake" - локальная заглушка для офлайн нагрузочного тестирования
+LLM_BACKEND = os.getenv("LLM_BACKEND", "mistral")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))                    # медианная латентность заглушки в секундах
+FAKE_LLM_RATE_LIMIT_PROBABILITY = float(os.getenv("FAKE_LLM_RATE_LIMIT_PROBABILITY", "0"))  # доля ответов 429
+
+# Очередь запросов к LLM: одновременно выполняется не больше LLM_CONCURRENCY запросов,
+# места делятся между пользователями по deficit round robin на оценке токенов
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_FAIR_QUANTUM = 4000  # кредит токенов, который пользователь получает за один ход
+
+# Часовой бюджет токенов LLM (в токенах самой дорогой модели суммаризации), 0 - без ограничения.
+# При нехватке бюджета дайджест сокращается до лучших сюжетов, строится на дешёвой модели или без LLM
+LLM_HOURLY_TOKEN_BUDGET = int(os.getenv("LLM_HOURLY_TOKEN_BUDGET", "0"))
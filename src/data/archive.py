@@ -0,0 +1,92 @@
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+# Общий словарь сжатия: фрагменты, которые повторяются в каждом дайджесте (разметка, ссылки на посты,
+# частые слова новостей). Короткий дайджест сам по себе сжимается плохо, со словарём - заметно лучше.
+# zlib ищет совпадения с конца словаря, поэтому самые частые фрагменты стоят в конце.
+_ZDICT_V1 = (
+    "Разное 📰 Политика 🏛 Экономика 💰 Технологии 💻 Общество 👥 Происшествия 🚨 Спорт ⚽️ Культура 🎭 Наука 🔬 "
+    "Здоровье 🏥 Мир 🌍 Россия 🇷🇺 Украина 🇺🇦 США 🇺🇸 Китай 🇨🇳 Москва Путин Трамп Зеленский ЦБ рубль доллар нефть "
+    "ставка санкции переговоры заявил сообщил сообщает по данным в результате в течение в том числе "
+    "миллиона миллиардов рублей процентов года которые который после против также России президент "
+    "правительство министр министерство компания компании более около "
+    "\n\n📰 <b>Разное</b>\n"
+    "</b>\n"
+    ".\n<i>Источник: </i><a href=\"https://t.me/"
+    "</a> | <a href=\"https://t.me/"
+    "</a>\n"
+).encode("utf-8")
+
+# Версия словаря хранится первым байтом архива: старые записи читаются своим словарём и после его смены
+_ZDICTS = {0: b"", 1: _ZDICT_V1}
+ZDICT_VERSION = 1
+
+
+def compress_digest(text: str, version: int = ZDICT_VERSION) -> bytes:
+    """
+    Compresses a digest for the archive with raw deflate and the shared dictionary.
+
+    :param text: HTML text of the digest.
+    :param version: Version of the dictionary; 0 compresses without a dictionary.
+    :returns: One byte of the dictionary version followed by the compressed text.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=_ZDICTS[version])
+    return bytes([version]) + compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decompress_digest(blob: bytes) -> str:
+    """
+    Restores a digest compressed by compress_digest.
+
+    :param blob: Archived bytes.
+    :returns: HTML text of the digest.
+    :raises ValueError: If the dictionary version is unknown.
+    """
+    if not blob:
+        return ""
+    zdict = _ZDICTS.get(blob[0])
+    if zdict is None:
+        raise ValueError(f"Unknown digest dictionary version: {blob[0]}")
+    decompressor = zlib.decompressobj(-15, zdict=zdict)
+    return (decompressor.decompress(blob[1:]) + decompressor.flush()).decode("utf-8")
+
+
+def encode_cursor(creation_timestamp: datetime, digest_id: int) -> str:
+    """Cursor of a history page: the key of its last digest, short enough for callback data."""
+    return f"{creation_timestamp.isoformat()}|{digest_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Parses a cursor made by encode_cursor.
+
+    :raises ValueError: If the cursor is malformed.
+    """
+    timestamp, digest_id = cursor.split("|")
+    return datetime.fromisoformat(timestamp), int(digest_id)
+
+
+def history_page(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], str | None]:
+    """
+    Builds a history page from digest rows read newest first, one row more than `limit`.
+
+    :param rows: Rows with keys "digest_id", "creation_timestamp" (datetime), "digest_compressed" (bytes or None)
+        and "digest_content" (text of digests saved before the archive was compressed).
+    :param limit: Digests per page.
+    :returns: Dictionaries with keys "digest_id", "creation_timestamp" and "digest_content", and the cursor
+        of the next (older) page or None if this page is the last one.
+    """
+    digests = [
+        {
+            "digest_id": row["digest_id"],
+            "creation_timestamp": row["creation_timestamp"],
+            "digest_content": decompress_digest(row["digest_compressed"])
+            if row.get("digest_compressed") else row.get("digest_content") or "",
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit and digests:
+        next_cursor = encode_cursor(digests[-1]["creation_timestamp"], digests[-1]["digest_id"])
+    return digests, next_cursor
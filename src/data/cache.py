@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+
+class ReadThroughCache:
+    """
+    In-process read-through cache for rarely changing rows (users, channels, intervals).
+
+    Entries live in namespaces, each with its own TTL; a namespace without a TTL is not cached.
+    Values are loaded on a miss and kept until they expire, are invalidated by a write, or are evicted
+    as least recently used when the cache holds more than `max_entries`. Only successful loads are cached:
+    a loader that raises leaves the cache untouched. A load that was running while its key was invalidated
+    is not cached either, since it may have read the row before the write. Hits and misses are counted per namespace.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int = 10000) -> None:
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        # Поколения ключей и пространств имён: invalidate увеличивает их, загрузка сверяет до и после
+        self._generations: Dict[Tuple[str, Hashable], int] = {}
+        self._namespace_generations: Dict[str, int] = {}
+
+    def _count(self, namespace: str, name: str) -> None:
+        counters = self.stats.setdefault(namespace, {"hits": 0, "misses": 0, "invalidations": 0})
+        counters[name] += 1
+
+    def get(self, namespace: str, key: Hashable) -> Tuple[bool, Any]:
+        """Returns (found, value) without loading."""
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            return False, None
+        if time.monotonic() > entry[0]:
+            del self._entries[(namespace, key)]
+            return False, None
+        self._entries.move_to_end((namespace, key))
+        return True, entry[1]
+
+    def put(self, namespace: str, key: Hashable, value: Any, generation: Tuple[int, int] | None = None) -> None:
+        """
+        Stores a value, e.g. one that was loaded in bulk.
+
+        :param generation: generation() of the key taken before the value was read; if the key was invalidated
+            since then, the value is not stored.
+        """
+        if generation is not None and self.generation(namespace, key) != generation:
+            return
+        ttl = self.ttls.get(namespace, 0)
+        if ttl <= 0:
+            return
+        self._entries[(namespace, key)] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end((namespace, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, namespace: str, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value or loads and caches it.
+
+        :param namespace: Kind of the value, e.g. "interval"; defines the TTL.
+        :param key: Key within the namespace, e.g. the user id.
+        :param loader: Coroutine function reading the value from the database; it should raise on errors.
+        :returns: The value.
+        """
+        found, value = self.get(namespace, key)
+        if found:
+            self._count(namespace, "hits")
+            return value
+        self._count(namespace, "misses")
+        generation = self.generation(namespace, key)
+        value = await loader()
+        # Запись успела сбросить ключ, пока шла загрузка: значение могло устареть, не кэшируем его
+        self.put(namespace, key, value, generation)
+        return value
+
+    def generation(self, namespace: str, key: Hashable) -> Tuple[int, int]:
+        """Changes whenever the key is invalidated; see put for loads made outside get_or_load."""
+        return self._namespace_generations.get(namespace, 0), self._generations.get((namespace, key), 0)
+
+    def invalidate(self, namespace: str, *keys: Hashable) -> None:
+        """Drops the given keys of a namespace, or the whole namespace if no keys are given."""
+        self._count(namespace, "invalidations")
+        if keys:
+            for key in keys:
+                self._entries.pop((namespace, key), None)
+                self._generations[(namespace, key)] = self._generations.get((namespace, key), 0) + 1
+        else:
+            self._namespace_generations[namespace] = self._namespace_generations.get(namespace, 0) + 1
+            for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == namespace]:
+                del self._entries[entry_key]
+
+    def clear(self) -> None:
+        for namespace in self.stats:
+            self._namespace_generations[namespace] = self._namespace_generations.get(namespace, 0) + 1
+        self._entries.clear()
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Returns per namespace hits, misses, hit rate and size, e.g. for logging."""
+        sizes: Dict[str, int] = {}
+        for namespace, _ in self._entries:
+            sizes[namespace] = sizes.get(namespace, 0) + 1
+        rows = []
+        for namespace, counters in sorted(self.stats.items()):
+            lookups = counters["hits"] + counters["misses"]
+            rows.append({
+                "namespace": namespace,
+                **counters,
+                "hit_rate": round(counters["hits"] / lookups, 3) if lookups else 0.0,
+                "size": sizes.get(namespace, 0),
+            })
+        return rows
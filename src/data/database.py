@@ -1,10 +1,13 @@
+import asyncio
 import logging
 import hashlib
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from datetime import datetime
+from typing import List, Dict, Any, Awaitable, Callable, Tuple
 from supabase import create_client, Client
 from supabase import AuthApiError, PostgrestAPIError
-from src.config.config import SUPABASE_URL, SUPABASE_KEY
+from src.config.config import SUPABASE_URL, SUPABASE_KEY, DB_MAX_CONCURRENCY, DB_BACKEND, DB_CACHE_TTLS
+from src.data.cache import ReadThroughCache
+from src.data.archive import compress_digest, decode_cursor, history_page
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
@@ -21,10 +24,61 @@ class SupabaseErrorHandler:
         logging.error(msg)
 
 
+def _as_topics(channel_topic: Any) -> List[str]:
+    """Normalizes channels.channel_topic (text[], a plain string in old rows, or NULL) to a list."""
+    if not channel_topic:
+        return []
+    return [channel_topic] if isinstance(channel_topic, str) else list(channel_topic)
+
+
+def _user_channel(row: Dict[str, Any]) -> Dict[str, Any]:
+    """A user_channels row with the embedded channel -> the channel dictionary of fetch_user_channels."""
+    return {
+        "channel_name": row["channels"]["channel_name"],
+        "channel_id": row["channel_id"],
+        "channel_topic": _as_topics(row["channels"].get("channel_topic")),
+    }
+
+
+def _digest_row(user_id: int, digest_content: str, creation_timestamp: str) -> Dict[str, Any]:
+    """A digests row with the content compressed for the archive; PostgREST takes bytea as a hex string."""
+    return {
+        "user_id": user_id,
+        "digest_compressed": "\\x" + compress_digest(digest_content).hex(),
+        "creation_timestamp": creation_timestamp,
+    }
+
+
+def _from_bytea(value: Any) -> bytes | None:
+    """Decodes a bytea value returned by PostgREST ("\\x" + hex)."""
+    if not value:
+        return None
+    return bytes.fromhex(value[2:]) if value.startswith("\\x") else bytes.fromhex(value)
+
+
 class SupabaseDB:
+    # Клиент supabase синхронный: запросы выполняются в потоках, чтобы не блокировать event loop.
+    # Семафор общий для всех экземпляров и ограничивает число одновременных запросов (и занятых потоков)
+    _semaphore = asyncio.Semaphore(DB_MAX_CONCURRENCY)
+    # Редко меняющиеся строки (пользователи, каналы, интервалы) читаем из памяти, записи сбрасывают кэш
+    cache = ReadThroughCache(DB_CACHE_TTLS)
+    # PostgREST отдаёт не больше max-rows строк за ответ (1000 по умолчанию), а длинный in.(...) упирается в длину URL
+    page_size = 1000
+    in_chunk_size = 100
+
     def __init__(self, supabase_client):
         self.client = supabase_client
 
+    async def _execute(self, query):
+        """
+        Executes a query of the synchronous supabase client in a worker thread.
+
+        :param query: A query builder, e.g. self.client.table("users").select("user_id").
+        :return: The API response.
+        """
+        async with SupabaseDB._semaphore:
+            return await asyncio.to_thread(query.execute)
+
     async def fetch_user(self, user_id: int) -> int:
         """
         Retrieve user ID from the database.
@@ -33,14 +87,16 @@ class SupabaseDB:
         :return: The ID of the user if found, otherwise None.
         :raises: SupabaseErrorHandler if an error occurs.
         """
-        try:
-            response = (
+        async def load():
+            response = await self._execute(
                 self.client.table("users")
                 .select("user_id")
                 .eq("user_id", user_id)
-                .execute()
             )
             return response.data[0]["user_id"] if response.data else None
+
+        try:
+            return await SupabaseDB.cache.get_or_load("user", user_id, load)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
 
@@ -61,7 +117,7 @@ class SupabaseDB:
         :raises: SupabaseErrorHandler if an error occurs.
         """
         try:
-            self.client.table("users").upsert(
+            await self._execute(self.client.table("users").upsert(
                 {
                     "user_id": user_id,
                     "username": username,
@@ -69,7 +125,9 @@ class SupabaseDB:
                     "check_interval": check_interval,
                     "is_receiving_news": is_receiving_news
                 }
-                ).execute()
+                ))
+            SupabaseDB.cache.invalidate("user", user_id)
+            SupabaseDB.cache.invalidate("interval", user_id)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
 
@@ -81,17 +139,37 @@ class SupabaseDB:
         :return:
         """
         try:
-            response = (
+            response = await self._execute(
                 self.client.table("users")
                 .update({"is_receiving_news": is_receiving})
                 .eq("user_id", user_id)
-                .execute()
             )
             return bool(response.data)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
             return False
 
+    async def set_users_receiving_news(self, user_ids: List[int], is_receiving: bool) -> bool:
+        """
+        Set the receiving news flag of many users with one request (see WriteBehindBuffer).
+
+        :param user_ids: IDs of the users.
+        :param is_receiving: The new value of the flag.
+        :return: True if the request succeeded (also when some users don't exist), otherwise False.
+        """
+        if not user_ids:
+            return True
+        try:
+            await self._execute(
+                self.client.table("users")
+                .update({"is_receiving_news": is_receiving})
+                .in_("user_id", user_ids)
+            )
+            return True
+        except Exception as e:
+            logging.error("Ошибка при обновлении is_receiving_news для %s пользователей: %s", len(user_ids), e)
+            return False
+
     async def retrieve_current_users(self) -> List[Dict[str, Any]]:
         """
         Retrieve users who are receiving news
@@ -99,11 +177,10 @@ class SupabaseDB:
         :return:
         """
         try:
-            response = (
+            response = await self._execute(
                 self.client.table("users")
                 .select("user_id")
                 .eq("is_receiving_news", True)
-                .execute()
             )
             return response
         except Exception as e:
@@ -111,31 +188,70 @@ class SupabaseDB:
 
     async def fetch_user_channels(self, user_id: int) -> List[Dict[str, Any]]:
         """
-        Retrieve the channels associated with a given user from the database.
+        Retrieve the channels associated with a given user from the database with one query.
 
         :param user_id: The ID of the user whose channels are to be retrieved.
         :return: A list of dictionaries containing the user's channels.
-                 Each dictionary contains the keys "channel_name" and "channel_id".
+                 Each dictionary contains the keys "channel_name", "channel_id" and "channel_topic" (list of topics).
         :raises: SupabaseErrorHandler if an error occurs.
         """
-        try:
-            response = (
+        async def load():
+            response = await self._execute(
                 self.client.table("user_channels")
-                .select("channel_id")
+                .select("channel_id, channels(channel_name, channel_topic)")
                 .eq("user_id", user_id)
                 .eq("is_active", True)  # Берем только активные каналы
-                .execute()
             )
-            channel_ids = [channel["channel_id"] for channel in response.data]
-            channels = []
-            for channel_id in channel_ids:
-                channel_name = await self.fetch_channel_name(channel_id)
-                if channel_name:
-                    channels.append({"channel_name": channel_name, "channel_id": channel_id})
-            return channels
+            return [_user_channel(row) for row in response.data if row.get("channels")]
+
+        try:
+            return list(await SupabaseDB.cache.get_or_load("user_channels", user_id, load))
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
 
+    async def fetch_users_channels(self, user_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Retrieve the channels of many users with a few queries, e.g. when the scheduler starts.
+
+        Users are queried in chunks of `in_chunk_size`, and every chunk is read page by page (`page_size` rows)
+        until a short page comes back, so the max-rows limit of PostgREST can't silently cut the result.
+
+        :param user_ids: The IDs of the users.
+        :return: User ID -> list of channels as returned by fetch_user_channels (empty for users without channels).
+            Users of a chunk that failed are left out, so callers read their channels with fetch_user_channels.
+        """
+        channels = {}
+        for start in range(0, len(user_ids), self.in_chunk_size):
+            chunk = user_ids[start:start + self.in_chunk_size]
+            try:
+                chunk_channels = {user_id: [] for user_id in chunk}
+                generations = {user_id: SupabaseDB.cache.generation("user_channels", user_id) for user_id in chunk}
+                offset = 0
+                while True:
+                    response = await self._execute(
+                        self.client.table("user_channels")
+                        .select("user_id, channel_id, channels(channel_name, channel_topic)")
+                        .in_("user_id", chunk)
+                        .eq("is_active", True)
+                        .order("user_id")
+                        .order("channel_id")
+                        .range(offset, offset + self.page_size - 1)
+                    )
+                    for row in response.data:
+                        if row.get("channels"):
+                            chunk_channels.setdefault(row["user_id"], []).append(_user_channel(row))
+                    if len(response.data) < self.page_size:
+                        break
+                    offset += self.page_size
+            except Exception as e:
+                logging.error("Ошибка при получении каналов %s пользователей: %s", len(chunk), e)
+                continue
+            # Кэшируем только полностью прочитанные списки
+            for user_id, user_channels in chunk_channels.items():
+                SupabaseDB.cache.put("user_channels", user_id, user_channels, generations[user_id])
+            channels.update(chunk_channels)
+        return channels
+
     async def add_channels(self, channels: List[str], channel_topics: List[str], addition_timestamp: str = None) -> bool:
         """
         Add multiple channels to the database.
@@ -149,9 +265,9 @@ class SupabaseDB:
 
         try:
             values = []
-            for channel in channels:
+            for index, channel in enumerate(channels):
                 channel_id = await self.generate_channel_hash(channel)
-                channel_topic = channel_topics[channels.index(channel)] if channel_topics else None
+                channel_topic = channel_topics[index] if channel_topics else None
                 channel_link = f"https://t.me/{channel[1:]}"
 
                 values.append({
@@ -162,7 +278,8 @@ class SupabaseDB:
                     "addition_timestamp": addition_timestamp
                 })
 
-            response = self.client.table("channels").insert(values).execute()
+            response = await self._execute(self.client.table("channels").insert(values))
+            SupabaseDB.cache.invalidate("channel_id", *channels)
             return bool(response.data)
         except Exception as e:
             logging.error("Error during adding channels %s : %s", channels, e)
@@ -189,12 +306,81 @@ class SupabaseDB:
                 "addition_timestamp": addition_timestamp
             }
 
-            response = self.client.table("channels").insert(data).execute()
+            response = await self._execute(self.client.table("channels").insert(data))
+            SupabaseDB.cache.invalidate("channel_id", channel_name)
             return bool(response.data)
         except Exception as e:
             logging.error("Error during adding single channel %s : %s", channel_name, e)
             return False
 
+    async def ensure_user_channels(
+        self,
+        user_id: int,
+        channels: List[str],
+        detect_topics: Callable[[List[str]], Awaitable[Dict[str, List[str]]]] | None = None,
+        addition_timestamp: str = None,
+    ) -> Dict[str, int]:
+        """
+        Register any unknown channels and link all of them to the user, with a constant number of requests.
+
+        Known channels keep their IDs (old rows have IDs that are not generate_channel_hash values), IDs of new
+        channels are computed locally. Only the new channels are passed to `detect_topics`. Both writes are
+        idempotent upserts, so repeating the call after a failure is safe: PostgREST has no multi-statement
+        transactions, PostgresDB does the same in one transaction.
+
+        :param user_id: The ID of the user.
+        :param channels: Channel names, known and new mixed.
+        :param detect_topics: Coroutine function returning channel name -> topics for the new channels.
+        :param addition_timestamp: The timestamp of the addition.
+        :return: Channel name -> channel ID of every linked channel, or an empty dictionary on failure.
+        """
+        channels = list(dict.fromkeys(channels))
+        if not channels:
+            return {}
+        try:
+            response = await self._execute(
+                self.client.table("channels").select("channel_id, channel_name").in_("channel_name", channels)
+            )
+            channel_ids = {row["channel_name"]: row["channel_id"] for row in response.data}
+
+            new_channels = [channel for channel in channels if channel not in channel_ids]
+            if new_channels:
+                topics = await detect_topics(new_channels) if detect_topics else {}
+                values = []
+                for channel in new_channels:
+                    channel_ids[channel] = await self.generate_channel_hash(channel)
+                    values.append({
+                        "channel_id": channel_ids[channel],
+                        "channel_name": channel,
+                        "channel_topic": topics.get(channel),
+                        "channel_link": f"https://t.me/{channel[1:]}",
+                        "addition_timestamp": addition_timestamp,
+                    })
+                await self._execute(
+                    self.client.table("channels").upsert(values, on_conflict="channel_id", ignore_duplicates=True)
+                )
+
+            await self._execute(self.client.table("user_channels").upsert(
+                [
+                    {
+                        "user_id": user_id,
+                        "channel_id": channel_ids[channel],
+                        "addition_timestamp": addition_timestamp,
+                        "is_active": True,
+                    }
+                    for channel in channels
+                ],
+                on_conflict="user_id,channel_id"
+            ))
+
+            SupabaseDB.cache.invalidate("user_channels", user_id)
+            for channel, channel_id in channel_ids.items():
+                SupabaseDB.cache.put("channel_id", channel, channel_id)
+            return channel_ids
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return {}
+
     async def link_user_channels(self, user_id: int, channel_ids: List[int], addition_timestamp: str = None) -> bool:
         """
         Link a user to multiple channels in the database.
@@ -216,7 +402,8 @@ class SupabaseDB:
                 for channel_id in channel_ids
             ]
 
-            response = self.client.table("user_channels").insert(values).execute()
+            response = await self._execute(self.client.table("user_channels").insert(values))
+            SupabaseDB.cache.invalidate("user_channels", user_id)
             return bool(response.data)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
@@ -232,7 +419,7 @@ class SupabaseDB:
         :return: True if the user was successfully linked to the channel, False otherwise.
         """
         try:
-            response = self.client.table("user_channels").upsert(
+            response = await self._execute(self.client.table("user_channels").upsert(
                 {
                     "user_id": user_id,
                     "channel_id": channel_id,
@@ -240,7 +427,8 @@ class SupabaseDB:
                     "is_active": True
                 },
                 on_conflict="user_id,channel_id"  # Указываем уникальные поля для конфликта
-            ).execute()
+            ))
+            SupabaseDB.cache.invalidate("user_channels", user_id)
 
             return bool(response.data)
         except Exception as e:
@@ -256,19 +444,82 @@ class SupabaseDB:
         :return: True if the operation was successful, otherwise handles exceptions.
         """
         try:
-            channel_ids = [await self.fetch_channel_id(channel) for channel in channels if await self.fetch_channel_id(channel)]
+            channel_ids = list((await self._resolve_channel_ids(channels)).values())
             if not channel_ids:
                 return False
 
-            response = self.client.table("user_channels").update(
+            response = await self._execute(self.client.table("user_channels").update(
                 {"is_active": False}
-            ).eq("user_id", user_id).in_("channel_id", channel_ids).execute()
+            ).eq("user_id", user_id).in_("channel_id", channel_ids))
+            SupabaseDB.cache.invalidate("user_channels", user_id)
 
             return bool(response.data)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
             return False
 
+    async def deactivate_channels(self, channels: List[str], user_ids: List[int] | None = None) -> int:
+        """
+        Deactivate channels for many users at once, e.g. from admin tooling when channels are removed or banned.
+
+        Only the cache of the calling process is invalidated. Other processes, e.g. the running bot when this is
+        called from dev_scripts/deactivate_channels.py, keep their cached channel lists and build digests from the
+        deactivated channels until the "user_channels" entry expires (DB_CACHE_TTLS, 10 minutes by default).
+
+        :param channels: Channel names.
+        :param user_ids: Users to unlink the channels from; None means all users.
+        :return: Number of deactivated user-channel links, -1 on failure.
+        """
+        try:
+            channel_ids = list((await self._resolve_channel_ids(channels)).values())
+            if not channel_ids:
+                return 0
+
+            query = (
+                self.client.table("user_channels")
+                .update({"is_active": False})
+                .in_("channel_id", channel_ids)
+                .eq("is_active", True)
+            )
+            if user_ids is not None:
+                query = query.in_("user_id", user_ids)
+            response = await self._execute(query)
+
+            affected_users = {row["user_id"] for row in response.data}
+            if affected_users:
+                SupabaseDB.cache.invalidate("user_channels", *affected_users)
+            logging.info("Деактивированы каналы %s у %s пользователей", channels, len(affected_users))
+            return len(response.data)
+        except Exception as e:
+            logging.error("Error during deactivating channels %s: %s", channels, e)
+            return -1
+
+    async def _resolve_channel_ids(self, channels: List[str]) -> Dict[str, int]:
+        """
+        Resolve channel names to IDs: cached names locally, the rest with one query.
+
+        IDs can't be computed with generate_channel_hash here: old channels have other IDs.
+
+        :param channels: Channel names.
+        :return: Channel name -> channel ID of the channels that exist.
+        """
+        channel_ids, missing = {}, []
+        for channel in dict.fromkeys(channels):
+            found, channel_id = SupabaseDB.cache.get("channel_id", channel)
+            if found and channel_id:
+                channel_ids[channel] = channel_id
+            else:
+                missing.append(channel)
+
+        if missing:
+            response = await self._execute(
+                self.client.table("channels").select("channel_id, channel_name").in_("channel_name", missing)
+            )
+            for row in response.data:
+                channel_ids[row["channel_name"]] = row["channel_id"]
+                SupabaseDB.cache.put("channel_id", row["channel_name"], row["channel_id"])
+        return channel_ids
+
     async def clear_user_channels(self, user_id: int) -> bool:
         """
         Clear all channels associated with a given user from the database.
@@ -277,9 +528,10 @@ class SupabaseDB:
         :return: The response data from the database operation.
         """
         try:
-            response = self.client.table("user_channels").update(
+            response = await self._execute(self.client.table("user_channels").update(
                 {"is_active": False}
-            ).eq("user_id", user_id).execute()
+            ).eq("user_id", user_id))
+            SupabaseDB.cache.invalidate("user_channels", user_id)
 
             return bool(response.data)
         except Exception as e:
@@ -298,7 +550,7 @@ class SupabaseDB:
         :return: True if the operation was successful, otherwise handles exceptions.
         """
         try:
-            response = (
+            response = await self._execute(
                 self.client.table("channels_news")
                 .upsert(
                     {
@@ -307,26 +559,64 @@ class SupabaseDB:
                         "addition_timestamp": addition_timestamp,
                     }
                 )
-                .execute()
             )
             return bool(response.data)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, None, channel_id)
             return False
 
-    async def cleanup_old_news(self):
+    async def save_channel_news_batch(self, channel_id: int, news: List[Dict[str, Any]]) -> bool:
+        """
+        Save a whole scrape batch of a channel with one request.
+
+        Rows are keyed by (channel_id, message_id): posts that are already stored are skipped, so
+        overlapping scrapes and restarts don't write the same post twice.
+
+        :param channel_id: The ID of the channel the news was retrieved from.
+        :param news: Dictionaries with keys "message_id", "message" and "message_date" (as returned by scrape_messages).
+        :return: True if the operation was successful (or there was nothing to save), otherwise False.
+        """
+        if not news:
+            return True
+        try:
+            values = list({
+                msg["message_id"]: {
+                    "channel_id": channel_id,
+                    "message_id": msg["message_id"],
+                    "news": msg["message"],
+                    "addition_timestamp": msg["message_date"].isoformat(),
+                }
+                for msg in news
+            }.values())
+            await self._execute(
+                self.client.table("channels_news")
+                .upsert(values, on_conflict="channel_id,message_id", ignore_duplicates=True)
+            )
+            return True
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, None, channel_id)
+            return False
+
+    async def purge_expired(self, table: str, cutoff: datetime, batch_size: int = 5000) -> int:
         """
-        Cleanup old news pieces from the database.
+        Delete at most `batch_size` of the oldest rows of a table that are older than `cutoff`.
+
+        Calls the purge_expired function of database.sql, which deletes by the index on the table's
+        time column, so one call costs the same however large the table is (see enforce_retention).
 
-        This method deletes all news pieces older than 1 day from the database.
+        :param table: "channels_news", "digests" or "delivered_posts".
+        :param cutoff: Rows older than this (naive UTC) are deleted.
+        :param batch_size: Maximum number of rows to delete.
+        :return: The number of deleted rows, or -1 on failure.
         """
         try:
-            cutoff_time = (datetime.utcnow() - timedelta(days=1)).isoformat()
-            self.client.table("channels_news").delete().lt(
-                "addition_timestamp", cutoff_time
-            ).execute()
+            response = await self._execute(self.client.rpc(
+                "purge_expired", {"target": table, "cutoff": cutoff.isoformat(), "batch_size": batch_size}
+            ))
+            return int(response.data or 0)
         except Exception as e:
-            logging.error("Ошибка при очистке старых новостей: %s", e)
+            logging.error("Ошибка при очистке таблицы %s: %s", table, e)
+            return -1
 
     async def save_user_digest(
         self,
@@ -335,31 +625,86 @@ class SupabaseDB:
         creation_timestamp: str,
     ) -> bool:
         """
-        Save a user's digest to the database.
+        Save a user's digest to the database, compressed (see compress_digest).
 
         :param user_id: The ID of the user the digest belongs to.
-        :param channel_id: The ID of the channel the digest was generated from.
         :param digest_content: The content of the digest as a string.
         :param creation_timestamp: The timestamp of the digest creation.
         :return: True if the operation was successful, otherwise handles exceptions.
         """
         try:
-            response = (
+            response = await self._execute(
                 self.client.table("digests")
-                .upsert(
-                    {
-                        "user_id": user_id,
-                        "digest_content": digest_content,
-                        "creation_timestamp": creation_timestamp,
-                    }
-                )
-                .execute()
+                .upsert(_digest_row(user_id, digest_content, creation_timestamp))
             )
             return bool(response.data)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
             return False
 
+    async def save_user_digests(self, digests: List[Dict[str, Any]]) -> bool:
+        """
+        Save many digests with one request (see WriteBehindBuffer).
+
+        :param digests: Dictionaries with keys "user_id", "digest_content" and "creation_timestamp".
+        :return: True if the operation was successful (or there was nothing to save), otherwise False.
+        """
+        if not digests:
+            return True
+        try:
+            await self._execute(self.client.table("digests").insert([
+                _digest_row(digest["user_id"], digest["digest_content"], digest["creation_timestamp"])
+                for digest in digests
+            ]))
+            return True
+        except Exception as e:
+            logging.error("Ошибка при сохранении %s дайджестов: %s", len(digests), e)
+            return False
+
+    async def fetch_digest_history(
+        self, user_id: int, limit: int = 5, before: str | None = None
+    ) -> Tuple[List[Dict[str, Any]], str | None]:
+        """
+        Read a page of the user's past digests, newest first.
+
+        Pages are keyset-paginated by (creation_timestamp, digest_id) over the digests_user_history_idx
+        index, so reading an old page costs the same as reading the first one.
+
+        :param user_id: The ID of the user.
+        :param limit: Digests per page.
+        :param before: Cursor returned with the previous page, None for the newest digests.
+        :return: Dictionaries with keys "digest_id", "creation_timestamp" and "digest_content", and the cursor
+            of the next page (None if there are no older digests). An empty page on failure.
+        """
+        try:
+            query = (
+                self.client.table("digests")
+                .select("digest_id, creation_timestamp, digest_content, digest_compressed")
+                .eq("user_id", user_id)
+            )
+            if before:
+                timestamp, digest_id = decode_cursor(before)
+                timestamp = timestamp.isoformat()
+                query = query.or_(
+                    f"creation_timestamp.lt.{timestamp},"
+                    f"and(creation_timestamp.eq.{timestamp},digest_id.lt.{digest_id})"
+                )
+            response = await self._execute(
+                query.order("creation_timestamp", desc=True).order("digest_id", desc=True).limit(limit + 1)
+            )
+            rows = [
+                {
+                    **row,
+                    "creation_timestamp": datetime.fromisoformat(row["creation_timestamp"]).replace(tzinfo=None),
+                    "digest_compressed": _from_bytea(row.get("digest_compressed")),
+                }
+                for row in response.data
+            ]
+            return history_page(rows, limit)
+        except Exception as e:
+            logging.error("Ошибка при чтении истории дайджестов пользователя %s: %s", user_id, e)
+            return [], None
+
     async def fetch_channel_id(self, channel_name: str) -> int:
         """
         Ensure that a channel with the given name exists in the database.
@@ -367,9 +712,12 @@ class SupabaseDB:
         :param channel_name: The name of the channel to check.
         :return: The ID of the channel if it exists, False otherwise.
         """
-        try:
-            response = self.client.table("channels").select("*").eq("channel_name", channel_name).execute()
+        async def load():
+            response = await self._execute(self.client.table("channels").select("channel_id").eq("channel_name", channel_name))
             return response.data[0]["channel_id"] if response.data else False
+
+        try:
+            return await SupabaseDB.cache.get_or_load("channel_id", channel_name, load)
         except Exception as e:
             logging.error("\nError %s during fetching channel in DB: %s\n", e, channel_name)
             return False
@@ -383,7 +731,7 @@ class SupabaseDB:
         :raises: Logs an error if an exception occurs during the database operation.
         """
         try:
-            response = self.client.table("channels").select("*").in_("channel_name", channels).execute()
+            response = await self._execute(self.client.table("channels").select("*").in_("channel_name", channels))
             return [channel["channel_id"] for channel in response.data]
         except Exception as e:
             logging.error("\nError %s during fetching channels in DB: %s\n", e, channels)
@@ -395,9 +743,12 @@ class SupabaseDB:
         :param channel_id: The ID of the channel to retrieve.
         :return: The name of the channel if found, otherwise False.
         """
-        try:
-            response = self.client.table("channels").select("channel_name").eq("channel_id", channel_id).single().execute()
+        async def load():
+            response = await self._execute(self.client.table("channels").select("channel_name").eq("channel_id", channel_id).single())
             return response.data["channel_name"] if response.data else False
+
+        try:
+            return await SupabaseDB.cache.get_or_load("channel_name", channel_id, load)
         except Exception as e:
             logging.error("\nError %s during fetching channel by id: %s\n", e, channel_id)
             return False
@@ -423,15 +774,16 @@ class SupabaseDB:
         :return: The check interval in seconds if found, otherwise 3600 (1 hour).
         :raises: Logs an error if an exception occurs during the database operation.
         """  
-        try:
-            response = (
+        async def load():
+            response = await self._execute(
                 self.client.table("users")
                 .select("check_interval")
                 .eq("user_id", user_id)
-                .execute()
             )
-
             return response.data[0].get("check_interval", 3600) if response.data else 3600
+
+        try:
+            return await SupabaseDB.cache.get_or_load("interval", user_id, load)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
             return 3600
@@ -446,14 +798,171 @@ class SupabaseDB:
         :raises: Logs an error if an exception occurs during the database operation.
         """
         try:
-            response = (
+            response = await self._execute(
                 self.client.table("users")
                 .update({"check_interval": interval})
                 .eq("user_id", user_id)
-                .execute()
             )
+            SupabaseDB.cache.invalidate("interval", user_id)
+
+            return bool(response.data)
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return False
+
+    async def get_user_top_k(self, user_id: int) -> int | None:
+        """
+        Retrieve how many ranked stories of the user's digest are sent to the LLM.
+
+        :param user_id: The ID of the user.
+        :return: The user's K, or None if the user has not set it (the default applies).
+        """
+        async def load():
+            response = await self._execute(
+                self.client.table("users")
+                .select("top_k")
+                .eq("user_id", user_id)
+            )
+            return response.data[0].get("top_k") if response.data else None
+
+        try:
+            return await SupabaseDB.cache.get_or_load("top_k", user_id, load)
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return None
+
+    async def set_user_top_k(self, user_id: int, top_k: int | None) -> bool:
+        """
+        Set how many ranked stories of the user's digest are sent to the LLM.
+
+        :param user_id: The ID of the user.
+        :param top_k: Number of stories, None to return to the default.
+        :return: True if the operation was successful, otherwise False.
+        """
+        try:
+            response = await self._execute(
+                self.client.table("users")
+                .update({"top_k": top_k})
+                .eq("user_id", user_id)
+            )
+            SupabaseDB.cache.invalidate("top_k", user_id)
+            return bool(response.data)
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return False
+
+    # Состояние инкрементального дайджеста: что пользователь уже получил
+    async def fetch_digest_state(self, user_id: int) -> Dict[str, Any] | None:
+        """
+        Retrieve the state of the user's last digest run.
+
+        :param user_id: The ID of the user.
+        :return: A dictionary with keys "last_run_timestamp" (naive UTC datetime) and "topics"
+                 (list of {"topic", "emoji"} of the last digest), or None if there is no state yet.
+        """
+        try:
+            response = await self._execute(
+                self.client.table("user_digest_state")
+                .select("last_run_timestamp, topics")
+                .eq("user_id", user_id)
+            )
+            if not response.data:
+                return None
+            state = response.data[0]
+            return {
+                "last_run_timestamp": datetime.fromisoformat(state["last_run_timestamp"]).replace(tzinfo=None),
+                "topics": state.get("topics") or [],
+            }
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return None
+
+    async def save_digest_state(self, user_id: int, last_run_timestamp: str, topics: List[Dict[str, str]]) -> bool:
+        """
+        Save the state of the user's digest run.
+
+        :param user_id: The ID of the user.
+        :param last_run_timestamp: UTC timestamp up to which the posts were processed.
+        :param topics: Topics of the last delivered digest, as {"topic", "emoji"} dictionaries.
+        :return: True if the operation was successful, otherwise False.
+        """
+        try:
+            response = await self._execute(self.client.table("user_digest_state").upsert(
+                {
+                    "user_id": user_id,
+                    "last_run_timestamp": last_run_timestamp,
+                    "topics": topics,
+                },
+                on_conflict="user_id"
+            ))
+            return bool(response.data)
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return False
+
+    async def fetch_delivered_posts(self, user_id: int, since: str) -> Dict[tuple, str]:
+        """
+        Retrieve the posts delivered to the user since the given moment.
+
+        :param user_id: The ID of the user.
+        :param since: UTC timestamp, older deliveries are ignored.
+        :return: A dictionary mapping (channel_name, message_id) to the story id the post was delivered in.
+        """
+        try:
+            response = await self._execute(
+                self.client.table("delivered_posts")
+                .select("channel_name, message_id, story_id")
+                .eq("user_id", user_id)
+                .gte("delivery_timestamp", since)
+            )
+            return {(post["channel_name"], post["message_id"]): post["story_id"] for post in response.data}
+        except Exception as e:
+            SupabaseErrorHandler.handle_error(e, user_id, None)
+            return {}
 
+    async def save_delivered_posts(self, user_id: int, posts: List[Dict[str, Any]], delivery_timestamp: str) -> bool:
+        """
+        Record the posts delivered to the user with one request.
+
+        :param user_id: The ID of the user.
+        :param posts: Dictionaries with keys "channel", "message_id" and "story_id".
+        :param delivery_timestamp: UTC timestamp of the delivery.
+        :return: True if the operation was successful, otherwise False.
+        """
+        if not posts:
+            return True
+        try:
+            values = [
+                {
+                    "user_id": user_id,
+                    "channel_name": post["channel"],
+                    "message_id": post["message_id"],
+                    "story_id": post["story_id"],
+                    "delivery_timestamp": delivery_timestamp,
+                }
+                for post in posts
+            ]
+            response = await self._execute(self.client.table("delivered_posts").upsert(
+                values, on_conflict="user_id,channel_name,message_id"
+            ))
             return bool(response.data)
         except Exception as e:
             SupabaseErrorHandler.handle_error(e, user_id, None)
             return False
+
+
+def create_db(backend: str | None = None):
+    """
+    Creates the data layer configured with DB_BACKEND.
+
+    :param backend: "supabase" (PostgREST over HTTP) or "postgres" (asyncpg, see PostgresDB). Defaults to DB_BACKEND.
+    :return: SupabaseDB or PostgresDB, both have the same methods.
+    :raises ValueError: If the backend name is unknown.
+    """
+    backend = backend or DB_BACKEND
+    if backend == "supabase":
+        return SupabaseDB(supabase)
+    if backend == "postgres":
+        from src.data.postgres import PostgresDB  # asyncpg нужен только этому бэкенду
+        return PostgresDB()
+    raise ValueError(f"Unknown database backend: {backend}")
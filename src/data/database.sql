@@ -4,9 +4,12 @@ CREATE TABLE IF NOT EXISTS users (
     username varchar(255) NOT NULL,
     login_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP WITHOUT TIME ZONE,
     is_receiving_news boolean NOT NULL DEFAULT true,
-    check_interval int8 NOT NULL
+    check_interval int8 NOT NULL,
+    top_k int NULL                   -- сколько сюжетов отправлять в LLM, NULL - значение по умолчанию
 );
 
+ALTER TABLE users ADD COLUMN IF NOT EXISTS top_k int NULL;
+
 -- channels table
 CREATE TABLE IF NOT EXISTS channels (
     channel_id bigint NOT NULL PRIMARY KEY,
@@ -29,14 +32,78 @@ CREATE TABLE IF NOT EXISTS user_channels (
 CREATE TABLE IF NOT EXISTS channels_news (
     news_id bigint NOT NULL PRIMARY KEY,
     channel_id bigint NOT NULL REFERENCES channels(channel_id),
-    news varchar(255) NOT NULL,
+    message_id bigint NULL,
+    news text NOT NULL,
     addition_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP WITHOUT TIME ZONE
 );
 
+-- Пост канала хранится один раз: повторный скрапинг того же поста не создаёт дублей
+ALTER TABLE channels_news ADD COLUMN IF NOT EXISTS message_id bigint NULL;
+ALTER TABLE channels_news ALTER COLUMN news TYPE text;
+CREATE UNIQUE INDEX IF NOT EXISTS channels_news_channel_message_idx ON channels_news (channel_id, message_id);
+
 -- digests table
 CREATE TABLE IF NOT EXISTS digests (
     digest_id bigint NOT NULL PRIMARY KEY,
     user_id bigint NOT NULL REFERENCES users(user_id),
-    digest_content varchar(255) NOT NULL,
+    digest_content text NULL,        -- текст старых дайджестов, новые хранятся сжатыми
+    digest_compressed bytea NULL,    -- версия словаря + deflate со словарём (src/data/archive.py)
     creation_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP WITHOUT TIME ZONE
-);
\ No newline at end of file
+);
+
+ALTER TABLE digests ALTER COLUMN digest_content DROP NOT NULL;
+ALTER TABLE digests ALTER COLUMN digest_content TYPE text;
+ALTER TABLE digests ADD COLUMN IF NOT EXISTS digest_compressed bytea NULL;
+-- История дайджестов пользователя постранично: keyset по (creation_timestamp, digest_id)
+CREATE INDEX IF NOT EXISTS digests_user_history_idx ON digests (user_id, creation_timestamp DESC, digest_id DESC);
+
+-- delivered_posts table: posts already delivered to a user, so that consecutive digests don't repeat them
+CREATE TABLE IF NOT EXISTS delivered_posts (
+    user_id bigint NOT NULL REFERENCES users(user_id),
+    channel_name varchar(255) NOT NULL,
+    message_id bigint NOT NULL,
+    story_id varchar(255) NOT NULL,
+    delivery_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP WITHOUT TIME ZONE,
+    PRIMARY KEY (user_id, channel_name, message_id)
+);
+CREATE INDEX IF NOT EXISTS delivered_posts_user_timestamp_idx ON delivered_posts (user_id, delivery_timestamp);
+
+-- user_digest_state table: last processed moment and topic structure of the user's last digest
+CREATE TABLE IF NOT EXISTS user_digest_state (
+    user_id bigint NOT NULL PRIMARY KEY REFERENCES users(user_id),
+    last_run_timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    topics jsonb NOT NULL DEFAULT '[]'
+);
+
+-- Retention: старые строки удаляются пачками ограниченного размера по индексу на время,
+-- так что стоимость одного прохода не зависит от размера таблицы (см. src/data/retention.py)
+CREATE INDEX IF NOT EXISTS channels_news_addition_timestamp_idx ON channels_news (addition_timestamp);
+CREATE INDEX IF NOT EXISTS digests_creation_timestamp_idx ON digests (creation_timestamp);
+CREATE INDEX IF NOT EXISTS delivered_posts_delivery_timestamp_idx ON delivered_posts (delivery_timestamp);
+
+-- Deletes at most batch_size of the oldest rows older than cutoff; returns how many were deleted.
+-- Only the tables with a retention policy are accepted, the time column is fixed per table.
+CREATE OR REPLACE FUNCTION purge_expired(target text, cutoff timestamp, batch_size int DEFAULT 5000)
+RETURNS int
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    ts_column text;
+    deleted int;
+BEGIN
+    ts_column := CASE target
+        WHEN 'channels_news' THEN 'addition_timestamp'
+        WHEN 'digests' THEN 'creation_timestamp'
+        WHEN 'delivered_posts' THEN 'delivery_timestamp'
+    END;
+    IF ts_column IS NULL THEN
+        RAISE EXCEPTION 'purge_expired: no retention policy for table %', target;
+    END IF;
+    EXECUTE format(
+        'DELETE FROM %I WHERE ctid = ANY(ARRAY(SELECT ctid FROM %I WHERE %I < $1 ORDER BY %I LIMIT $2))',
+        target, target, ts_column, ts_column
+    ) USING cutoff, batch_size;
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    RETURN deleted;
+END
+$$;
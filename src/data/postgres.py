@@ -0,0 +1,624 @@
+import json
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Awaitable, Callable, Tuple
+
+import asyncpg
+
+from src.data.database import SupabaseDB, _as_topics
+from src.config.config import DATABASE_URL, DB_MAX_CONCURRENCY, DB_STATEMENT_CACHE_SIZE, DB_CACHE_TTLS
+from src.data.cache import ReadThroughCache
+from src.data.archive import compress_digest, decode_cursor, history_page
+
+# Горячие запросы: asyncpg готовит каждый один раз на соединение и дальше берёт из кэша prepared statements
+FETCH_USER_CHANNELS = """
+    SELECT c.channel_id, c.channel_name, c.channel_topic
+    FROM user_channels uc JOIN channels c ON c.channel_id = uc.channel_id
+    WHERE uc.user_id = $1 AND uc.is_active
+"""
+FETCH_USERS_CHANNELS = """
+    SELECT uc.user_id, c.channel_id, c.channel_name, c.channel_topic
+    FROM user_channels uc JOIN channels c ON c.channel_id = uc.channel_id
+    WHERE uc.user_id = ANY($1::bigint[]) AND uc.is_active
+"""
+FETCH_USER_INTERVAL = "SELECT check_interval FROM users WHERE user_id = $1"
+SET_USER_INTERVAL = "UPDATE users SET check_interval = $2 WHERE user_id = $1"
+INSERT_CHANNEL_NEWS = "INSERT INTO channels_news (channel_id, news, addition_timestamp) VALUES ($1, $2, $3)"
+INSERT_CHANNEL_NEWS_BATCH = """
+    INSERT INTO channels_news (channel_id, message_id, news, addition_timestamp) VALUES ($1, $2, $3, $4)
+    ON CONFLICT (channel_id, message_id) DO NOTHING
+"""
+
+FETCH_DIGEST_HISTORY = """
+    SELECT digest_id, creation_timestamp, digest_content, digest_compressed FROM digests
+    WHERE user_id = $1
+    ORDER BY creation_timestamp DESC, digest_id DESC LIMIT $2
+"""
+FETCH_DIGEST_HISTORY_BEFORE = """
+    SELECT digest_id, creation_timestamp, digest_content, digest_compressed FROM digests
+    WHERE user_id = $1 AND (creation_timestamp, digest_id) < ($3, $4)
+    ORDER BY creation_timestamp DESC, digest_id DESC LIMIT $2
+"""
+
+# С какого размера пачки записываем через COPY, а не executemany
+COPY_THRESHOLD = 500
+
+
+@dataclass
+class QueryResult:
+    """Rows in the shape of a PostgREST response, for methods whose callers read `.data`."""
+    data: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def _timestamp(value: Any) -> datetime | None:
+    """Converts an ISO string or datetime to naive UTC, as stored in TIMESTAMP WITHOUT TIME ZONE columns."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _affected(status: str) -> int:
+    """Number of rows from a command status such as "UPDATE 3"."""
+    try:
+        return int(status.split()[-1])
+    except (ValueError, IndexError):
+        return 0
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+class PostgresDB:
+    """
+    Direct Postgres backend with the method surface of SupabaseDB (DB_BACKEND=postgres).
+
+    Talks to the database over asyncpg instead of PostgREST: one connection pool per process (at most
+    DB_MAX_CONCURRENCY connections), statements are prepared once per connection, bulk writes use
+    executemany, or COPY into a temporary table for large batches. Rarely changing rows are cached
+    in memory the same way as in SupabaseDB.
+
+    Every public method implements the SupabaseDB method of the same name: parameters, return values
+    and the fallback value returned on errors are the same and documented there. Docstrings here only
+    describe what the Postgres version does differently.
+    """
+
+    _pool: asyncpg.Pool | None = None
+    _pool_lock = asyncio.Lock()
+    cache = ReadThroughCache(DB_CACHE_TTLS)
+
+    def __init__(self, dsn: str | None = None):
+        self.dsn = dsn or DATABASE_URL
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        # Пул создаётся лениво: ему нужен запущенный event loop
+        if PostgresDB._pool is None:
+            async with PostgresDB._pool_lock:
+                if PostgresDB._pool is None:
+                    PostgresDB._pool = await asyncpg.create_pool(
+                        self.dsn,
+                        min_size=1,
+                        max_size=DB_MAX_CONCURRENCY,
+                        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                        init=_init_connection,
+                    )
+        return PostgresDB._pool
+
+    @classmethod
+    async def close(cls) -> None:
+        """Closes the connection pool, e.g. on shutdown."""
+        if cls._pool is not None:
+            await cls._pool.close()
+            cls._pool = None
+
+    async def _fetch(self, query: str, *args) -> List[asyncpg.Record]:
+        pool = await self._get_pool()
+        return await pool.fetch(query, *args)
+
+    async def _fetchval(self, query: str, *args) -> Any:
+        pool = await self._get_pool()
+        return await pool.fetchval(query, *args)
+
+    async def _execute(self, query: str, *args) -> str:
+        pool = await self._get_pool()
+        return await pool.execute(query, *args)
+
+    async def _executemany(self, query: str, args: List[tuple]) -> None:
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.executemany(query, args)
+
+    async def _copy_upsert(self, table: str, columns: List[str], records: List[tuple], conflict: str) -> None:
+        """
+        Writes a large batch with COPY into a temporary table and one INSERT ... ON CONFLICT from it.
+
+        :param table: Target table.
+        :param columns: Columns of the records.
+        :param records: Rows to write.
+        :param conflict: The ON CONFLICT clause, e.g. "(user_id) DO NOTHING".
+        """
+        pool = await self._get_pool()
+        column_list = ", ".join(columns)
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Только нужные колонки и без ограничений таблицы: ключи и NOT NULL проверит INSERT
+                await conn.execute(
+                    f"CREATE TEMP TABLE tmp_{table} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA"
+                )
+                await conn.copy_records_to_table(f"tmp_{table}", records=records, columns=columns)
+                await conn.execute(
+                    f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM tmp_{table} ON CONFLICT {conflict}"
+                )
+
+    async def fetch_user(self, user_id: int) -> int:
+        try:
+            return await PostgresDB.cache.get_or_load(
+                "user", user_id, lambda: self._fetchval("SELECT user_id FROM users WHERE user_id = $1", user_id)
+            )
+        except Exception as e:
+            logging.error("Error during fetching user %s: %s", user_id, e)
+
+    async def add_user(
+        self, user_id: int, username: str, login_timestamp: str = None, check_interval: int = 3600,
+        is_receiving_news: bool = False
+    ) -> None:
+        try:
+            await self._execute(
+                """
+                INSERT INTO users (user_id, username, login_timestamp, check_interval, is_receiving_news)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = EXCLUDED.username,
+                    login_timestamp = EXCLUDED.login_timestamp,
+                    check_interval = EXCLUDED.check_interval,
+                    is_receiving_news = EXCLUDED.is_receiving_news
+                """,
+                user_id, username, _timestamp(login_timestamp), check_interval, is_receiving_news,
+            )
+            PostgresDB.cache.invalidate("user", user_id)
+            PostgresDB.cache.invalidate("interval", user_id)
+        except Exception as e:
+            logging.error("Error during adding user %s: %s", user_id, e)
+
+    async def set_user_receiving_news(self, user_id: int, is_receiving: bool) -> bool:
+        try:
+            status = await self._execute(
+                "UPDATE users SET is_receiving_news = $2 WHERE user_id = $1", user_id, is_receiving
+            )
+            return _affected(status) > 0
+        except Exception as e:
+            logging.error("Error during updating user %s: %s", user_id, e)
+            return False
+
+    async def set_users_receiving_news(self, user_ids: List[int], is_receiving: bool) -> bool:
+        if not user_ids:
+            return True
+        try:
+            await self._execute(
+                "UPDATE users SET is_receiving_news = $2 WHERE user_id = ANY($1::bigint[])", user_ids, is_receiving
+            )
+            return True
+        except Exception as e:
+            logging.error("Error during updating %s users: %s", len(user_ids), e)
+            return False
+
+    async def retrieve_current_users(self) -> QueryResult:
+        try:
+            rows = await self._fetch("SELECT user_id FROM users WHERE is_receiving_news")
+            return QueryResult([dict(row) for row in rows])
+        except Exception as e:
+            logging.error("Error during fetching current users: %s", e)
+
+    @staticmethod
+    def _channel(row: asyncpg.Record) -> Dict[str, Any]:
+        return {
+            "channel_name": row["channel_name"],
+            "channel_id": row["channel_id"],
+            "channel_topic": _as_topics(row["channel_topic"]),
+        }
+
+    async def fetch_user_channels(self, user_id: int) -> List[Dict[str, Any]]:
+        async def load():
+            return [self._channel(row) for row in await self._fetch(FETCH_USER_CHANNELS, user_id)]
+
+        try:
+            return list(await PostgresDB.cache.get_or_load("user_channels", user_id, load))
+        except Exception as e:
+            logging.error("Error during fetching channels of user %s: %s", user_id, e)
+
+    async def fetch_users_channels(self, user_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        if not user_ids:
+            return {}
+        try:
+            channels = {user_id: [] for user_id in user_ids}
+            generations = {user_id: PostgresDB.cache.generation("user_channels", user_id) for user_id in user_ids}
+            for row in await self._fetch(FETCH_USERS_CHANNELS, user_ids):
+                channels.setdefault(row["user_id"], []).append(self._channel(row))
+            for user_id, user_channels in channels.items():
+                PostgresDB.cache.put("user_channels", user_id, user_channels, generations[user_id])
+            return channels
+        except Exception as e:
+            logging.error("Error during fetching channels of users: %s", e)
+            return {}
+
+    async def add_channels(self, channels: List[str], channel_topics: List[str], addition_timestamp: str = None) -> bool:
+        try:
+            values = [
+                (
+                    await self.generate_channel_hash(channel),
+                    channel,
+                    channel_topics[index] if channel_topics else None,
+                    f"https://t.me/{channel[1:]}",
+                    _timestamp(addition_timestamp),
+                )
+                for index, channel in enumerate(channels)
+            ]
+            await self._executemany(
+                """
+                INSERT INTO channels (channel_id, channel_name, channel_topic, channel_link, addition_timestamp)
+                VALUES ($1, $2, $3, $4, $5)
+                """,
+                values,
+            )
+            PostgresDB.cache.invalidate("channel_id", *channels)
+            return bool(values)
+        except Exception as e:
+            logging.error("Error during adding channels %s : %s", channels, e)
+            return False
+
+    async def add_single_channel(self, channel_name: str, channel_topic: str, addition_timestamp: str = None) -> bool:
+        return await self.add_channels([channel_name], [channel_topic], addition_timestamp)
+
+    async def ensure_user_channels(
+        self,
+        user_id: int,
+        channels: List[str],
+        detect_topics: Callable[[List[str]], Awaitable[Dict[str, List[str]]]] | None = None,
+        addition_timestamp: str = None,
+    ) -> Dict[str, int]:
+        """See SupabaseDB.ensure_user_channels. New channels and the links are written in one transaction."""
+        channels = list(dict.fromkeys(channels))
+        if not channels:
+            return {}
+        try:
+            rows = await self._fetch(
+                "SELECT channel_id, channel_name FROM channels WHERE channel_name = ANY($1::varchar[])", channels
+            )
+            channel_ids = {row["channel_name"]: row["channel_id"] for row in rows}
+            new_channels = [channel for channel in channels if channel not in channel_ids]
+            # Темы определяются до транзакции: это запросы к Telegram и LLM, соединение не держим
+            topics = await detect_topics(new_channels) if new_channels and detect_topics else {}
+            for channel in new_channels:
+                channel_ids[channel] = await self.generate_channel_hash(channel)
+
+            added_at = _timestamp(addition_timestamp)
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    if new_channels:
+                        await conn.executemany(
+                            """
+                            INSERT INTO channels (channel_id, channel_name, channel_topic, channel_link, addition_timestamp)
+                            VALUES ($1, $2, $3, $4, $5) ON CONFLICT (channel_id) DO NOTHING
+                            """,
+                            [
+                                (channel_ids[channel], channel, topics.get(channel), f"https://t.me/{channel[1:]}", added_at)
+                                for channel in new_channels
+                            ],
+                        )
+                    await conn.executemany(
+                        """
+                        INSERT INTO user_channels (user_id, channel_id, addition_timestamp, is_active)
+                        VALUES ($1, $2, $3, true)
+                        ON CONFLICT (channel_id, user_id) DO UPDATE SET
+                            addition_timestamp = EXCLUDED.addition_timestamp,
+                            is_active = true
+                        """,
+                        [(user_id, channel_ids[channel], added_at) for channel in channels],
+                    )
+
+            PostgresDB.cache.invalidate("user_channels", user_id)
+            for channel, channel_id in channel_ids.items():
+                PostgresDB.cache.put("channel_id", channel, channel_id)
+            return channel_ids
+        except Exception as e:
+            logging.error("Error during adding channels of user %s: %s", user_id, e)
+            return {}
+
+    async def link_user_channels(self, user_id: int, channel_ids: List[int], addition_timestamp: str = None) -> bool:
+        try:
+            await self._executemany(
+                """
+                INSERT INTO user_channels (user_id, channel_id, addition_timestamp, is_active)
+                VALUES ($1, $2, $3, true)
+                """,
+                [(user_id, channel_id, _timestamp(addition_timestamp)) for channel_id in channel_ids],
+            )
+            PostgresDB.cache.invalidate("user_channels", user_id)
+            return bool(channel_ids)
+        except Exception as e:
+            logging.error("Error during linking channels of user %s: %s", user_id, e)
+            return False
+
+    async def link_user_single_channel(self, user_id: int, channel_id: int, addition_timestamp: str = None) -> bool:
+        try:
+            status = await self._execute(
+                """
+                INSERT INTO user_channels (user_id, channel_id, addition_timestamp, is_active)
+                VALUES ($1, $2, $3, true)
+                ON CONFLICT (channel_id, user_id) DO UPDATE SET
+                    addition_timestamp = EXCLUDED.addition_timestamp,
+                    is_active = true
+                """,
+                user_id, channel_id, _timestamp(addition_timestamp),
+            )
+            PostgresDB.cache.invalidate("user_channels", user_id)
+            return _affected(status) > 0
+        except Exception as e:
+            logging.error("Error during linking channel %s to user %s: %s", channel_id, user_id, e)
+            return False
+
+    async def delete_user_channels(self, user_id: int, channels: List[str]) -> bool:
+        try:
+            status = await self._execute(
+                """
+                UPDATE user_channels uc SET is_active = false
+                FROM channels c
+                WHERE c.channel_id = uc.channel_id AND uc.user_id = $1 AND c.channel_name = ANY($2::varchar[])
+                """,
+                user_id, channels,
+            )
+            PostgresDB.cache.invalidate("user_channels", user_id)
+            return _affected(status) > 0
+        except Exception as e:
+            logging.error("Error during deleting channels of user %s: %s", user_id, e)
+            return False
+
+    async def deactivate_channels(self, channels: List[str], user_ids: List[int] | None = None) -> int:
+        try:
+            rows = await self._fetch(
+                """
+                UPDATE user_channels uc SET is_active = false
+                FROM channels c
+                WHERE c.channel_id = uc.channel_id AND c.channel_name = ANY($1::varchar[]) AND uc.is_active
+                  AND ($2::bigint[] IS NULL OR uc.user_id = ANY($2::bigint[]))
+                RETURNING uc.user_id
+                """,
+                channels, user_ids,
+            )
+            affected_users = {row["user_id"] for row in rows}
+            if affected_users:
+                PostgresDB.cache.invalidate("user_channels", *affected_users)
+            logging.info("Деактивированы каналы %s у %s пользователей", channels, len(affected_users))
+            return len(rows)
+        except Exception as e:
+            logging.error("Error during deactivating channels %s: %s", channels, e)
+            return -1
+
+    async def clear_user_channels(self, user_id: int) -> bool:
+        try:
+            status = await self._execute("UPDATE user_channels SET is_active = false WHERE user_id = $1", user_id)
+            PostgresDB.cache.invalidate("user_channels", user_id)
+            return _affected(status) > 0
+        except Exception as e:
+            logging.error("Error during clearing channels of user %s: %s", user_id, e)
+            return False
+
+    async def save_channel_news(self, channel_id: int, news: str, addition_timestamp: str) -> bool:
+        try:
+            await self._execute(INSERT_CHANNEL_NEWS, channel_id, news, _timestamp(addition_timestamp))
+            return True
+        except Exception as e:
+            logging.error("Error during saving news of channel %s: %s", channel_id, e)
+            return False
+
+    async def save_channel_news_batch(self, channel_id: int, news: List[Dict[str, Any]]) -> bool:
+        """See SupabaseDB.save_channel_news_batch. Batches of COPY_THRESHOLD posts and more are written with COPY."""
+        if not news:
+            return True
+        try:
+            records = list({
+                msg["message_id"]: (channel_id, msg["message_id"], msg["message"], _timestamp(msg["message_date"]))
+                for msg in news
+            }.values())
+            if len(records) >= COPY_THRESHOLD:
+                await self._copy_upsert(
+                    "channels_news", ["channel_id", "message_id", "news", "addition_timestamp"], records,
+                    "(channel_id, message_id) DO NOTHING",
+                )
+            else:
+                await self._executemany(INSERT_CHANNEL_NEWS_BATCH, records)
+            return True
+        except Exception as e:
+            logging.error("Error during saving news of channel %s: %s", channel_id, e)
+            return False
+
+    async def purge_expired(self, table: str, cutoff: datetime, batch_size: int = 5000) -> int:
+        try:
+            return await self._fetchval("SELECT purge_expired($1, $2, $3)", table, _timestamp(cutoff), batch_size)
+        except Exception as e:
+            logging.error("Ошибка при очистке таблицы %s: %s", table, e)
+            return -1
+
+    async def save_user_digest(self, user_id: int, digest_content: str, creation_timestamp: str) -> bool:
+        try:
+            await self._execute(
+                "INSERT INTO digests (user_id, digest_compressed, creation_timestamp) VALUES ($1, $2, $3)",
+                user_id, compress_digest(digest_content), _timestamp(creation_timestamp),
+            )
+            return True
+        except Exception as e:
+            logging.error("Error during saving digest of user %s: %s", user_id, e)
+            return False
+
+    async def save_user_digests(self, digests: List[Dict[str, Any]]) -> bool:
+        if not digests:
+            return True
+        try:
+            await self._executemany(
+                "INSERT INTO digests (user_id, digest_compressed, creation_timestamp) VALUES ($1, $2, $3)",
+                [
+                    (digest["user_id"], compress_digest(digest["digest_content"]), _timestamp(digest["creation_timestamp"]))
+                    for digest in digests
+                ],
+            )
+            return True
+        except Exception as e:
+            logging.error("Error during saving %s digests: %s", len(digests), e)
+            return False
+
+    async def fetch_digest_history(
+        self, user_id: int, limit: int = 5, before: str | None = None
+    ) -> Tuple[List[Dict[str, Any]], str | None]:
+        try:
+            if before:
+                timestamp, digest_id = decode_cursor(before)
+                rows = await self._fetch(FETCH_DIGEST_HISTORY_BEFORE, user_id, limit + 1, timestamp, digest_id)
+            else:
+                rows = await self._fetch(FETCH_DIGEST_HISTORY, user_id, limit + 1)
+            return history_page([dict(row) for row in rows], limit)
+        except Exception as e:
+            logging.error("Error during fetching digest history of user %s: %s", user_id, e)
+            return [], None
+
+    async def fetch_channel_id(self, channel_name: str) -> int:
+        try:
+            channel_id = await PostgresDB.cache.get_or_load(
+                "channel_id", channel_name,
+                lambda: self._fetchval("SELECT channel_id FROM channels WHERE channel_name = $1", channel_name),
+            )
+            return channel_id if channel_id is not None else False
+        except Exception as e:
+            logging.error("\nError %s during fetching channel in DB: %s\n", e, channel_name)
+            return False
+
+    async def fetch_channel_ids(self, channels: List[str]) -> List[int]:
+        try:
+            rows = await self._fetch("SELECT channel_id FROM channels WHERE channel_name = ANY($1::varchar[])", channels)
+            return [row["channel_id"] for row in rows]
+        except Exception as e:
+            logging.error("\nError %s during fetching channels in DB: %s\n", e, channels)
+
+    async def fetch_channel_name(self, channel_id: int) -> str:
+        try:
+            channel_name = await PostgresDB.cache.get_or_load(
+                "channel_name", channel_id,
+                lambda: self._fetchval("SELECT channel_name FROM channels WHERE channel_id = $1", channel_id),
+            )
+            return channel_name or False
+        except Exception as e:
+            logging.error("\nError %s during fetching channel by id: %s\n", e, channel_id)
+            return False
+
+    generate_channel_hash = staticmethod(SupabaseDB.generate_channel_hash)
+
+    async def get_user_interval(self, user_id: int) -> int:
+        try:
+            interval = await PostgresDB.cache.get_or_load(
+                "interval", user_id, lambda: self._fetchval(FETCH_USER_INTERVAL, user_id)
+            )
+            return interval if interval is not None else 3600
+        except Exception as e:
+            logging.error("Error during fetching interval of user %s: %s", user_id, e)
+            return 3600
+
+    async def set_user_interval(self, user_id: int, interval: int) -> bool:
+        try:
+            status = await self._execute(SET_USER_INTERVAL, user_id, interval)
+            PostgresDB.cache.invalidate("interval", user_id)
+            return _affected(status) > 0
+        except Exception as e:
+            logging.error("Error during setting interval of user %s: %s", user_id, e)
+            return False
+
+    async def get_user_top_k(self, user_id: int) -> int | None:
+        try:
+            return await PostgresDB.cache.get_or_load(
+                "top_k", user_id, lambda: self._fetchval("SELECT top_k FROM users WHERE user_id = $1", user_id)
+            )
+        except Exception as e:
+            logging.error("Error during fetching top_k of user %s: %s", user_id, e)
+            return None
+
+    async def set_user_top_k(self, user_id: int, top_k: int | None) -> bool:
+        try:
+            status = await self._execute("UPDATE users SET top_k = $2 WHERE user_id = $1", user_id, top_k)
+            PostgresDB.cache.invalidate("top_k", user_id)
+            return _affected(status) > 0
+        except Exception as e:
+            logging.error("Error during setting top_k of user %s: %s", user_id, e)
+            return False
+
+    async def fetch_digest_state(self, user_id: int) -> Dict[str, Any] | None:
+        try:
+            rows = await self._fetch(
+                "SELECT last_run_timestamp, topics FROM user_digest_state WHERE user_id = $1", user_id
+            )
+            if not rows:
+                return None
+            return {"last_run_timestamp": rows[0]["last_run_timestamp"], "topics": rows[0]["topics"] or []}
+        except Exception as e:
+            logging.error("Error during fetching digest state of user %s: %s", user_id, e)
+            return None
+
+    async def save_digest_state(self, user_id: int, last_run_timestamp: str, topics: List[Dict[str, str]]) -> bool:
+        try:
+            await self._execute(
+                """
+                INSERT INTO user_digest_state (user_id, last_run_timestamp, topics) VALUES ($1, $2, $3)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    last_run_timestamp = EXCLUDED.last_run_timestamp,
+                    topics = EXCLUDED.topics
+                """,
+                user_id, _timestamp(last_run_timestamp), topics,
+            )
+            return True
+        except Exception as e:
+            logging.error("Error during saving digest state of user %s: %s", user_id, e)
+            return False
+
+    async def fetch_delivered_posts(self, user_id: int, since: str) -> Dict[tuple, str]:
+        try:
+            rows = await self._fetch(
+                """
+                SELECT channel_name, message_id, story_id FROM delivered_posts
+                WHERE user_id = $1 AND delivery_timestamp >= $2
+                """,
+                user_id, _timestamp(since),
+            )
+            return {(row["channel_name"], row["message_id"]): row["story_id"] for row in rows}
+        except Exception as e:
+            logging.error("Error during fetching delivered posts of user %s: %s", user_id, e)
+            return {}
+
+    async def save_delivered_posts(self, user_id: int, posts: List[Dict[str, Any]], delivery_timestamp: str) -> bool:
+        """See SupabaseDB.save_delivered_posts. Batches of COPY_THRESHOLD posts and more are written with COPY."""
+        if not posts:
+            return True
+        try:
+            delivered_at = _timestamp(delivery_timestamp)
+            # Внутри одной пачки ключ должен быть уникальным, иначе ON CONFLICT DO UPDATE падает
+            records = list({
+                (post["channel"], post["message_id"]): (user_id, post["channel"], post["message_id"], post["story_id"], delivered_at)
+                for post in posts
+            }.values())
+            columns = ["user_id", "channel_name", "message_id", "story_id", "delivery_timestamp"]
+            conflict = ("(user_id, channel_name, message_id) DO UPDATE SET "
+                        "story_id = EXCLUDED.story_id, delivery_timestamp = EXCLUDED.delivery_timestamp")
+            if len(records) >= COPY_THRESHOLD:
+                await self._copy_upsert("delivered_posts", columns, records, conflict)
+            else:
+                await self._executemany(
+                    f"INSERT INTO delivered_posts ({', '.join(columns)}) VALUES ($1, $2, $3, $4, $5) ON CONFLICT {conflict}",
+                    records,
+                )
+            return True
+        except Exception as e:
+            logging.error("Error during saving delivered posts of user %s: %s", user_id, e)
+            return False
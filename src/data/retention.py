@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict
+
+
+async def enforce_retention(
+    db,
+    retention_days: Dict[str, int],
+    batch_size: int = 5000,
+    max_batches: int = 20,
+    pause: float = 0.1,
+) -> Dict[str, int]:
+    """
+    Deletes rows older than their table's retention, in bounded batches.
+
+    Every batch is one `purge_expired` call that removes at most `batch_size` of the oldest expired rows
+    using the index on the table's time column, and a table gets at most `max_batches` of them per run.
+    So a run costs the same however large the tables are; a backlog (e.g. after the policy is first
+    enabled) is worked off by the following runs.
+
+    :param db: SupabaseDB or PostgresDB.
+    :param retention_days: Table -> how many days its rows are kept (see DB_RETENTION_DAYS).
+    :param batch_size: Rows deleted by one request.
+    :param max_batches: Requests per table per run.
+    :param pause: Pause in seconds between batches, so deletes don't crowd out inserts.
+    :return: Table -> number of deleted rows.
+    """
+    deleted: Dict[str, int] = {}
+    for table, days in retention_days.items():
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        deleted[table] = 0
+        for _ in range(max_batches):
+            count = await db.purge_expired(table, cutoff, batch_size)
+            if count < 0:  # ошибка уже в логе, попробуем в следующий запуск
+                break
+            deleted[table] += count
+            if count < batch_size:
+                break
+            await asyncio.sleep(pause)
+    return deleted
+
+
+async def retention_loop(db, retention_days: Dict[str, int], interval: float, **kwargs) -> None:
+    """Runs enforce_retention every `interval` seconds, e.g. as one background task of the bot."""
+    while True:
+        deleted = await enforce_retention(db, retention_days, **kwargs)
+        logging.info("Очистка устаревших строк: %s", deleted)
+        await asyncio.sleep(interval)
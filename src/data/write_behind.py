@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from typing import Any, Dict, Hashable, List
+
+
+class WriteBehindBuffer:
+    """
+    Write-behind queue for the writes nobody waits for: the digest archive, scraped posts and the
+    "receiving news" flag set by the scraper itself (explicit commands of the user are written directly).
+
+    It has the same write methods as the database (save_user_digest, save_channel_news_batch,
+    set_user_receiving_news), but they only enqueue and return at once, so digest delivery never waits
+    on them. Pending writes are coalesced - posts by (channel, message_id), the flag by user with the
+    last value winning - and flushed with bulk requests every `flush_interval` seconds or as soon as
+    `max_batch` writes are pending. A batch that fails is kept and retried by the next flushes, up to
+    `max_retries` times, then dropped with an error in the log. At most `max_pending` writes of all kinds
+    are kept (e.g. while the database is down): beyond that the oldest ones are dropped, posts first, and
+    counted in stats["overflow"]. drain() writes out what is left on shutdown.
+    """
+
+    def __init__(
+        self,
+        db,
+        max_batch: int = 100,
+        flush_interval: float = 5.0,
+        max_retries: int = 5,
+        max_pending: int = 10000,
+        retry_delay: float = 1.0,
+    ) -> None:
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.stats = {"enqueued": 0, "coalesced": 0, "flushed": 0, "failed": 0, "dropped": 0, "overflow": 0}
+        self._digests: List[Dict[str, Any]] = []
+        self._news: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        self._receiving: Dict[int, bool] = {}
+        self._attempts: Dict[Hashable, int] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._flush_lock: asyncio.Lock | None = None
+        self._stopping = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._digests) + sum(len(posts) for posts in self._news.values()) + len(self._receiving)
+
+    async def save_user_digest(self, user_id: int, digest_content: str, creation_timestamp: str) -> bool:
+        """Queues a digest for the archive; returns True right away."""
+        self._digests.append(
+            {"user_id": user_id, "digest_content": digest_content, "creation_timestamp": creation_timestamp}
+        )
+        self._enqueued(1)
+        return True
+
+    async def save_channel_news_batch(self, channel_id: int, news: List[Dict[str, Any]]) -> bool:
+        """Queues scraped posts of a channel; a post that is already queued is written once."""
+        posts = self._news.setdefault(channel_id, {})
+        for msg in news:
+            if msg["message_id"] in posts:
+                self.stats["coalesced"] += 1
+            posts[msg["message_id"]] = msg
+        if not posts:
+            del self._news[channel_id]
+        self._enqueued(len(news))
+        return True
+
+    async def set_user_receiving_news(self, user_id: int, is_receiving: bool) -> bool:
+        """Queues the flag of a user; of several pending values only the last one is written."""
+        if user_id in self._receiving:
+            self.stats["coalesced"] += 1
+        self._receiving[user_id] = is_receiving
+        self._enqueued(1)
+        return True
+
+    def discard_receiving_news(self, user_id: int) -> None:
+        """Drops a pending flag of a user, e.g. before the user's own command is written directly."""
+        self._receiving.pop(user_id, None)
+
+    def _enqueued(self, count: int) -> None:
+        self.stats["enqueued"] += count
+        self._trim()
+        self._ensure_running()
+        if self.pending >= self.max_batch:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        """
+        Drops the oldest pending writes beyond `max_pending`: scraped posts first (they are only an archive
+        of what Telegram keeps anyway), then digests, then the flags.
+        """
+        overflow = self.pending - self.max_pending
+        if overflow <= 0:
+            return
+        self.stats["overflow"] += overflow
+        logging.warning("Очередь отложенных записей переполнена, %s самых старых записей не будут сохранены", overflow)
+        # Словари хранят порядок вставки: первые элементы - самые старые
+        while overflow and self._news:
+            channel_id = next(iter(self._news))
+            posts = self._news[channel_id]
+            while overflow and posts:
+                del posts[next(iter(posts))]
+                overflow -= 1
+            if not posts:
+                del self._news[channel_id]
+        while overflow and self._digests:
+            self._digests.pop(0)
+            overflow -= 1
+        while overflow and self._receiving:
+            del self._receiving[next(iter(self._receiving))]
+            overflow -= 1
+
+    def _ensure_running(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        # Событие и блокировка создаются в текущем event loop, а не при импорте
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error("Ошибка при записи отложенных изменений в БД: %s", e)
+
+    def _failed(self, key: Hashable, count: int) -> bool:
+        """Counts a failed attempt of a batch; returns True if the batch should be retried."""
+        self.stats["failed"] += 1
+        self._attempts[key] = self._attempts.get(key, 0) + 1
+        if self._attempts[key] <= self.max_retries:
+            return True
+        del self._attempts[key]
+        self.stats["dropped"] += count
+        logging.error("Не удалось записать %s (%s записей) после %s попыток", key, count, self.max_retries + 1)
+        return False
+
+    def _succeeded(self, key: Hashable, count: int) -> None:
+        self._attempts.pop(key, None)
+        self.stats["flushed"] += count
+
+    async def flush(self) -> None:
+        """Writes everything that is pending with one request per kind (per channel for posts)."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            # Забираем накопленное: новые записи во время flush попадают уже в следующую пачку
+            digests, self._digests = self._digests, []
+            news, self._news = self._news, {}
+            receiving, self._receiving = self._receiving, {}
+
+            if digests:
+                if await self.db.save_user_digests(digests):
+                    self._succeeded("digests", len(digests))
+                elif self._failed("digests", len(digests)):
+                    self._digests[:0] = digests
+
+            for channel_id, posts in news.items():
+                key = ("channels_news", channel_id)
+                if await self.db.save_channel_news_batch(channel_id, list(posts.values())):
+                    self._succeeded(key, len(posts))
+                elif self._failed(key, len(posts)):
+                    # Посты, поставленные в очередь во время flush, новее - они и остаются
+                    self._news[channel_id] = {**posts, **self._news.get(channel_id, {})}
+
+            for is_receiving in (False, True):
+                user_ids = [user_id for user_id, value in receiving.items() if value == is_receiving]
+                if not user_ids:
+                    continue
+                key = ("is_receiving_news", is_receiving)
+                if await self.db.set_users_receiving_news(user_ids, is_receiving):
+                    self._succeeded(key, len(user_ids))
+                elif self._failed(key, len(user_ids)):
+                    for user_id in user_ids:
+                        self._receiving.setdefault(user_id, is_receiving)
+            # Повторно поставленные в очередь пачки тоже подчиняются лимиту
+            self._trim()
+
+    async def drain(self) -> None:
+        """Stops the background flushes and writes out everything that is pending, e.g. on shutdown."""
+        if self._task is not None and not self._task.done():
+            # Не отменяем задачу: отмена посреди flush потеряла бы уже забранную пачку
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._stopping = False
+        self._task = None
+        # Каждая неудачная попытка приближает пачку к лимиту повторов, так что цикл конечен
+        while self.pending:
+            await self.flush()
+            if self.pending:
+                await asyncio.sleep(self.retry_delay)
+        logging.info("Отложенные записи в БД: %s", self.stats)
@@ -0,0 +1,95 @@
+import logging
+from typing import List, Dict, Any, Hashable
+import numpy as np
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import TfidfVectorizer
+from src.utils.text import preprocess
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.5
+
+
+def _source(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "channel": item["channel"],
+        "message_id": item["message_id"],
+        "channel_title": item.get("channel_title", item["channel"]),
+    }
+
+
+def find_duplicate_groups(texts: List[str], threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> np.ndarray:
+    """
+    Groups near-duplicate texts using TF-IDF cosine similarity.
+
+    Rows of the TF-IDF matrix are L2-normalized, so one sparse product gives all pairwise
+    cosine similarities. Pairs above the threshold are treated as graph edges and every
+    connected component becomes one group.
+
+    :param texts: Normalized texts (see src.utils.text.preprocess).
+    :param threshold: Minimal cosine similarity for two texts to be considered the same story.
+    :returns: An array of group labels, one per text. Empty texts always get their own group.
+    """
+    labels = np.arange(len(texts))
+    non_empty = [index for index, text in enumerate(texts) if text]
+    if len(non_empty) < 2:
+        return labels
+
+    try:
+        matrix = TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True).fit_transform(
+            [texts[index] for index in non_empty]
+        )
+    except ValueError:
+        # Пустой словарь - сравнивать нечего
+        return labels
+
+    similarity = (matrix @ matrix.T).tocsr()
+    similarity.data[similarity.data < threshold] = 0
+    similarity.eliminate_zeros()
+
+    _, components = connected_components(similarity, directed=False)
+    labels[non_empty] = len(texts) + components
+    return labels
+
+
+def merge_groups(news: List[Dict[str, Any]], labels: List[Hashable]) -> List[Dict[str, Any]]:
+    """
+    Collapses posts with the same label into one representative.
+
+    The representative is the longest post, as it usually carries the most details. The links to
+    all posts of the group (including sources merged earlier) are kept in the 'sources' key.
+
+    :param news: A list of dictionaries with keys 'channel', 'message', 'message_id', 'channel_title'.
+    :param labels: Group label of every post.
+    :returns: A list of representative posts in the original order, each with a 'sources' list.
+    """
+    groups: Dict[Hashable, List[Dict[str, Any]]] = {}
+    for item, label in zip(news, labels):
+        groups.setdefault(label, []).append(item)
+
+    merged = []
+    for group in groups.values():
+        representative = max(group, key=lambda item: len(item["message"] or ""))
+        sources = [source for item in group for source in item.get("sources") or [_source(item)]]
+        merged.append({**representative, "sources": sources})
+    return merged
+
+
+def deduplicate_news(
+    news: List[Dict[str, Any]], threshold: float = DEFAULT_SIMILARITY_THRESHOLD
+) -> List[Dict[str, Any]]:
+    """
+    Merges near-duplicate posts (usually the same story reposted by several channels).
+
+    :param news: A list of dictionaries with keys 'channel', 'message', 'message_id', 'channel_title'.
+    :param threshold: Minimal cosine similarity for two posts to be merged.
+    :returns: A list of representative posts in the original order, each with a 'sources' list.
+    """
+    if not news:
+        return []
+
+    labels = find_duplicate_groups([preprocess(item["message"] or "") for item in news], threshold)
+    deduplicated = merge_groups(news, labels.tolist())
+
+    if len(deduplicated) < len(news):
+        logging.info("Dedup: %s posts merged into %s stories", len(news), len(deduplicated))
+    return deduplicated
+
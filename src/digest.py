@@ -0,0 +1,273 @@
+import re
+import json
+import html
+from typing import List, Dict, Any
+
+SOURCE_PREFIX = "<i>Источник: </i>"
+FALLBACK_TOPIC = {"topic": "Разное", "emoji": "📰"}
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+def parse_summary_items(summaries_text: str) -> List[Dict[str, Any]]:
+    """
+    Splits the output of the summarization stage into separate items.
+
+    Every summary line is followed by a line with links to the original posts
+    (starting with '<i>Источник: </i>'), so each summary line opens a new item
+    and a links line is attached to the item above it.
+
+    :param summaries_text: Text produced by StoryPool.render_summaries.
+    :returns: A list of dictionaries with keys 'id' (starting from 1), 'summary' and 'links'.
+    """
+    items = []
+    for raw_line in summaries_text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        if line.startswith(SOURCE_PREFIX) or line.startswith("<a href"):
+            if items and not items[-1]["links"]:
+                items[-1]["links"] = line if line.startswith(SOURCE_PREFIX) else f"{SOURCE_PREFIX}{line}"
+            elif items:
+                items[-1]["links"] += f" | {line.removeprefix(SOURCE_PREFIX)}"
+            continue
+
+        items.append({"id": len(items) + 1, "summary": line, "links": ""})
+    return items
+
+
+def format_source_links(posts: List[Dict[str, Any]]) -> str:
+    """
+    Builds the links line of a summary from the original posts.
+
+    :param posts: Dictionaries with keys 'channel', 'message_id' and 'channel_title'.
+    :returns: Links separated with ' | ', prefixed with '<i>Источник: </i>'.
+    """
+    links = " | ".join(
+        f'<a href="https://t.me/{post["channel"]}/{post["message_id"]}">{html.escape(str(post["channel_title"]))}</a>'
+        for post in posts
+    )
+    return f"{SOURCE_PREFIX}{links}"
+
+
+def parse_clusters(raw: str) -> List[Dict[str, Any]]:
+    """
+    Parses the structured output of the clustering stage.
+
+    Accepts either {"clusters": [...]} or a bare list, with or without a ```json fence.
+
+    :param raw: Raw model output.
+    :returns: A list of dictionaries with keys 'topic', 'emoji' and 'items' (list of item ids).
+    :raises ValueError: If the output is not valid JSON of the expected shape.
+    """
+    try:
+        data = json.loads(_CODE_FENCE.sub("", raw.strip()))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Clustering output is not valid JSON: {e}") from e
+
+    if isinstance(data, dict):
+        data = data.get("clusters")
+    if not isinstance(data, list):
+        raise ValueError("Clustering output does not contain a list of clusters")
+
+    return [cluster for cluster in map(normalize_cluster, data) if cluster]
+
+
+def normalize_cluster(cluster: Any) -> Dict[str, Any] | None:
+    """
+    Validates a single cluster object, coercing item ids to int.
+
+    :param cluster: A decoded JSON object describing one cluster.
+    :returns: Normalized cluster or None if the object is unusable.
+    """
+    if not isinstance(cluster, dict):
+        return None
+
+    topic = str(cluster.get("topic") or "").strip()
+    if not topic:
+        return None
+
+    item_ids = []
+    for item_id in cluster.get("items") or []:
+        try:
+            item_ids.append(int(item_id))
+        except (TypeError, ValueError):
+            continue
+
+    return {
+        "topic": topic,
+        "emoji": str(cluster.get("emoji") or "").strip(),
+        "items": item_ids,
+    }
+
+
+def render_cluster(cluster: Dict[str, Any], items: List[Dict[str, Any]]) -> str:
+    """
+    Renders a single topic block of the digest in Telegram HTML.
+
+    :param cluster: Normalized cluster (see normalize_cluster).
+    :param items: Items belonging to the cluster, in output order.
+    :returns: HTML text of the block.
+    """
+    # Эмодзи тоже приходит от модели и экранируется, как и тема
+    emoji = f"{html.escape(cluster['emoji'])} " if cluster["emoji"] else ""
+    lines = [f"{emoji}<b>{html.escape(cluster['topic'])}</b>"]
+    for item in items:
+        lines.append(html.escape(item["summary"], quote=False))
+        if item["links"]:
+            lines.append(item["links"])
+    return "\n".join(lines)
+
+
+def split_message(text: str, max_length: int = 4096) -> List[str]:
+    """
+    Splits HTML text into Telegram messages without breaking links.
+
+    :param text: HTML text.
+    :param max_length: Telegram message length limit.
+    :returns: Parts of the text, each at most `max_length` long.
+    """
+    parts = []
+    while text:
+        # Ищем безопасное место для разбивки, чтобы не разрывать теги
+        if len(text) <= max_length:
+            parts.append(text)
+            break
+
+        # Ищем последний закрывающий тег в пределах max_length
+        split_pos = text.rfind('</a>', 0, max_length)
+        if split_pos != -1:
+            split_pos += 4  # Включаем сам тег </a>
+        else:
+            # Если тегов нет, разбиваем по последнему переносу строки
+            split_pos = text.rfind('\n', 0, max_length)
+            if split_pos == -1:
+                # Если нет переносов, принудительно обрезаем
+                split_pos = max_length
+
+        parts.append(text[:split_pos])
+        text = text[split_pos:].lstrip()
+    return parts
+
+
+_BLOCK_HEADER = re.compile(r"^(?:(?P<emoji>[^<]*?) )?<b>(?P<topic>.*?)</b>")
+
+
+def block_topic(block: str) -> Dict[str, str] | None:
+    """
+    Extracts the topic of a block rendered by render_cluster.
+
+    :param block: HTML block of one topic.
+    :returns: A dictionary with keys 'topic' and 'emoji', or None if the block has no header.
+    """
+    match = _BLOCK_HEADER.match(block)
+    if not match:
+        return None
+    return {"topic": html.unescape(match.group("topic")), "emoji": html.unescape(match.group("emoji") or "")}
+
+
+class DigestRenderer:
+    """
+    Renders clusters one by one, so that a digest can be built while the clustering output is still streaming.
+
+    Items are rendered once, under the first cluster that mentions them. Items the model did not assign
+    to any cluster are collected under a fallback topic so that nothing is lost.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]]) -> None:
+        self.items = items
+        self._items_by_id = {item["id"]: item for item in items}
+        self._used_ids = set()
+
+    def add(self, cluster: Dict[str, Any]) -> str | None:
+        """
+        Renders a cluster, skipping unknown and already rendered items.
+
+        :param cluster: Normalized cluster (see normalize_cluster).
+        :returns: HTML block or None if the cluster has no new items.
+        """
+        cluster_items = []
+        for item_id in cluster["items"]:
+            if item_id in self._items_by_id and item_id not in self._used_ids:
+                self._used_ids.add(item_id)
+                cluster_items.append(self._items_by_id[item_id])
+        return render_cluster(cluster, cluster_items) if cluster_items else None
+
+    def leftovers(self) -> str | None:
+        """Renders the items that were not assigned to any cluster, or returns None."""
+        leftover_ids = [item["id"] for item in self.items if item["id"] not in self._used_ids]
+        return self.add({**FALLBACK_TOPIC, "items": leftover_ids}) if leftover_ids else None
+
+
+def render_digest(clusters: List[Dict[str, Any]], items: List[Dict[str, Any]]) -> str:
+    """
+    Builds the final HTML digest from clusters of item ids (see DigestRenderer).
+
+    :param clusters: Normalized clusters (see parse_clusters).
+    :param items: Items returned by parse_summary_items.
+    :returns: The digest as HTML text.
+    """
+    renderer = DigestRenderer(items)
+    blocks = [renderer.add(cluster) for cluster in clusters] + [renderer.leftovers()]
+    return "\n\n".join(block for block in blocks if block)
+
+
+class ClusterStreamParser:
+    """
+    Incrementally extracts cluster objects from streamed clustering output.
+
+    The output is expected to be {"clusters": [{...}, {...}]} or a bare list of clusters. Every cluster
+    object is returned as soon as its closing brace arrives, before the rest of the JSON is generated.
+    """
+
+    def __init__(self) -> None:
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._capturing = False
+        self._buffer: List[str] = []
+
+    def _at_cluster_level(self) -> bool:
+        return self._stack in (["{", "["], ["["])
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Consumes the next chunk of output.
+
+        :param chunk: Next piece of the streamed text.
+        :returns: Normalized clusters completed by this chunk.
+        """
+        clusters = []
+        for char in chunk:
+            if self._capturing:
+                self._buffer.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and not self._capturing and self._at_cluster_level():
+                    self._capturing = True
+                    self._buffer = [char]
+                self._stack.append(char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._capturing and char == "}" and self._at_cluster_level():
+                    self._capturing = False
+                    try:
+                        cluster = normalize_cluster(json.loads("".join(self._buffer)))
+                    except json.JSONDecodeError:
+                        cluster = None
+                    if cluster:
+                        clusters.append(cluster)
+        return clusters
@@ -0,0 +1,62 @@
+import re
+from typing import List, Dict, Any
+from src.utils.text import tokenize
+
+_URL_PATTERN = re.compile(r"https?://\S+|t\.me/\S+|@\w+|#\w+")
+_MARKUP_PATTERN = re.compile(r"[*_~`|]+|\[|\]\([^)]*\)")
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits a post into sentences, dropping links, mentions, hashtags and markdown.
+
+    :param text: Raw post text.
+    :returns: Non-empty sentences in their original order.
+    """
+    text = _MARKUP_PATTERN.sub("", _URL_PATTERN.sub(" ", text or ""))
+    sentences = []
+    for sentence in _SENTENCE_PATTERN.split(text):
+        sentence = " ".join(sentence.split()).strip(" -—•:")
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def extractive_summary(text: str, max_length: int = 150, min_words: int = 4) -> str:
+    """
+    Builds a summary of a post without the LLM: the lead sentence, as news posts usually
+    put the essence first.
+
+    Headline-like fragments (emoji, a couple of words) are skipped in favour of the first sentence
+    with at least `min_words` meaningful words. The result is cut at a word boundary.
+
+    :param text: Raw post text.
+    :param max_length: Maximum length of the summary.
+    :param min_words: Minimum number of meaningful words in the chosen sentence.
+    :returns: The summary, or an empty string if the post has no text.
+    """
+    sentences = split_sentences(text)
+    if not sentences:
+        return ""
+
+    lead = next((sentence for sentence in sentences if len(tokenize(sentence)) >= min_words), sentences[0])
+    if len(lead) <= max_length:
+        return lead
+    return lead[:max_length - 1].rsplit(" ", 1)[0].rstrip(" ,;:—-") + "…"
+
+
+def extractive_summaries(items: List[Dict[str, Any]], key: str = "story_id") -> Dict[Any, str]:
+    """
+    Summarizes several items with extractive_summary.
+
+    :param items: Dictionaries with the key 'message' and an id under `key`.
+    :param key: Name of the id key.
+    :returns: A dictionary mapping id to summary. Items without text are missing.
+    """
+    summaries = {}
+    for item in items:
+        summary = extractive_summary(item.get("message") or "")
+        if summary:
+            summaries[item[key]] = summary
+    return summaries
@@ -12,16 +12,17 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from src.scraper import TelegramScraper
-from src.data.database import supabase
-from src.data.database import SupabaseDB
+from src.data.database import create_db
 from src.scraper import init_telethon_client
 from src.config import MISTRAL_KEY, DAY_RANGE_INTERVAL, GROUP_LOGS_ID, ONBOARDING_VIDEO_ID
+from src.config import TOPIC_CACHE_TTL, TOPIC_SCRAPE_CONCURRENCY, DIGEST_TOP_K
 from src.summarization import Summarization
+from src.digest import split_message
 # from src.handlers.messages import BOT_DESCRIPTION, TUTORIAL_STEPS
 
 router = Router()
-db = SupabaseDB(supabase)
-summarizer = Summarization(api_key=MISTRAL_KEY)
+db = create_db()
+summarizer = Summarization(api_key=MISTRAL_KEY, topic_ttl=TOPIC_CACHE_TTL)
 
 
 class UserStates(StatesGroup):
@@ -513,7 +514,7 @@ async def process_interval_input(message: Message, state: FSMContext):
         # Записываем интервал в БД
         await db.set_user_interval(user_id, interval_sec)
         # Обновляем статус юзера на аквтиного в is_receiving_news
-        await db.set_user_receiving_news(user_id, True)
+        await _set_receiving_news(user_id, True)
         # Перезапускаем задачу
         await _restart_news_check(user_id, interval_sec, message)
         await state.clear()
@@ -533,6 +534,113 @@ async def process_interval_input(message: Message, state: FSMContext):
         logging.error("Ошибка в process_interval_input: %s", e)
 
 
+############################## set_top_k - сколько сюжетов в дайджесте  #####################
+
+@router.message(Command("set_top_k"))
+async def set_top_k_handler(message: Message, command: CommandObject):
+    """
+    Handles the /set_top_k command: how many of the most relevant stories go into the user's digest.
+
+    Without arguments shows the current value. `/set_top_k 0` returns to the default.
+
+    :param message: The incoming message object containing the command.
+    :param command: The CommandObject containing parsed command arguments.
+    :returns: None. Sends messages to the user and updates their settings.
+    """
+    user_id = message.from_user.id
+    args = command.args if command else None
+    try:
+        if not args:
+            current = await db.get_user_top_k(user_id)
+            await message.answer(f"📰 Сейчас в дайджест попадает до {current or DIGEST_TOP_K} самых важных сюжетов.\n\n"
+                                 "Чтобы изменить, отправьте `/set_top_k N`, где N от 5 до 100 "
+                                 "(0 - значение по умолчанию).",
+                                 parse_mode="Markdown")
+            return
+
+        top_k = int(args.strip())
+        if top_k != 0 and not 5 <= top_k <= 100:
+            raise ValueError("Недопустимое число сюжетов")
+
+        await db.set_user_top_k(user_id, top_k or None)
+        await message.answer(f"✅ В дайджест будет попадать до {top_k or DIGEST_TOP_K} самых важных сюжетов.")
+    except ValueError:
+        await message.answer("❌ Некорректное значение. Введите число от 5 до 100 или 0.")
+    except Exception as e:
+        await message.answer("⚠️ Произошла внутренняя ошибка. Мы уже работаем над этим!")
+        logging.error("Ошибка в set_top_k_handler: %s", e)
+
+
+############################## /history - архив прошлых дайджестов  #########################
+
+async def _send_history_page(message: Message, user_id: int, before: str | None = None) -> None:
+    """
+    Sends one archived digest of the user, newest first, with a button leading to the previous one.
+
+    :param message: Message to answer to.
+    :param user_id: The ID of the user whose archive is browsed.
+    :param before: Cursor of the page (see SupabaseDB.fetch_digest_history), None for the newest digest.
+    :returns: None.
+    """
+    digests, next_cursor = await db.fetch_digest_history(user_id, limit=1, before=before)
+    if not digests:
+        await message.answer("🗂 Архив пуст: дайджестов пока не было." if before is None
+                             else "🗂 Более ранних дайджестов нет.")
+        return
+
+    digest = digests[0]
+    header = f"🗂 <b>Дайджест от {digest['creation_timestamp'].strftime('%d.%m.%Y %H:%M')}</b>\n\n"
+    parts = split_message(digest["digest_content"], 4096 - len(header))
+    keyboard = None
+    if next_cursor:
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="⬅️ Предыдущий", callback_data=f"history:{next_cursor}")
+        ]])
+    for index, part in enumerate(parts):
+        await message.answer(
+            f"{header}{part}" if index == 0 else part,
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+            # Кнопка под последней частью, чтобы листать после прочтения всего дайджеста
+            reply_markup=keyboard if index == len(parts) - 1 else None,
+        )
+
+
+@router.message(Command("history"))
+async def history_handler(message: Message, state: FSMContext):
+    """
+    Handles the /history command: shows the user's last digest and lets them page back through the archive.
+
+    :param message: The incoming message object containing the command.
+    :param state: FSMContext, cleared so the command interrupts any dialog.
+    :returns: None. Sends the digest to the user.
+    """
+    await state.clear()
+    try:
+        await _send_history_page(message, message.from_user.id)
+    except Exception as e:
+        await message.answer("⚠️ Произошла внутренняя ошибка. Мы уже работаем над этим!")
+        logging.error("Ошибка в history_handler: %s", e)
+
+
+@router.callback_query(F.data.startswith("history:"))
+async def history_page_handler(callback: CallbackQuery):
+    """
+    Handles the "previous digest" button of /history.
+
+    :param callback: CallbackQuery with the cursor of the page after "history:".
+    :returns: None. Sends the previous digest to the user.
+    """
+    await callback.answer()
+    try:
+        # Убираем кнопку, чтобы одну страницу не прислать дважды
+        await callback.message.edit_reply_markup(reply_markup=None)
+        await _send_history_page(callback.message, callback.from_user.id, callback.data.removeprefix("history:"))
+    except Exception as e:
+        await callback.message.answer("⚠️ Произошла внутренняя ошибка. Мы уже работаем над этим!")
+        logging.error("Ошибка в history_page_handler: %s", e)
+
+
 ############################## /comment - оставить комментарий ##############################
 
 @router.message(Command("comment"))
@@ -856,7 +964,7 @@ async def receive_news_handler(message: Message, state: FSMContext):
         interval_sec = await db.get_user_interval(user_id)
 
         # 2. Помечаем пользователя как активного
-        await db.set_user_receiving_news(user_id, True)
+        await _set_receiving_news(user_id, True)
 
         # 3. Инициализируем клиент Telethon
         await init_telethon_client()
@@ -883,7 +991,7 @@ async def stop_news_handler(message: Message, state: FSMContext):
 
     user_id = message.from_user.id
     scraper = TelegramScraper(user_id)
-    await db.set_user_receiving_news(user_id, False)
+    await _set_receiving_news(user_id, False)
     scraper.stop_auto_news_check(user_id)
     await message.answer(
         "Вы остановили получение дайджестов.\n\n"
@@ -938,27 +1046,14 @@ async def forwarded_message(message: Message):
     channel = f"@{channel}" if not channel.startswith("@") else channel
 
     try:
-        exist_channel_id = await db.fetch_channel_id(channel)
-        if exist_channel_id:
-            linking_user_channel = await db.link_user_single_channel(user_id, exist_channel_id, addition_timestamp)
-            if linking_user_channel:
-                await message.answer(f"Канал {channel} успешно добавлен! ✔️\n\n Список ваших каналов - команда /show_channels")
-                await message.delete()
-            else:
-                await message.answer("Ошибка при добавлении канала. Пожалуйста, попробуйте позже.")
-
+        linked = await db.ensure_user_channels(
+            user_id, [channel], lambda new: _detect_channel_topics(scraper, new), addition_timestamp
+        )
+        if linked:
+            await message.answer(f"Канал {channel} успешно добавлен! ✔️\n\n Список ваших каналов - команда /show_channels")
+            await message.delete()
         else:
-            messages = await scraper.scrape_messages_long_term(channel, days=DAY_RANGE_INTERVAL, limit=15)
-            channel_topic = await summarizer.determine_channel_topic(messages)
-
-            adding_channel = await db.add_single_channel(channel, channel_topic, addition_timestamp)
-            if adding_channel:
-                channel_id = await db.fetch_channel_id(channel)
-                await db.link_user_single_channel(user_id, channel_id, addition_timestamp)
-                await message.answer(f"Канал {channel} успешно добавлен! ✔️\n\n Список ваших каналов - команда /show_channels")
-                await message.delete()
-            else:
-                await message.answer("Ошибка при добавлении канала. Пожалуйста, попробуйте позже.")
+            await message.answer("Ошибка при добавлении канала. Пожалуйста, попробуйте позже.")
     except Exception as e:
         logging.error("\nError adding channel for user %s: %s\n", user_id, e)
         await message.answer("Произошла ошибка при добавлении канала. Пожалуйста, попробуйте позже.")
@@ -1013,25 +1108,16 @@ async def async_process_channels_input(message: Message):
     try:
         new_channels = list(new_channels)
 
-        channel_ids = await db.fetch_channel_ids(new_channels)
-        if channel_ids:
-            await db.link_user_channels(user_id, channel_ids, addition_timestamp)
-            new_channels_list = ', '.join(new_channels)
-            await message.answer(f"Каналы {new_channels_list} успешно добавлены! ✔️\n\n Список ваших каналов - команда /show_channels")
-
-        else:
-            topics = []
-            for channel in new_channels:
-                messages = await scraper.scrape_messages_long_term(channel, days=DAY_RANGE_INTERVAL, limit=15)
-                channel_topic = await summarizer.determine_channel_topic(messages)
-                topics.append(channel_topic)
-
-            await db.add_channels(new_channels, topics, addition_timestamp)
-            channel_ids = await db.fetch_channel_ids(new_channels)
-            await db.link_user_channels(user_id, channel_ids, addition_timestamp)
+        # Известные каналы просто привязываются, темы определяются только для новых
+        linked = await db.ensure_user_channels(
+            user_id, new_channels, lambda new: _detect_channel_topics(scraper, new), addition_timestamp
+        )
+        if not linked:
+            await message.answer("Ошибка при добавлении каналов. Пожалуйста, попробуйте позже.")
+            return
 
-            new_channels_list = ', '.join(new_channels)
-            await message.answer(f"Каналы {new_channels_list} успешно добавлены! ✔️\n\n Список ваших каналов - команда /show_channels")
+        new_channels_list = ', '.join(new_channels)
+        await message.answer(f"Каналы {new_channels_list} успешно добавлены! ✔️\n\n Список ваших каналов - команда /show_channels")
 
     except Exception as e:
         logging.error("\nError adding channels for user %s: %s\n", user_id, e)
@@ -1080,6 +1166,18 @@ async def process_other_messages(message: Message, state: FSMContext):
 ############################## Доп функции ##############################
 
 
+############################## Функция изменения статуса получения дайджестов
+async def _set_receiving_news(user_id: int, is_receiving: bool) -> None:
+    """
+    Writes an explicit command of the user (receive or stop digests) straight to the database.
+
+    The write-behind buffer may lose writes, so it is only used for the scraper's own deactivations;
+    a deactivation still pending there is dropped so it can't overwrite the user's choice.
+    """
+    TelegramScraper.write_buffer.discard_receiving_news(user_id)
+    await db.set_user_receiving_news(user_id, is_receiving)
+
+
 ############################## Функция для перезапуска дайджеста
 async def _restart_news_check(user_id: int, interval_sec: int, message: Message):
     """Перезапускает задачу проверки новостей с новым интервалом."""
@@ -1102,6 +1200,24 @@ async def _restart_news_check(user_id: int, interval_sec: int, message: Message)
         logging.error("Ошибка в _restart_news_check: %s", e)
 
 
+############################## Функция определения тем каналов
+async def _detect_channel_topics(scraper: TelegramScraper, channels: list[str]) -> dict[str, list[str]]:
+    """
+    Determines topics of the given channels: cached topics are reused, the rest of the channels are
+    scraped concurrently and classified with batched requests.
+    """
+    semaphore = asyncio.Semaphore(TOPIC_SCRAPE_CONCURRENCY)
+
+    async def scrape_sample(channel: str) -> tuple[str, list]:
+        async with semaphore:
+            return channel, await scraper.scrape_messages_long_term(channel, days=DAY_RANGE_INTERVAL, limit=15)
+
+    missing = [channel for channel in channels if not summarizer.cached_channel_topic(channel)]
+    samples = dict(await asyncio.gather(*(scrape_sample(channel) for channel in missing)))
+    samples.update({channel: [] for channel in channels if channel not in samples})
+    return await summarizer.determine_channel_topics(samples)
+
+
 ############################## Функция обработки списка каналов #############################
 def process_channel_list(channels_text: str) -> set[str]:
     """
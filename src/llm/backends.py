@@ -0,0 +1,245 @@
+import re
+import json
+import random
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List
+
+
+@dataclass
+class Completion:
+    """Text of a response (or of a streamed chunk) with the token usage reported for it."""
+    content: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class RateLimitError(Exception):
+    """The backend answered 429. `retry_after` is the delay suggested by the server, if any."""
+
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(f"{message}: Status 429")
+        self.retry_after = retry_after
+
+
+class LLMBackend(ABC):
+    """
+    Interface of an LLM provider used by Summarization.
+
+    `complete` returns the whole response, `stream` yields it chunk by chunk; the last chunk carries
+    the token usage. Rate limiting is reported with RateLimitError, other failures with any exception.
+    """
+
+    @abstractmethod
+    async def complete(self, model: str, prompt: str, response_format: Dict | None = None) -> Completion:
+        ...
+
+    @abstractmethod
+    def stream(self, model: str, prompt: str, response_format: Dict | None = None) -> AsyncIterator[Completion]:
+        ...
+
+
+def _retry_after(e) -> float | None:
+    if e.raw_response is None:
+        return None
+    try:
+        return float(e.raw_response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class MistralBackend(LLMBackend):
+    """
+    Mistral API via the mistralai SDK.
+
+    The SDK is imported on first use, so the rest of this module (FakeBackend, estimate_tokens) works without it.
+    """
+
+    def __init__(self, api_key: str) -> None:
+        self.api_key = api_key
+
+    async def complete(self, model: str, prompt: str, response_format: Dict | None = None) -> Completion:
+        from mistralai import Mistral, models
+
+        extra_params = {"response_format": response_format} if response_format else {}
+        async with Mistral(api_key=self.api_key) as client:
+            try:
+                response = await client.chat.complete_async(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    **extra_params
+                )
+            except models.SDKError as e:
+                if e.status_code == 429:
+                    raise RateLimitError(e.message, _retry_after(e)) from e
+                raise
+
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else 0,
+            usage.completion_tokens if usage else 0,
+        )
+
+    async def stream(self, model: str, prompt: str, response_format: Dict | None = None) -> AsyncIterator[Completion]:
+        from mistralai import Mistral, models
+
+        extra_params = {"response_format": response_format} if response_format else {}
+        async with Mistral(api_key=self.api_key) as client:
+            try:
+                stream = await client.chat.stream_async(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    **extra_params
+                )
+            except models.SDKError as e:
+                if e.status_code == 429:
+                    raise RateLimitError(e.message, _retry_after(e)) from e
+                raise
+
+            usage = None
+            async with stream as events:
+                async for event in events:
+                    usage = event.data.usage or usage
+                    if event.data.choices and event.data.choices[0].delta.content:
+                        yield Completion(event.data.choices[0].delta.content)
+            if usage:
+                yield Completion("", usage.prompt_tokens, usage.completion_tokens)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), used where the real tokenizer is not available."""
+    return max(1, len(text) // 4)
+
+
+_STORY_ID = re.compile(r"'id': '([^']*)'")
+_NUMBERED_SUMMARY = re.compile(r"^\s*(\d+)\. ", re.MULTILINE)
+_CHANNEL_KEY = re.compile(r"'(@\w+)': \[")
+_FAKE_TOPICS = [("Политика", "🏛"), ("Экономика", "💰"), ("Технологии", "💻"), ("Общество", "👥"), ("Спорт", "⚽")]
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "big")
+
+
+def default_fake_response(prompt: str, response_format: Dict | None = None) -> str:
+    """
+    Deterministic answers to the prompts of Summarization: the same prompt always gets the same response.
+
+    Recognizes story summarization, clustering and batched topic detection prompts and answers them
+    with JSON of the expected shape; anything else gets a short text derived from the prompt.
+    """
+    if '{"summaries"' in prompt:
+        summaries = [
+            {"id": story_id, "summary": f"Сводка сюжета {story_id} ({_stable_hash(story_id) % 1000})"}
+            for story_id in _STORY_ID.findall(prompt)
+        ]
+        return json.dumps({"summaries": summaries}, ensure_ascii=False)
+
+    if '{"clusters"' in prompt:
+        clusters: Dict[int, List[int]] = {}
+        summaries_part = prompt.split("Summaries:", 1)[-1]
+        for item_id in _NUMBERED_SUMMARY.findall(summaries_part):
+            clusters.setdefault(_stable_hash(item_id) % len(_FAKE_TOPICS), []).append(int(item_id))
+        return json.dumps({"clusters": [
+            {"topic": _FAKE_TOPICS[index][0], "emoji": _FAKE_TOPICS[index][1], "items": items}
+            for index, items in sorted(clusters.items())
+        ]}, ensure_ascii=False)
+
+    if '{"@channel_name": "topic"}' in prompt:
+        return json.dumps({
+            channel: _FAKE_TOPICS[_stable_hash(channel) % len(_FAKE_TOPICS)][0]
+            for channel in _CHANNEL_KEY.findall(prompt)
+        }, ensure_ascii=False)
+
+    if response_format and response_format.get("type") == "json_object":
+        return "{}"
+    return _FAKE_TOPICS[_stable_hash(prompt) % len(_FAKE_TOPICS)][0]
+
+
+class FakeBackend(LLMBackend):
+    """
+    In-process stand-in for the LLM API, for offline tests and load testing of the digest pipeline.
+
+    Latency of every call is drawn from a lognormal distribution (median `latency`, spread `latency_sigma`)
+    plus `seconds_per_token` for every generated token. With probability `rate_limit_probability` a call
+    fails with RateLimitError and Retry-After `retry_after`. Token usage is accounted per model in `usage`.
+    Responses come from `responder(prompt, response_format)` and are deterministic by default.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        latency_sigma: float = 0.5,
+        seconds_per_token: float = 0.0,
+        rate_limit_probability: float = 0.0,
+        retry_after: float = 1.0,
+        chunk_size: int = 16,
+        seed: int = 0,
+        responder: Callable[[str, Dict | None], str] = default_fake_response,
+    ) -> None:
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.seconds_per_token = seconds_per_token
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.chunk_size = chunk_size
+        self.responder = responder
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+        self.usage: Dict[str, Dict[str, int]] = {}
+
+    def _account(self, model: str, prompt: str, content: str) -> Completion:
+        prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        usage = self.usage.setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0})
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        return Completion(content, prompt_tokens, completion_tokens)
+
+    def _delay(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        return self._random.lognormvariate(0.0, self.latency_sigma) * self.latency
+
+    async def _admit(self) -> None:
+        self.calls += 1
+        if self._random.random() < self.rate_limit_probability:
+            self.rate_limited += 1
+            await asyncio.sleep(self._delay() / 10)
+            raise RateLimitError("Fake rate limit", self.retry_after)
+
+    async def complete(self, model: str, prompt: str, response_format: Dict | None = None) -> Completion:
+        await self._admit()
+        content = self.responder(prompt, response_format)
+        await asyncio.sleep(self._delay() + self.seconds_per_token * estimate_tokens(content))
+        return self._account(model, prompt, content)
+
+    async def stream(self, model: str, prompt: str, response_format: Dict | None = None) -> AsyncIterator[Completion]:
+        await self._admit()
+        content = self.responder(prompt, response_format)
+        await asyncio.sleep(self._delay())  # время до первого токена
+        for start in range(0, len(content), self.chunk_size):
+            chunk = content[start:start + self.chunk_size]
+            await asyncio.sleep(self.seconds_per_token * estimate_tokens(chunk))
+            yield Completion(chunk)
+        usage = self._account(model, prompt, content)
+        yield Completion("", usage.prompt_tokens, usage.completion_tokens)
+
+
+def create_backend(name: str, api_key: str | None = None, **fake_options) -> LLMBackend:
+    """
+    Creates the backend configured with LLM_BACKEND.
+
+    :param name: "mistral" or "fake".
+    :param api_key: Mistral API key.
+    :param fake_options: Keyword arguments of FakeBackend, ignored by the other backends.
+    :raises ValueError: If the backend name is unknown.
+    """
+    if name == "mistral":
+        return MistralBackend(api_key)
+    if name == "fake":
+        return FakeBackend(**fake_options)
+    raise ValueError(f"Unknown LLM backend: {name}")
@@ -0,0 +1,96 @@
+import time
+from collections import deque
+from typing import Deque, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast when the upstream API keeps failing.
+
+    The breaker opens when, within the last `window` seconds, at least `min_calls` calls were made and
+    the share of failed ones reached `failure_threshold`. While open, calls are rejected with
+    CircuitOpenError. After `reset_timeout` seconds a single probe call is let through (half-open state):
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: float = 0.5,
+        min_calls: int = 5,
+        window: float = 60.0,
+        reset_timeout: float = 120.0,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        # (время, успешен ли вызов)
+        self._calls: Deque[Tuple[float, bool]] = deque()
+
+    def _recent(self) -> Deque[Tuple[float, bool]]:
+        cutoff = time.monotonic() - self.window
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
+        return self._calls
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self._calls.clear()
+
+    def check(self) -> None:
+        """
+        Checks whether a call may be made right now.
+
+        :raises CircuitOpenError: If the breaker is open, or half-open with the probe call already in flight.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError("LLM API circuit breaker is open")
+            self.state = HALF_OPEN
+
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError("LLM API circuit breaker is half-open, probe call in flight")
+            self._probe_in_flight = True
+
+    def record_success(self) -> None:
+        """Registers a successful call."""
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self._probe_in_flight = False
+            self._calls.clear()
+        self._recent().append((time.monotonic(), True))
+
+    def record_failure(self) -> None:
+        """Registers a failed call, opening the breaker if the failure rate is too high."""
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+
+        calls = self._recent()
+        calls.append((time.monotonic(), False))
+        failures = sum(1 for _, success in calls if not success)
+        if len(calls) >= self.min_calls and failures / len(calls) >= self.failure_threshold:
+            self._open()
+
+    def release(self) -> None:
+        """Frees the half-open probe slot without a verdict, e.g. when the probe call was cancelled."""
+        self._probe_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently rejected (the reset timeout has not passed yet)."""
+        return self.state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout
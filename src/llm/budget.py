@@ -0,0 +1,144 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, List, Tuple
+
+from src.llm.models import MODEL_PRICES
+
+LEVEL_FULL = "full"
+LEVEL_TOP_K = "top_k"
+LEVEL_CHEAP_MODEL = "cheap_model"
+LEVEL_EXTRACTIVE = "extractive"
+
+
+@dataclass
+class BudgetPlan:
+    """What a digest is allowed to spend and how it has to degrade to fit."""
+    level: str
+    allowance: float
+    max_items: int | None = None
+    reserved: float = 0.0
+
+
+def _price(model: str) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_price + completion_price) / 2
+
+
+class TokenBudget:
+    """
+    Hourly token budget of the LLM API, shared fairly between users.
+
+    Spending is counted in tokens of `reference_model`: tokens of other models are weighted by their price
+    relative to it, so a cheaper model consumes proportionally less budget. Every digest gets at most
+    the user's fair share of the window budget, and never more than is left. The share is the budget divided
+    between the users expected to request digests in the window (e.g. those receiving news), or between
+    the users that already did if there are more of them, and then between that user's digests. So the first
+    digest of a window doesn't get the whole budget just because nobody else has asked yet.
+    """
+
+    def __init__(
+        self,
+        tokens_per_window: float,
+        reference_model: str = "mistral-large-latest",
+        window: float = 3600.0,
+        min_top_share: float = 0.5,
+    ) -> None:
+        self.tokens_per_window = tokens_per_window
+        self.reference_model = reference_model
+        self.window = window
+        self.min_top_share = min_top_share
+        self._spent: Deque[Tuple[float, float]] = deque()
+        self._plans: Deque[Tuple[float, Any]] = deque()
+        self._reserved = 0.0
+
+    def _trim(self) -> None:
+        cutoff = time.monotonic() - self.window
+        while self._spent and self._spent[0][0] < cutoff:
+            self._spent.popleft()
+        while self._plans and self._plans[0][0] < cutoff:
+            self._plans.popleft()
+
+    def weight(self, model: str) -> float:
+        """Budget tokens consumed by one token of the model."""
+        reference_price, price = _price(self.reference_model), _price(model)
+        if not reference_price or not price:
+            return 1.0
+        return price / reference_price
+
+    def spend(self, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Registers tokens spent by a finished call."""
+        tokens = (prompt_tokens + completion_tokens) * self.weight(model)
+        if tokens:
+            self._spent.append((time.monotonic(), tokens))
+
+    def spent(self) -> float:
+        """Budget tokens spent within the window."""
+        self._trim()
+        return sum(tokens for _, tokens in self._spent)
+
+    def remaining(self) -> float:
+        """Budget tokens left in the window, minus what running digests have reserved."""
+        return max(0.0, self.tokens_per_window - self.spent() - self._reserved)
+
+    def fair_share(self, user_id: Any, expected_users: int = 0) -> float:
+        """
+        The share of the window budget for one digest of the user.
+
+        :param user_id: The user the digest is built for.
+        :param expected_users: How many users are expected to request digests in the window.
+        :returns: Budget tokens.
+        """
+        self._trim()
+        users = {user for _, user in self._plans} | {user_id}
+        user_digests = 1 + sum(1 for _, user in self._plans if user == user_id)
+        return self.tokens_per_window / max(len(users), expected_users) / user_digests
+
+    def plan(
+        self,
+        user_id: Any,
+        item_costs: List[float],
+        overhead: float = 0.0,
+        cheap_model: str | None = None,
+        expected_users: int = 0,
+    ) -> BudgetPlan:
+        """
+        Decides how a digest fits into the budget and reserves its allowance.
+
+        In order of preference: the full digest; only the top-ranked items (if at least `min_top_share`
+        of them fit); the full digest on `cheap_model`; the extractive fallback without the LLM.
+
+        :param user_id: The user the digest is built for.
+        :param item_costs: Estimated tokens of every item, in ranking order (best first).
+        :param overhead: Estimated tokens that don't depend on the number of items.
+        :param cheap_model: The cheaper model that may be used instead.
+        :param expected_users: How many users are expected to request digests in the window.
+        :returns: The plan; pass it to release when the digest is done.
+        """
+        allowance = min(self.fair_share(user_id, expected_users), self.remaining())
+        self._plans.append((time.monotonic(), user_id))
+        estimate = overhead + sum(item_costs)
+
+        if estimate <= allowance:
+            plan = BudgetPlan(LEVEL_FULL, allowance, reserved=estimate)
+        else:
+            fitting, total = 0, overhead
+            for cost in item_costs:
+                if total + cost > allowance:
+                    break
+                total += cost
+                fitting += 1
+            if item_costs and fitting >= len(item_costs) * self.min_top_share:
+                plan = BudgetPlan(LEVEL_TOP_K, allowance, max_items=fitting, reserved=total)
+            elif cheap_model and estimate * self.weight(cheap_model) <= allowance:
+                plan = BudgetPlan(LEVEL_CHEAP_MODEL, allowance, reserved=estimate * self.weight(cheap_model))
+            else:
+                plan = BudgetPlan(LEVEL_EXTRACTIVE, allowance)
+
+        self._reserved += plan.reserved
+        return plan
+
+    def release(self, plan: BudgetPlan) -> None:
+        """Drops the reservation of a finished digest; its real spending is already counted by spend."""
+        self._reserved = max(0.0, self._reserved - plan.reserved)
+        plan.reserved = 0.0
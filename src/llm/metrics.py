@@ -0,0 +1,193 @@
+import time
+import bisect
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Tuple
+
+from src.llm.models import estimate_cost
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+OUTCOME_RATE_LIMITED = "rate_limited"
+OUTCOME_CIRCUIT_OPEN = "circuit_open"
+
+# Границы корзин гистограммы латентности, в секундах
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Метки текущего вызова (пользователь, дайджест), наследуются задачами asyncio
+_labels: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("llm_labels", default={})
+
+
+@contextmanager
+def llm_context(**labels: Any) -> Iterator[None]:
+    """
+    Attributes LLM calls made inside the block (including tasks started from it) to the given labels.
+
+    :param labels: E.g. user_id=..., digest_id=...
+    """
+    token = _labels.set({**_labels.get(), **labels})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> Dict[str, Any]:
+    """Returns the labels set with llm_context."""
+    return _labels.get()
+
+
+@dataclass
+class CallRecord:
+    """One upstream LLM request, including all its retries."""
+    stage: str
+    model: str
+    outcome: str
+    wall_time: float
+    attempts: int
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    labels: Dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds."""
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the q-quantile (inf for the overflow bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+def _totals() -> Dict[str, float]:
+    return {"calls": 0, "wall_time": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+
+
+class LLMMetrics:
+    """
+    Aggregates per-call records of LLM requests.
+
+    Keeps counters per (stage, model, outcome), latency histograms and token/cost totals per (stage, model),
+    totals per user and per digest (from the labels set with llm_context), and the last `max_records` raw records.
+
+    Work that serves many users is not charged to the user who happened to trigger it: calls made with
+    the label shared=True (story summaries of StoryPool) go to the `shared` totals instead of `by_user` and
+    `by_digest`. Requests coalesced by SingleFlight are recorded once, under the labels of the caller that
+    made the upstream call; the other callers are not charged for them.
+    """
+
+    def __init__(self, max_records: int = 10000, max_digests: int = 1000) -> None:
+        self.max_digests = max_digests
+        self.records: Deque[CallRecord] = deque(maxlen=max_records)
+        self.counters: Dict[Tuple[str, str, str], int] = {}
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.attempts: Dict[Tuple[str, str], Histogram] = {}
+        self.totals: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self.by_user: Dict[Any, Dict[str, float]] = {}
+        self.by_digest: "OrderedDict[Any, Dict[str, float]]" = OrderedDict()
+        self.shared: Dict[str, float] = _totals()
+
+    def record(
+        self,
+        stage: str,
+        model: str,
+        outcome: str,
+        wall_time: float,
+        attempts: int,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+    ) -> CallRecord:
+        """
+        Registers one upstream request.
+
+        :param stage: Pipeline stage (summary, cluster, topic).
+        :param model: Model of the last attempt.
+        :param outcome: OUTCOME_OK, OUTCOME_ERROR, OUTCOME_RATE_LIMITED or OUTCOME_CIRCUIT_OPEN.
+        :param wall_time: Time from the first attempt to the result, backoff included, in seconds.
+        :param attempts: Number of attempts made.
+        :param prompt_tokens: Prompt tokens reported by the API.
+        :param completion_tokens: Completion tokens reported by the API.
+        :returns: The stored record.
+        """
+        record = CallRecord(
+            stage, model, outcome, wall_time, attempts, prompt_tokens, completion_tokens,
+            estimate_cost(model, prompt_tokens, completion_tokens), dict(current_labels()),
+        )
+        self.records.append(record)
+
+        self.counters[(stage, model, outcome)] = self.counters.get((stage, model, outcome), 0) + 1
+        self.latency.setdefault((stage, model), Histogram()).observe(wall_time)
+        self.attempts.setdefault((stage, model), Histogram(bounds=(1, 2, 3, 5))).observe(attempts)
+
+        breakdowns = [self.totals.setdefault((stage, model), _totals())]
+        if record.labels.get("shared"):
+            breakdowns.append(self.shared)
+        elif "user_id" in record.labels:
+            breakdowns.append(self.by_user.setdefault(record.labels["user_id"], _totals()))
+        if "digest_id" in record.labels and not record.labels.get("shared"):
+            digest_id = record.labels["digest_id"]
+            breakdowns.append(self.by_digest.setdefault(digest_id, _totals()))
+            self.by_digest.move_to_end(digest_id)
+            while len(self.by_digest) > self.max_digests:
+                self.by_digest.popitem(last=False)
+
+        for totals in breakdowns:
+            totals["calls"] += 1
+            totals["wall_time"] += wall_time
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cost"] += record.cost
+        return record
+
+    def digest(self, digest_id: Any) -> Dict[str, float]:
+        """Returns the totals of one digest (calls, wall time, tokens, cost)."""
+        return dict(self.by_digest.get(digest_id) or _totals())
+
+    def top_users(self, limit: int = 10, key: str = "wall_time") -> List[Tuple[Any, Dict[str, float]]]:
+        """
+        Returns the users that spent the most.
+
+        :param limit: Number of users.
+        :param key: "wall_time", "cost", "prompt_tokens", "completion_tokens" or "calls".
+        """
+        return sorted(self.by_user.items(), key=lambda item: item[1][key], reverse=True)[:limit]
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Returns per stage and model aggregates, e.g. for logging."""
+        rows = []
+        for (stage, model), totals in sorted(self.totals.items()):
+            latency = self.latency[(stage, model)]
+            rows.append({
+                "stage": stage,
+                "model": model,
+                **{outcome: count for (s, m, outcome), count in self.counters.items() if (s, m) == (stage, model)},
+                "p50": latency.quantile(0.5),
+                "p95": latency.quantile(0.95),
+                "avg_attempts": round(self.attempts[(stage, model)].sum / latency.count, 2),
+                "prompt_tokens": totals["prompt_tokens"],
+                "completion_tokens": totals["completion_tokens"],
+                "cost": round(totals["cost"], 6),
+            })
+        return rows
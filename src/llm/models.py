@@ -0,0 +1,110 @@
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+STAGE_SUMMARY = "summary"
+STAGE_CLUSTER = "cluster"
+STAGE_TOPIC = "topic"
+
+# Цены Mistral в $ за 1M токенов: (prompt, completion)
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "mistral-large-latest": (2.0, 6.0),
+    "mistral-medium-latest": (0.4, 2.0),
+    "mistral-small-latest": (0.1, 0.3),
+    "ministral-8b-latest": (0.1, 0.1),
+    "ministral-3b-latest": (0.04, 0.04),
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Returns the cost of a call in $, or 0 for models without a known price."""
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class ModelSelector:
+    """
+    Picks a model for every pipeline stage from an ordered list of tiers.
+
+    The first tier is used while it is healthy. A model is considered degraded when, within the last
+    `window` seconds, its share of rate-limited attempts, its mean latency or the mean time requests
+    spent waiting (backoff, queue) crosses the thresholds; the next tier is used then. Once the window
+    passes without bad samples, the model is tried again.
+
+    Only this sliding window is kept here; calls, tokens and cost are accounted by LLMMetrics.
+    """
+
+    def __init__(
+        self,
+        stage_models: Dict[str, List[str]],
+        window: float = 300.0,
+        rate_limit_threshold: float = 0.3,
+        latency_threshold: float = 30.0,
+        queue_threshold: float = 20.0,
+        min_samples: int = 3,
+    ) -> None:
+        self.stage_models = stage_models
+        self.window = window
+        self.rate_limit_threshold = rate_limit_threshold
+        self.latency_threshold = latency_threshold
+        self.queue_threshold = queue_threshold
+        self.min_samples = min_samples
+        # model -> (время, латентность, ожидание, был ли 429)
+        self._samples: Dict[str, Deque[Tuple[float, float, float, bool]]] = {}
+
+    def tiers(self, stage: str, default: str) -> List[str]:
+        """Returns the configured models of a stage, or [default] if the stage is not configured."""
+        return self.stage_models.get(stage) or [default]
+
+    def _recent(self, model: str) -> Deque[Tuple[float, float, float, bool]]:
+        samples = self._samples.setdefault(model, deque())
+        cutoff = time.monotonic() - self.window
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        return samples
+
+    def is_degraded(self, model: str) -> bool:
+        """Checks the recent samples of a model against the thresholds."""
+        samples = self._recent(model)
+        if len(samples) < self.min_samples:
+            return False
+        rate_limited = sum(1 for sample in samples if sample[3]) / len(samples)
+        completed = [sample for sample in samples if not sample[3]]
+        mean_latency = sum(sample[1] for sample in completed) / len(completed) if completed else 0.0
+        mean_wait = sum(sample[2] for sample in completed) / len(completed) if completed else 0.0
+        return (
+            rate_limited >= self.rate_limit_threshold
+            or mean_latency >= self.latency_threshold
+            or mean_wait >= self.queue_threshold
+        )
+
+    def select(self, stage: str, default: str) -> str:
+        """
+        Returns the first healthy model of the stage, or the last tier if all of them are degraded.
+
+        :param stage: Pipeline stage (STAGE_SUMMARY, STAGE_CLUSTER, STAGE_TOPIC).
+        :param default: Model used when the stage has no configured tiers.
+        """
+        tiers = self.tiers(stage, default)
+        for model in tiers[:-1]:
+            if not self.is_degraded(model):
+                return model
+        return tiers[-1]
+
+    def cheapest(self, stage: str, default: str) -> str:
+        """Returns the last (cheapest) tier of the stage, used when the token budget is short."""
+        return self.tiers(stage, default)[-1]
+
+    def record_rate_limit(self, model: str) -> None:
+        """Registers a 429 response of a model."""
+        self._recent(model).append((time.monotonic(), 0.0, 0.0, True))
+
+    def record(self, model: str, latency: float, queue_wait: float = 0.0) -> None:
+        """
+        Registers a finished attempt (successful or failed with an error other than 429).
+
+        :param model: Model that served the attempt.
+        :param latency: Wall time of the attempt in seconds.
+        :param queue_wait: Time the call spent waiting before it was served (backoff, queue) in seconds.
+        """
+        self._recent(model).append((time.monotonic(), latency, queue_wait, False))
@@ -0,0 +1,133 @@
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List
+
+
+class _Flow:
+    """Queue of one user's requests: [cost, future] pairs plus the DRR deficit counter."""
+
+    def __init__(self) -> None:
+        self.queue: Deque[List[Any]] = deque()
+        self.deficit = 0.0
+
+
+class FairScheduler:
+    """
+    Limits concurrent LLM requests and shares the slots between users with deficit round robin.
+
+    Every request has a cost (estimated tokens). Waiting users are visited in turn; on each visit a user
+    receives `quantum * weight` tokens of credit and may start requests while their cost fits into the
+    accumulated credit. A user sending huge prompts therefore gets proportionally fewer turns instead of
+    blocking everybody queued behind them. While there are free slots and nobody is waiting, requests
+    start immediately.
+
+    Requests are queued in the flow of the user in whose context they are made (llm_context). Shared work,
+    e.g. story summaries of StoryPool or a request coalesced by SingleFlight, runs in the flow of the user
+    who triggered it, since that user is the one waiting for it.
+    """
+
+    def __init__(self, concurrency: int = 4, quantum: float = 4000.0) -> None:
+        self.concurrency = concurrency
+        self.quantum = quantum
+        self.weights: Dict[Any, float] = {}
+        self.stats = {"granted": 0, "queued": 0, "wait_time": 0.0}
+        self._flows: Dict[Any, _Flow] = {}
+        self._active: Deque[Any] = deque()
+        self._running = 0
+        self._new_visit = True
+
+    @property
+    def waiting(self) -> int:
+        """Number of queued requests."""
+        return sum(len(flow.queue) for flow in self._flows.values())
+
+    def set_weight(self, user: Any, weight: float) -> None:
+        """Gives a user a larger (or smaller) share of the capacity, 1.0 by default."""
+        self.weights[user] = weight
+
+    async def acquire(self, user: Any, cost: float) -> float:
+        """
+        Waits for a slot.
+
+        :param user: Flow key, usually the user id.
+        :param cost: Estimated tokens of the request.
+        :returns: Time spent waiting, in seconds.
+        """
+        self.stats["granted"] += 1
+        if self._running < self.concurrency and not self._active:
+            self._running += 1
+            return 0.0
+
+        self.stats["queued"] += 1
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = [max(cost, 1.0), future]
+        flow = self._flows.setdefault(user, _Flow())
+        flow.queue.append(entry)
+        if user not in self._active:
+            self._active.append(user)
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # слот уже выдан, возвращаем его
+            elif entry in flow.queue:
+                flow.queue.remove(entry)
+                self._dispatch()
+            raise
+        waited = time.monotonic() - started
+        self.stats["wait_time"] += waited
+        return waited
+
+    def release(self) -> None:
+        """Frees a slot taken with acquire."""
+        self._running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: Any, cost: float) -> AsyncIterator[float]:
+        """Holds a slot for the duration of the block, yields the time spent waiting for it."""
+        waited = await self.acquire(user, cost)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency and self._active:
+            user = self._active[0]
+            flow = self._flows[user]
+            if not flow.queue:
+                self._finish_visit(user)
+                continue
+
+            if self._new_visit:
+                flow.deficit += self.quantum * self.weights.get(user, 1.0)
+                self._new_visit = False
+
+            cost, future = flow.queue[0]
+            if future.done():
+                # Ожидание отменили, но запрос ещё не убран из очереди
+                flow.queue.popleft()
+                continue
+            if cost > flow.deficit:
+                # Кредита не хватает - ход переходит к следующему пользователю
+                self._active.rotate(-1)
+                self._new_visit = True
+                continue
+
+            flow.queue.popleft()
+            flow.deficit -= cost
+            self._running += 1
+            future.set_result(None)
+            if not flow.queue:
+                self._finish_visit(user)
+
+    def _finish_visit(self, user: Any) -> None:
+        self._active.popleft()
+        self._flows.pop(user, None)  # у пользователя без очереди кредит не копится
+        self._new_visit = True
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+
+def request_key(*parts: Any) -> str:
+    """Builds a stable key for a request from its parts (model, prompt, response format...)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class _SharedStream:
+    """Chunks of one upstream stream, replayed to every consumer."""
+
+    def __init__(self) -> None:
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.condition = asyncio.Condition()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight requests.
+
+    Concurrent callers with the same key await one upstream call instead of issuing their own,
+    and successful results are kept for `ttl` seconds for callers that arrive right after it completes.
+    Errors are never cached.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0, "cache_hits": 0}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self._pumps: set = set()
+        self._results: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def _cached(self, key: str) -> Tuple[bool, Any]:
+        cached = self._results.get(key)
+        if cached is None:
+            return False, None
+        if time.monotonic() - cached[0] > self.ttl:
+            del self._results[key]
+            return False, None
+        self._results.move_to_end(key)
+        return True, cached[1]
+
+    def _remember(self, key: str, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        self._results[key] = (time.monotonic(), value)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the result of `call`, sharing it with concurrent callers that use the same key.
+
+        :param key: Request key (see request_key).
+        :param call: Coroutine function making the actual request.
+        :returns: The result of the request.
+        """
+        self.stats["calls"] += 1
+        while True:
+            found, value = self._cached(key)
+            if found:
+                self.stats["cache_hits"] += 1
+                return value
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Ведущий запрос отменили - повторяем сами, иначе это отмена нас
+                if inflight.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.stats["upstream"] += 1
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # помечаем исключение как полученное, даже если ждущих нет
+            raise
+        else:
+            future.set_result(result)
+            self._remember(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def stream(self, key: str, open_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Streams the chunks of `open_stream()`, sharing one upstream stream between concurrent consumers.
+
+        The upstream is consumed by a background task, so it is not interrupted if one of the consumers
+        stops early. Every consumer receives all chunks from the beginning.
+
+        :param key: Request key (see request_key).
+        :param open_stream: Function returning the upstream async iterator.
+        :returns: An async iterator over the chunks.
+        """
+        self.stats["calls"] += 1
+        found, chunks = self._cached(key)
+        if found:
+            self.stats["cache_hits"] += 1
+            for chunk in chunks:
+                yield chunk
+            return
+
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream()
+            self._streams[key] = shared
+            self.stats["upstream"] += 1
+            pump = asyncio.create_task(self._pump(key, shared, open_stream))
+            self._pumps.add(pump)
+            pump.add_done_callback(self._pumps.discard)
+        else:
+            self.stats["coalesced"] += 1
+
+        position = 0
+        while True:
+            async with shared.condition:
+                await shared.condition.wait_for(lambda: len(shared.chunks) > position or shared.done)
+                new_chunks = shared.chunks[position:]
+                done, error = shared.done, shared.error
+            for chunk in new_chunks:
+                yield chunk
+            position += len(new_chunks)
+            if done and position >= len(shared.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def _pump(self, key: str, shared: _SharedStream, open_stream: Callable[[], AsyncIterator[str]]) -> None:
+        try:
+            async for chunk in open_stream():
+                async with shared.condition:
+                    shared.chunks.append(chunk)
+                    shared.condition.notify_all()
+        except asyncio.CancelledError as e:
+            shared.error = e
+            raise
+        except Exception as e:
+            shared.error = e
+        finally:
+            self._streams.pop(key, None)
+            if shared.error is None:
+                self._remember(key, list(shared.chunks))
+            async with shared.condition:
+                shared.done = True
+                shared.condition.notify_all()
@@ -0,0 +1,178 @@
+import hashlib
+from datetime import datetime, timedelta
+from typing import List, Dict, Set, Tuple, Hashable
+import numpy as np
+from src.utils.text import tokenize
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def shingles(text: str, size: int = 2) -> Set[str]:
+    """
+    Builds a set of word shingles from the normalized text of a post.
+
+    :param text: Raw post text.
+    :param size: Number of words in a shingle. Short posts fall back to single words.
+    :returns: A set of shingles (empty for posts without text).
+    """
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return set(tokens)
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures with universal hashing (a * x + b) mod p, vectorized over permutations."""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1) -> None:
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = generator.randint(1, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = generator.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    @staticmethod
+    def _hash_shingles(items: Set[str]) -> np.ndarray:
+        return np.fromiter(
+            (int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=4).digest(), "big") for item in items),
+            dtype=np.uint64,
+            count=len(items),
+        )
+
+    def signature(self, items: Set[str]) -> np.ndarray:
+        """
+        Computes the MinHash signature of a set of shingles.
+
+        :param items: A non-empty set of shingles.
+        :returns: An array of num_perm uint64 values.
+        """
+        hashes = self._hash_shingles(items)
+        # Переполнение uint64 здесь ожидаемо - это часть хэш-функции
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Estimates the Jaccard similarity of two sets from their signatures."""
+        return float(np.count_nonzero(first == second)) / len(first)
+
+
+class StoryIndex:
+    """
+    Assigns posts to stories using MinHash signatures and an LSH band index.
+
+    Every story is represented by the signature of its first post. A new post is compared only with
+    the stories that share at least one LSH band with it, so matching takes sublinear time in the number
+    of indexed stories. Story ids are the keys of the posts that opened them, so they are shared between
+    all users that read the same channels.
+    """
+
+    def __init__(
+        self, num_perm: int = 128, bands: int = 32, threshold: float = 0.5, ttl: timedelta = timedelta(hours=24)
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.ttl = ttl
+
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._story_posts: Dict[str, List[Hashable]] = {}
+        self._story_updated: Dict[str, datetime] = {}
+        self._post_story: Dict[Hashable, str] = {}
+        self._last_prune = datetime.utcnow()
+
+    def __len__(self) -> int:
+        return len(self._story_posts)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _find_story(self, signature: np.ndarray) -> str | None:
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+
+        best_story, best_similarity = None, self.threshold
+        for story_id in candidates:
+            similarity = MinHasher.similarity(signature, self._signatures[story_id])
+            if similarity >= best_similarity:
+                best_story, best_similarity = story_id, similarity
+        return best_story
+
+    def add(self, post_key: Hashable, text: str, timestamp: datetime | None = None) -> str:
+        """
+        Adds a post to the index and returns the id of its story.
+
+        Adding the same post twice returns the story it was assigned to the first time.
+
+        :param post_key: Unique key of the post, e.g. (channel, message_id).
+        :param text: Raw post text.
+        :param timestamp: Time of the post, defaults to now (UTC). Used for expiration.
+        :returns: The story id.
+        """
+        if post_key in self._post_story:
+            return self._post_story[post_key]
+
+        timestamp = timestamp or datetime.utcnow()
+        post_shingles = shingles(text)
+        signature = self.hasher.signature(post_shingles) if post_shingles else None
+        story_id = self._find_story(signature) if signature is not None else None
+
+        if story_id is None:
+            story_id = "/".join(map(str, post_key)) if isinstance(post_key, tuple) else str(post_key)
+            self._story_posts[story_id] = []
+            if signature is not None:
+                self._signatures[story_id] = signature
+                for key in self._band_keys(signature):
+                    self._buckets.setdefault(key, set()).add(story_id)
+
+        self._story_posts[story_id].append(post_key)
+        self._story_updated[story_id] = max(timestamp, self._story_updated.get(story_id, timestamp))
+        self._post_story[post_key] = story_id
+        return story_id
+
+    def story_of(self, post_key: Hashable) -> str | None:
+        """Returns the story id of an indexed post or None."""
+        return self._post_story.get(post_key)
+
+    def posts(self, story_id: str) -> List[Hashable]:
+        """Returns the keys of all posts of a story."""
+        return list(self._story_posts.get(story_id, ()))
+
+    def prune(self, now: datetime | None = None, min_interval: timedelta = timedelta(0)) -> int:
+        """
+        Removes stories that were not updated during the last ttl.
+
+        :param now: Current time (UTC), defaults to now.
+        :param min_interval: Skip pruning if the previous one ran less than min_interval ago.
+        :returns: Number of removed stories.
+        """
+        now = now or datetime.utcnow()
+        if now - self._last_prune < min_interval:
+            return 0
+        self._last_prune = now
+
+        cutoff = now - self.ttl
+        expired = [story_id for story_id, updated in self._story_updated.items() if updated < cutoff]
+
+        for story_id in expired:
+            signature = self._signatures.pop(story_id, None)
+            if signature is not None:
+                for key in self._band_keys(signature):
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(story_id)
+                        if not bucket:
+                            del self._buckets[key]
+            for post_key in self._story_posts.pop(story_id):
+                self._post_story.pop(post_key, None)
+            del self._story_updated[story_id]
+        return len(expired)
@@ -0,0 +1,123 @@
+import math
+import statistics
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+# Вес пересылки относительно просмотра: пересылают гораздо реже, чем читают
+FORWARD_WEIGHT = 20
+
+
+class StoryRanker:
+    """
+    Local relevance ranking of a user's stories, used to send only the top-K of them to the LLM.
+
+    Every story gets a score from cheap features, no model calls:
+    - engagement: views and forwards of the story's posts, relative to the median of the same channel,
+      so small channels are not drowned by big ones;
+    - coverage: how many posts (across all channels, not only the user's) covered the story;
+    - novelty: exponential decay with the age of the story's first post;
+    - length: posts shorter than `min_words` words (announcements, ads, "подробности по ссылке") are penalized;
+    - topic interest: the share of the user's channels that have the topic of the story's channel.
+    """
+
+    def __init__(
+        self,
+        half_life: timedelta = timedelta(hours=6),
+        min_words: int = 15,
+        weights: Dict[str, float] | None = None,
+    ) -> None:
+        self.half_life = half_life
+        self.min_words = min_words
+        self.weights = {"engagement": 1.0, "coverage": 1.0, "novelty": 1.0, "length": 0.5, "topic": 1.0}
+        self.weights.update(weights or {})
+
+    @staticmethod
+    def _engagement(post: Dict[str, Any]) -> float:
+        return post.get("views", 0) + FORWARD_WEIGHT * post.get("forwards", 0)
+
+    @staticmethod
+    def topic_interest(channel_topics: Dict[Any, List[str]]) -> Dict[str, float]:
+        """
+        Share of the user's channels per topic.
+
+        :param channel_topics: Channel id -> topics of the user's channels (see SupabaseDB.fetch_user_channels).
+        :returns: Topic -> share of the channels that have it, from 0 to 1.
+        """
+        if not channel_topics:
+            return {}
+        counts: Dict[str, int] = {}
+        for topics in channel_topics.values():
+            for topic in set(topics or []):
+                counts[topic] = counts.get(topic, 0) + 1
+        return {topic: count / len(channel_topics) for topic, count in counts.items()}
+
+    def features(
+        self,
+        story: Dict[str, Any],
+        coverage: int,
+        channel_medians: Dict[Any, float],
+        channel_topics: Dict[Any, List[str]],
+        interest: Dict[str, float],
+        now: datetime,
+    ) -> Dict[str, float]:
+        """Computes the features of one story, every one roughly in the 0..3 range."""
+        posts = story["posts"]
+        engagement = max(
+            self._engagement(post) / max(channel_medians.get(post["channel_id"], 0.0), 1.0) for post in posts
+        )
+        age = (now - min(post["message_date"] for post in posts)).total_seconds()
+        words = max(len(post["message"].split()) for post in posts)
+        topic = max(
+            (interest.get(topic, 0.0) for post in posts for topic in channel_topics.get(post["channel_id"]) or []),
+            default=0.0,
+        )
+        return {
+            "engagement": math.log1p(engagement),
+            "coverage": math.log(max(coverage, 1)),
+            "novelty": 0.5 ** (max(age, 0.0) / self.half_life.total_seconds()),
+            "length": min(1.0, words / self.min_words),
+            "topic": topic,
+        }
+
+    def rank(
+        self,
+        stories: List[Dict[str, Any]],
+        coverage: Dict[str, int] | None = None,
+        channel_topics: Dict[Any, List[str]] | None = None,
+        now: datetime | None = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Orders stories by relevance for the user, best first.
+
+        :param stories: Stories with their posts (see StoryPool.collect); posts need 'views' and 'forwards'.
+        :param coverage: Story id -> number of posts that covered the story across all channels.
+        :param channel_topics: Channel id -> topics of the user's channels.
+        :param now: Current time (naive UTC), defaults to utcnow.
+        :returns: The same stories, sorted by score.
+        """
+        if not stories:
+            return []
+        coverage = coverage or {}
+        channel_topics = channel_topics or {}
+        now = now or datetime.utcnow()
+
+        # Медиана вовлечённости по каналу считается по постам этой же выборки
+        channel_values: Dict[Any, List[float]] = {}
+        for story in stories:
+            for post in story["posts"]:
+                channel_values.setdefault(post["channel_id"], []).append(self._engagement(post))
+        channel_medians = {channel_id: statistics.median(values) for channel_id, values in channel_values.items()}
+        interest = self.topic_interest(channel_topics)
+
+        def score(story: Dict[str, Any]) -> float:
+            features = self.features(
+                story, coverage.get(story["story_id"], len(story["posts"])), channel_medians, channel_topics, interest, now
+            )
+            return sum(self.weights.get(name, 0.0) * value for name, value in features.items())
+
+        return sorted(stories, key=score, reverse=True)
+
+
+def top_k(stories: List[Dict[str, Any]], k: int | None) -> List[Dict[str, Any]]:
+    """Returns the first k ranked stories; k of None or 0 means no limit."""
+    return stories[:k] if k else stories
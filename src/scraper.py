@@ -4,11 +4,21 @@ import logging
 from datetime import datetime, timedelta
 from aiogram import Bot
 from telethon import TelegramClient, errors
-from typing import List, Dict, Union
-from src.data.database import supabase
-from src.data.database import SupabaseDB
+from typing import List, Dict, Union, AsyncIterator
+from src.data.database import create_db
+from src.data.write_behind import WriteBehindBuffer
 from src.config.config import TELEGRAM_BOT_TOKEN, API_ID, API_HASH, PHONE_NUMBER, MISTRAL_KEY, DEACTIVATE_USER
+from src.config.config import DEDUP_SIMILARITY_THRESHOLD, STORY_SIMILARITY_THRESHOLD, STORY_TICK_INTERVAL
+from src.config.config import DIGEST_LOOKBACK_OVERLAP, DIGEST_MAX_LOOKBACK
+from src.config.config import DIGEST_TOP_K, RANKING_HALF_LIFE
+from src.config.config import DB_WRITE_BEHIND_MAX_BATCH, DB_WRITE_BEHIND_FLUSH_INTERVAL, DB_WRITE_BEHIND_MAX_RETRIES
 from src.summarization import Summarization
+from src.minhash import StoryIndex
+from src.stories import StoryPool, DIGEST_OVERHEAD_TOKENS
+from src.ranking import StoryRanker, top_k
+from src.digest import block_topic, split_message
+from src.llm.metrics import llm_context
+from src.llm.budget import LEVEL_FULL, LEVEL_TOP_K, LEVEL_CHEAP_MODEL, LEVEL_EXTRACTIVE
 from telethon.tl.types import Channel, Chat
 
 TIME_RANGE_24H = timedelta(hours=24)
@@ -65,10 +75,25 @@ async def close_telethon_client():
 
 class TelegramScraper:
     running_tasks = {}
+    # Общий для всех пользователей пул сюжетов: каналы скрапятся и сюжеты суммаризируются один раз за тик
+    story_pool = StoryPool(
+        StoryIndex(threshold=STORY_SIMILARITY_THRESHOLD),
+        tick=timedelta(seconds=STORY_TICK_INTERVAL),
+        dedup_threshold=DEDUP_SIMILARITY_THRESHOLD,
+    )
+    ranker = StoryRanker(half_life=timedelta(seconds=RANKING_HALF_LIFE))
+    # Записи, которых никто не ждёт, уходят в БД пачками в фоне, а не на пути доставки дайджеста
+    write_buffer = WriteBehindBuffer(
+        create_db(),
+        max_batch=DB_WRITE_BEHIND_MAX_BATCH,
+        flush_interval=DB_WRITE_BEHIND_FLUSH_INTERVAL,
+        max_retries=DB_WRITE_BEHIND_MAX_RETRIES,
+    )
 
     def __init__(self, user_id: int):
         self.user_id = user_id
-        self.db = SupabaseDB(supabase)
+        self.db = create_db()
+        self.writes = TelegramScraper.write_buffer
         self.bot = Bot(token=TELEGRAM_BOT_TOKEN)
         self.summarizer = Summarization(api_key=MISTRAL_KEY)
         self.deactivate_user = DEACTIVATE_USER
@@ -110,6 +135,8 @@ class TelegramScraper:
                  - 'message': The text content of the message.
                  - 'message_date': The timestamp of when the message was sent.
                  - 'channel_title': The title of the channel.
+                 - 'views': Number of views of the message.
+                 - 'forwards': Number of forwards of the message.
         :raises: Exception if message scraping fails.
         """
         client = await init_telethon_client()
@@ -136,7 +163,9 @@ class TelegramScraper:
                             "message_id": message.id,
                             "message": message.text,
                             "message_date": message.date,
-                            "channel_title": channel_title
+                            "channel_title": channel_title,
+                            "views": message.views or 0,
+                            "forwards": message.forwards or 0,
                         })
                     else:
                         break
@@ -149,73 +178,113 @@ class TelegramScraper:
                 break
         return messages
 
-    async def check_new_messages(self, user_id: int, time_range: timedelta):
+    async def check_new_messages(self, user_id: int, time_range: timedelta, user_channels: List[Dict] | None = None):
         """
         Check for new messages from channels associated with the user and send a digest.
 
         This method retrieves the user's channels from the database, scrapes recent messages from each channel
-        within the specified time range, saves them to the database, and then creates and sends a digest to the user.
+        published since the previous run, saves them to the database, and then creates and sends a digest to the user.
+        Posts the user has already received (see SupabaseDB.fetch_delivered_posts) are skipped, and the topics
+        of the previous digest are reused when clustering. LLM calls are attributed to the user and the digest
+        in Summarization.metrics.
 
         :param user_id: The unique identifier of the user.
-        :param time_range: The time range (as timedelta) to consider for new messages.
+        :param time_range: The time range (as timedelta) to consider for new messages on the first run.
+        :param user_channels: The user's channels if they are already loaded (see SupabaseDB.fetch_users_channels).
         :return: None.
         :raises: Exception if checking messages or sending the digest fails.
         """
+        digest_id = f"{user_id}:{datetime.utcnow():%Y%m%dT%H%M%S}"
+        with llm_context(user_id=user_id, digest_id=digest_id):
+            await self._check_new_messages(user_id, time_range, user_channels)
+        usage = Summarization.metrics.digest(digest_id)
+        if usage["calls"]:
+            logging.info("LLM usage for digest %s: %s", digest_id, usage)
+
+    async def _check_new_messages(self, user_id: int, time_range: timedelta, user_channels: List[Dict] | None = None):
+        """Builds and sends the digest, see check_new_messages."""
         try:
-            user_channels = await self.db.fetch_user_channels(user_id)
+            if not user_channels:
+                # Пустой предзагруженный список перепроверяем отдельным запросом
+                user_channels = await self.db.fetch_user_channels(user_id)
             if not user_channels:
                 await self.bot.send_message(user_id, "❌ У вас нет добавленных каналов.")
                 return
 
             now = datetime.utcnow()
-            start_time = now - time_range
-            aggregated_news = []
-
-            for channel in user_channels:
-                messages = await self.scrape_messages(channel["channel_name"], limit=100)
-                if not messages:
-                    continue
-
-                recent_messages = [
-                    msg for msg in messages
-                    if msg["message_date"].replace(tzinfo=None) >= start_time
-                ]
-
-                for msg in recent_messages:
-                    await self.db.save_channel_news(channel["channel_id"],
-                                                    msg["message"],
-                                                    msg["message_date"].isoformat()
-                                                    )
-                    aggregated_news.append({
-                        "channel": channel["channel_name"].lstrip("@"),
-                        "message": msg["message"],
-                        "message_id": msg["message_id"],
-                        "channel_title": msg.get("channel_title", channel["channel_name"].lstrip("@"))
-                    })
-                await asyncio.sleep(1)
+            # Смотрим назад с момента прошлого запуска (с небольшим запасом), а не на фиксированный интервал:
+            # дрейф расписания не приводит к пропускам, а повторы отсекает журнал доставленных постов
+            state = await self.db.fetch_digest_state(user_id)
+            period_start = state["last_run_timestamp"] if state else now - time_range
+            period_start = max(period_start, now - timedelta(seconds=DIGEST_MAX_LOOKBACK))
+            start_time = period_start - timedelta(seconds=DIGEST_LOOKBACK_OVERLAP) if state else period_start
+            previous_topics = state["topics"] if state else []
+
+            # Скрапинг каналов и суммаризация сюжетов общие для всех пользователей
+            stories = await TelegramScraper.story_pool.collect(self, user_channels, since=start_time)
+            delivered = await self.db.fetch_delivered_posts(
+                user_id, since=(now - timedelta(seconds=DIGEST_MAX_LOOKBACK)).isoformat()
+            )
+            stories = TelegramScraper.story_pool.unseen(stories, delivered)
+
+            if not stories:
+                await self.db.save_digest_state(user_id, now.isoformat(), previous_topics)
+                return
+
+            # Локальное ранжирование: в LLM уходят только top-K сюжетов, K настраивается пользователем
+            channel_topics = {channel["channel_id"]: channel["channel_topic"] for channel in user_channels}
+            stories = TelegramScraper.story_pool.rank(stories, TelegramScraper.ranker, channel_topics)
+            user_top_k = await self.db.get_user_top_k(user_id)
+            stories = top_k(stories, DIGEST_TOP_K if user_top_k is None else user_top_k)
+
+            plan = None
+            if Summarization.budget is not None:
+                plan = Summarization.budget.plan(
+                    user_id,
+                    TelegramScraper.story_pool.estimate_tokens(stories),
+                    overhead=DIGEST_OVERHEAD_TOKENS,
+                    cheap_model=self.summarizer.cheapest_model(),
+                    # Бюджет делится между всеми, кто получает новости, а не между успевшими его запросить
+                    expected_users=len(TelegramScraper.running_tasks),
+                )
+                if plan.level != LEVEL_FULL:
+                    logging.info("Не хватает бюджета токенов: дайджест пользователя %s строится в режиме %s",
+                                 user_id, plan.level)
+                if plan.level == LEVEL_TOP_K:
+                    stories = stories[:plan.max_items]
 
-            if aggregated_news:
-                summaries = await self.summarizer.summarize_news_items(aggregated_news)
-                digest = await self.summarizer.cluster_summaries(summaries)
+            try:
+                with llm_context(cheap_model=plan is not None and plan.level == LEVEL_CHEAP_MODEL):
+                    if plan is not None and plan.level == LEVEL_EXTRACTIVE:
+                        summaries = TelegramScraper.story_pool.render_summaries(
+                            stories, TelegramScraper.story_pool.extractive_summaries(stories)
+                        )
+                        blocks = self.summarizer.local_digest(summaries)
+                    else:
+                        await TelegramScraper.story_pool.summarize(stories, self.summarizer)
+                        summaries = TelegramScraper.story_pool.render_summaries(stories)
+                        blocks = self.summarizer.stream_cluster_summaries(summaries, previous_topics)
+                    if not summaries:
+                        logging.warning("Нет суммаризированных сюжетов для пользователя %s", user_id)
+                        return
+                    # Части дайджеста отправляются по мере готовности кластеров, не дожидаясь конца ответа LLM
+                    digest = await self._deliver_digest(user_id, blocks, now - period_start)
+            finally:
+                if plan is not None:
+                    Summarization.budget.release(plan)
+            if digest:
                 creation_timestamp = datetime.now().isoformat()
-                await self.db.save_user_digest(user_id, digest, creation_timestamp)
-                
-                # Разбиваем на части сообщение
-                try:
-                    digest_parts = await self._split_digest(digest) # обозначаем части сообщения (part)
-                except Exception as e:
-                    logging.error("Ошибка в _split_digest: %s", e)
-
-                for index, part in enumerate(digest_parts, 1):
-
-                    prefix = f"<b>Часть {index} из {len(digest_parts)}</b>\n\n" if len(digest_parts) > 1 else ""
-                    await self.bot.send_message(
-                        user_id,
-                        f"📢 <b>Ваш дайджест за последние {int(time_range.total_seconds() // 60)} минут:</b>\n{prefix}\n{part}",
-                        parse_mode="HTML",
-                        disable_web_page_preview=True
-                    )
-                    await asyncio.sleep(1)  # Пауза между сообщениями
+                await self.writes.save_user_digest(user_id, digest, creation_timestamp)
+                await self.db.save_delivered_posts(
+                    user_id,
+                    [
+                        {**post, "story_id": TelegramScraper.story_pool.resolve(story["story_id"])}
+                        for story in stories for post in story["posts"]
+                    ],
+                    now.isoformat(),
+                )
+                topics = [topic for topic in map(block_topic, digest.split("\n\n")) if topic]
+                await self.db.save_digest_state(user_id, now.isoformat(), topics or previous_topics)
 
         except Exception as e:
             logging.error("\nОшибка в check_new_messages для пользователя %s: %s\n", user_id, e)
@@ -226,39 +295,40 @@ class TelegramScraper:
                 # chat not found
                 if "chat not found" in error_message:
                     logging.error(f"Чат с пользователем {user_id} не найден. ⚠️ Деактивация.")
-                    await self.db.set_user_receiving_news(user_id, False)  # Деактивируем
+                    await self.writes.set_user_receiving_news(user_id, False)  # Деактивируем
                     TelegramScraper.stop_auto_news_check(user_id)  # Останавливаем задачи
 
                 # При заблокированном боте
                 elif "bot was blocked by the user" in error_message:
                     logging.error(f"Пользователь {user_id} заблокировал бота. ⚠️ Деактивация.")
-                    await self.db.set_user_receiving_news(user_id, False)
+                    await self.writes.set_user_receiving_news(user_id, False)
                     TelegramScraper.stop_auto_news_check(user_id)
 
                 else:
                     await self.bot.send_message(user_id, "❌ Ошибка при получении дайджеста. Попробуйте позже.")
 
-    async def start_auto_news_check(self, user_id: int, interval: int = 3600):
+    async def start_auto_news_check(self, user_id: int, interval: int = 3600, user_channels: List[Dict] | None = None):
         """
         Start a background task to periodically check for new messages and update the user's digest.
 
         This method initiates a continuous background loop that, at every interval, checks for new messages
-        across the user's subscribed channels, updates the digest, and cleans up old news from the database.
+        across the user's subscribed channels and updates the digest. Old rows are removed by the bot's
+        retention task (see enforce_retention), not per user.
 
         :param user_id: The unique identifier of the user.
         :param interval: The time interval in seconds between successive checks. Defaults to 1800 seconds (30 minutes).
+        :param user_channels: The user's channels preloaded for the first check, e.g. when all tasks start at once.
         :return: None.
         :raises: Exception if the background task fails to start.
         """
-        db = SupabaseDB(supabase)
+        db = create_db()
         interval = await db.get_user_interval(user_id)
         logging.info("\n🔍 Запускаю фоновую проверку для пользователя %s (интервал %s мин)...\n", user_id, interval // 60)
 
-        await self.db.cleanup_old_news()
-
         while user_id in TelegramScraper.running_tasks:
             logging.info("\n🔄 Проверка новых сообщений для %s...\n", user_id)
-            await self.check_new_messages(user_id, time_range=timedelta(seconds=interval))  # Проверяем новые сообщения за последний час
+            await self.check_new_messages(user_id, time_range=timedelta(seconds=interval), user_channels=user_channels)
+            user_channels = None  # дальше каналы читаются заново: пользователь мог их изменить
             logging.info("\n✅ Проверка завершена %s. Следующая через %s минут.\n",
                          datetime.now().strftime('%Y-%m-%d %H:%M:%S'), interval // 60)
 
@@ -333,26 +403,58 @@ class TelegramScraper:
                 break
         return messages
 
+    async def _deliver_digest(self, user_id: int, blocks: AsyncIterator[str], time_range: timedelta,
+                              max_length: int = 4096) -> str:
+        """
+        Sends a digest to the user part by part while its topic blocks are still being generated.
+
+        Blocks are packed into messages; a message is sent as soon as the next block does not fit into it,
+        so the first part reaches the user before the LLM finishes the whole digest.
+
+        :param user_id: The unique identifier of the user.
+        :param blocks: Async iterator over HTML blocks of the digest (one per topic).
+        :param time_range: The time range of the digest, shown in the header.
+        :param max_length: Telegram message length limit.
+        :return: The full digest text (empty if nothing was generated).
+        """
+        header = f"📢 <b>Ваш дайджест за последние {int(time_range.total_seconds() // 60)} минут:</b>\n"
+        # Оставляем место под заголовок и номер части
+        part_length = max_length - len(header) - 32
+        sent_blocks = []
+        part_index = 0
+
+        async def send_part(part: str) -> None:
+            nonlocal part_index
+            part_index += 1
+            prefix = f"<b>Часть {part_index}</b>\n\n" if part_index > 1 else ""
+            await self.bot.send_message(
+                user_id,
+                f"{header}{prefix}\n{part}",
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+            await asyncio.sleep(1)  # Пауза между сообщениями
+
+        current = ""
+        async for block in blocks:
+            sent_blocks.append(block)
+            candidate = f"{current}\n\n{block}" if current else block
+            if len(candidate) <= part_length:
+                current = candidate
+                continue
+
+            if current:
+                await send_part(current)
+            # Блок сам по себе может не помещаться в одно сообщение
+            pieces = await self._split_digest(block, part_length)
+            for piece in pieces[:-1]:
+                await send_part(piece)
+            current = pieces[-1]
+
+        if current:
+            await send_part(current)
+        return "\n\n".join(sent_blocks)
+
     ### Сплитер для сообщений
     async def _split_digest(self, text: str, max_length: int = 4096) -> list[str]:
-        parts = []
-        while text:
-            # Ищем безопасное место для разбивки, чтобы не разрывать теги
-            if len(text) <= max_length:
-                parts.append(text)
-                break
-
-            # Ищем последний закрывающий тег в пределах max_length
-            split_pos = text.rfind('</a>', 0, max_length)
-            if split_pos != -1:
-                split_pos += 4  # Включаем сам тег </a>
-            else:
-                # Если тегов нет, разбиваем по последнему переносу строки
-                split_pos = text.rfind('\n', 0, max_length)
-                if split_pos == -1:
-                    # Если нет переносов, принудительно обрезаем
-                    split_pos = max_length
-
-            parts.append(text[:split_pos])
-            text = text[split_pos:].lstrip()
-        return parts
\ No newline at end of file
+        return split_message(text, max_length)
\ No newline at end of file
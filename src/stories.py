@@ -0,0 +1,275 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Tuple
+from src.digest import format_source_links
+from src.dedup import deduplicate_news
+from src.minhash import StoryIndex
+from src.extractive import extractive_summaries
+from src.ranking import StoryRanker
+from src.llm.backends import estimate_tokens
+from src.llm.metrics import llm_context
+
+# Оценка токенов на сюжет: ответ суммаризации и строка сюжета в запросе и ответе кластеризации
+SUMMARY_TOKENS = 60
+CLUSTER_TOKENS_PER_STORY = 70
+# Оценка токенов дайджеста, не зависящих от числа сюжетов (инструкции в запросах)
+DIGEST_OVERHEAD_TOKENS = 400
+
+PostKey = Tuple[str, int]
+
+
+class StoryPool:
+    """
+    Global story stage shared by all user digests.
+
+    Every channel is scraped at most once per tick, no matter how many users read it, and its posts
+    are assigned to stories in a shared StoryIndex. Each story is summarized once; a user's digest is
+    a selection of the stories that contain posts from the user's channels. Summarization cost is thus
+    proportional to the number of stories, not to users × posts.
+    """
+
+    def __init__(
+        self,
+        index: StoryIndex,
+        tick: timedelta = timedelta(minutes=5),
+        dedup_threshold: float = 0.5,
+        batch_size: int = 30,
+        scrape_pause: float = 1.0,
+    ) -> None:
+        self.index = index
+        self.tick = tick
+        self.dedup_threshold = dedup_threshold
+        self.batch_size = batch_size
+        self.scrape_pause = scrape_pause  # пауза после скрапинга канала, чтобы не упираться в лимиты Telegram
+
+        self._channel_posts: Dict[str, List[Dict[str, Any]]] = {}
+        self._channel_fetched: Dict[str, datetime] = {}
+        self._channel_locks: Dict[str, asyncio.Lock] = {}
+        self._story_posts: Dict[str, Dict[PostKey, Dict[str, Any]]] = {}
+        self._summaries: Dict[str, str] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._aliases: Dict[str, str] = {}
+
+    def resolve(self, story_id: str) -> str:
+        """Returns the canonical id of a story that may have been merged into another one."""
+        while story_id in self._aliases:
+            story_id = self._aliases[story_id]
+        return story_id
+
+    def prune(self) -> None:
+        """Drops stories that expired in the index, at most once per hour."""
+        if not self.index.prune(min_interval=timedelta(hours=1)):
+            return
+        expired = [story_id for story_id in self._story_posts if not self.index.posts(story_id)]
+        for story_id in expired:
+            self._story_posts.pop(story_id, None)
+            self._summaries.pop(story_id, None)
+        self._aliases = {
+            alias: target for alias, target in self._aliases.items()
+            if alias in self._story_posts and target in self._story_posts
+        }
+
+    async def _refresh_channel(self, scraper, channel: Dict[str, Any]) -> None:
+        """Scrapes a channel unless it was already scraped during the current tick."""
+        channel_name = channel["channel_name"]
+        lock = self._channel_locks.setdefault(channel_name, asyncio.Lock())
+        async with lock:
+            fetched = self._channel_fetched.get(channel_name)
+            if fetched and datetime.utcnow() - fetched < self.tick:
+                return
+
+            messages = await scraper.scrape_messages(channel_name, limit=100)
+            self._channel_fetched[channel_name] = datetime.utcnow()
+
+            posts, new_messages = [], []
+            for msg in messages:
+                if not msg["message"]:
+                    continue
+                post = {
+                    "channel": channel_name.lstrip("@"),
+                    "channel_id": channel["channel_id"],
+                    "message": msg["message"],
+                    "message_id": msg["message_id"],
+                    "message_date": msg["message_date"].replace(tzinfo=None),
+                    "channel_title": msg.get("channel_title", channel_name.lstrip("@")),
+                    "views": msg.get("views") or 0,
+                    "forwards": msg.get("forwards") or 0,
+                }
+                key = (post["channel"], post["message_id"])
+                if self.index.story_of(key) is None:
+                    new_messages.append(msg)
+                story_id = self.index.add(key, post["message"], post["message_date"])
+                self._story_posts.setdefault(story_id, {})[key] = post
+                posts.append(post)
+
+            # Одна запись на скрапинг канала; повторы после рестарта отсекает ключ (channel_id, message_id) в БД
+            await scraper.writes.save_channel_news_batch(channel["channel_id"], new_messages)
+            self._channel_posts[channel_name] = posts
+            await asyncio.sleep(self.scrape_pause)
+
+    async def collect(self, scraper, channels: List[Dict[str, Any]], since: datetime) -> List[Dict[str, Any]]:
+        """
+        Returns the stories that contain posts from the given channels published after `since`.
+
+        :param scraper: TelegramScraper used to scrape channels that are stale.
+        :param channels: The user's channels (dictionaries with 'channel_name' and 'channel_id').
+        :param since: Only posts published after this moment (naive UTC) are selected.
+        :returns: A list of dictionaries with keys 'story_id' and 'posts' (the user's posts of the story).
+        """
+        self.prune()
+        for channel in channels:
+            await self._refresh_channel(scraper, channel)
+
+        selected: Dict[str, List[Dict[str, Any]]] = {}
+        for channel in channels:
+            for post in self._channel_posts.get(channel["channel_name"], []):
+                if post["message_date"] < since:
+                    continue
+                story_id = self.index.story_of((post["channel"], post["message_id"]))
+                if story_id is not None:
+                    selected.setdefault(story_id, []).append(post)
+
+        return [{"story_id": story_id, "posts": posts} for story_id, posts in selected.items()]
+
+    def unseen(self, stories: List[Dict[str, Any]], delivered: Dict[PostKey, str]) -> List[Dict[str, Any]]:
+        """
+        Drops what the user has already received: posts that were delivered before, and whole stories
+        that were delivered before (e.g. another channel reposted the same news later).
+
+        :param stories: Stories returned by collect.
+        :param delivered: (channel, message_id) -> story id the post was delivered in (see SupabaseDB.fetch_delivered_posts).
+        :returns: Stories with new posts only.
+        """
+        delivered_stories = {self.resolve(story_id) for story_id in delivered.values()}
+        unseen = []
+        for story in stories:
+            if self.resolve(story["story_id"]) in delivered_stories:
+                continue
+            posts = [post for post in story["posts"] if (post["channel"], post["message_id"]) not in delivered]
+            if posts:
+                unseen.append({"story_id": story["story_id"], "posts": posts})
+        return unseen
+
+    def _representative(self, story_id: str) -> Dict[str, Any]:
+        posts = self._story_posts[story_id].values()
+        representative = max(posts, key=lambda post: len(post["message"]))
+        return {**representative, "story_id": story_id}
+
+    def _merge_duplicates(self, merged_stories: List[Dict[str, Any]]) -> List[str]:
+        """Aliases new stories that TF-IDF merged although MinHash kept them apart; returns canonical ids."""
+        canonical_ids = []
+        for merged in merged_stories:
+            canonical_id = merged["story_id"]
+            canonical_ids.append(canonical_id)
+            for source in merged["sources"]:
+                source_story = self.index.story_of((source["channel"], source["message_id"]))
+                if source_story and source_story != canonical_id:
+                    self._aliases[source_story] = canonical_id
+        return canonical_ids
+
+    async def summarize(self, stories: List[Dict[str, Any]], summarizer) -> None:
+        """
+        Makes sure every given story has a summary.
+
+        Stories that are already summarized (or being summarized for another user) are not sent to the
+        LLM again. New stories are summarized in batches of `batch_size`.
+
+        :param stories: Stories returned by collect.
+        :param summarizer: Summarization instance.
+        """
+        story_ids = {self.resolve(story["story_id"]) for story in stories}
+        waiting = [self._pending[story_id] for story_id in story_ids if story_id in self._pending]
+        new_ids = [story_id for story_id in story_ids if story_id not in self._summaries and story_id not in self._pending]
+
+        if new_ids:
+            loop = asyncio.get_running_loop()
+            futures = {story_id: loop.create_future() for story_id in new_ids}
+            self._pending.update(futures)
+            try:
+                if len(new_ids) > 1:
+                    representatives = [self._representative(story_id) for story_id in new_ids]
+                    merged_stories = await asyncio.to_thread(deduplicate_news, representatives, self.dedup_threshold)
+                    new_ids = self._merge_duplicates(merged_stories)
+                batches = [new_ids[i:i + self.batch_size] for i in range(0, len(new_ids), self.batch_size)]
+                # Сводки сюжетов общие для всех пользователей: в метриках они учитываются отдельно, а не на того,
+                # чей дайджест их запустил. В очереди FairScheduler они идут в потоке этого пользователя: он их и ждёт
+                with llm_context(shared=True):
+                    results = await asyncio.gather(
+                        *(summarizer.summarize_stories([self._representative(story_id) for story_id in batch])
+                          for batch in batches)
+                    )
+                for batch_summaries in results:
+                    self._summaries.update(batch_summaries)
+                logging.info("StoryPool: summarized %s new stories", len(new_ids))
+            finally:
+                for story_id, future in futures.items():
+                    self._pending.pop(story_id, None)
+                    future.set_result(None)
+
+        if waiting:
+            await asyncio.gather(*waiting)
+
+    def rank(
+        self, stories: List[Dict[str, Any]], ranker: StoryRanker, channel_topics: Dict[Any, List[str]] | None = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Orders stories by relevance for the user, best first (see StoryRanker).
+
+        :param stories: Stories returned by collect.
+        :param ranker: StoryRanker instance.
+        :param channel_topics: Channel id -> topics of the user's channels.
+        :returns: The same stories, sorted.
+        """
+        coverage = {story["story_id"]: len(self.index.posts(self.resolve(story["story_id"]))) for story in stories}
+        return ranker.rank(stories, coverage, channel_topics)
+
+    def estimate_tokens(self, stories: List[Dict[str, Any]]) -> List[float]:
+        """
+        Estimates the LLM tokens every story adds to a digest. Stories that are already summarized
+        only cost their share of the clustering request.
+
+        :param stories: Stories returned by collect.
+        :returns: Estimated tokens per story, in the same order.
+        """
+        costs = []
+        for story in stories:
+            story_id = self.resolve(story["story_id"])
+            cost = CLUSTER_TOKENS_PER_STORY
+            if story_id not in self._summaries and story_id not in self._pending and story_id in self._story_posts:
+                cost += estimate_tokens(self._representative(story_id)["message"]) + SUMMARY_TOKENS
+            costs.append(cost)
+        return costs
+
+    def extractive_summaries(self, stories: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Summarizes the stories that have no summary yet without the LLM (see extractive_summary).
+        The result is not cached, so the stories still get an LLM summary when the budget allows.
+
+        :param stories: Stories returned by collect.
+        :returns: Story id -> summary, to be passed to render_summaries.
+        """
+        missing = {self.resolve(story["story_id"]) for story in stories} - set(self._summaries)
+        return extractive_summaries([self._representative(story_id) for story_id in missing if story_id in self._story_posts])
+
+    def render_summaries(self, stories: List[Dict[str, Any]], extra_summaries: Dict[str, str] | None = None) -> str:
+        """
+        Builds the summaries text of a user's digest with links to the user's posts.
+
+        The result is the input of Summarization.stream_cluster_summaries (see parse_summary_items).
+
+        :param stories: Stories returned by collect.
+        :param extra_summaries: Summaries of stories the pool has not summarized (see extractive_summaries).
+        :returns: Summaries with links, or an empty string if nothing was summarized.
+        """
+        merged: Dict[str, List[Dict[str, Any]]] = {}
+        for story in stories:
+            merged.setdefault(self.resolve(story["story_id"]), []).extend(story["posts"])
+
+        lines = []
+        for story_id, posts in merged.items():
+            summary = self._summaries.get(story_id) or (extra_summaries or {}).get(story_id)
+            if not summary:
+                continue
+            lines.append(f"{summary}\n{format_source_links(posts)}")
+        return "\n".join(lines)
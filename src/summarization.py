@@ -1,103 +1,387 @@
+import json
 import logging
 import asyncio
-from mistralai import Mistral
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Tuple, AsyncIterator
 import random
+import time
+from src.digest import parse_summary_items, render_digest, DigestRenderer, ClusterStreamParser
+from src.llm.singleflight import SingleFlight, request_key
+from src.llm.models import ModelSelector, STAGE_SUMMARY, STAGE_CLUSTER, STAGE_TOPIC
+from src.llm.breaker import CircuitBreaker, CircuitOpenError
+from src.llm.metrics import LLMMetrics, current_labels, OUTCOME_OK, OUTCOME_ERROR, OUTCOME_RATE_LIMITED, OUTCOME_CIRCUIT_OPEN
+from src.llm.backends import LLMBackend, MistralBackend, RateLimitError, estimate_tokens
+from src.llm.scheduler import FairScheduler
+from src.llm.budget import TokenBudget
+from src.extractive import extractive_summaries
 
 class Summarization:
-    def __init__(self, api_key: str, model: str = "mistral-large-latest") -> None:
+    # Кэш тем каналов: имя канала -> (время определения, тема). Общий для всех экземпляров
+    _topic_cache: Dict[str, Tuple[float, List[str]]] = {}
+    # Склейка одинаковых одновременных запросов к LLM (общая для всех экземпляров)
+    _singleflight = SingleFlight()
+    # Выбор модели для каждого этапа пайплайна (общий для всех экземпляров)
+    _selector = ModelSelector({})
+    # Быстрый отказ при недоступности API (общий для всех экземпляров)
+    _breaker = CircuitBreaker()
+    # Провайдер LLM; если не задан, используется Mistral API с ключом экземпляра
+    _backend: LLMBackend | None = None
+    # Метрики вызовов LLM: латентность, токены, попытки и стоимость по этапам, пользователям и дайджестам
+    metrics = LLMMetrics()
+    # Ограничение одновременных запросов к API со справедливым разделением между пользователями
+    _scheduler = FairScheduler()
+    # Часовой бюджет токенов; None - без ограничений
+    budget: TokenBudget | None = None
+
+    def __init__(self, api_key: str, model: str = "mistral-large-latest", topic_ttl: int = 7 * 24 * 3600) -> None:
         self.api_key = api_key
-        self.model = model
+        self.model = model  # модель для этапов, для которых не настроены уровни в ModelSelector
+        self.topic_ttl = topic_ttl
+        self._default_backend = MistralBackend(api_key)
+
+    @classmethod
+    def configure(cls, result_cache_ttl: float | None = None, selector: ModelSelector | None = None,
+                  breaker: CircuitBreaker | None = None, backend: LLMBackend | None = None,
+                  scheduler: FairScheduler | None = None, budget: TokenBudget | None = None) -> None:
+        """
+        Configures the state shared by all instances.
+
+        :param result_cache_ttl: How long (in seconds) results of identical requests are reused after completion.
+        :param selector: Model selection policy with model tiers per pipeline stage.
+        :param breaker: Circuit breaker guarding the API calls.
+        :param backend: LLM provider, e.g. FakeBackend for offline load testing.
+        :param scheduler: Queue of the API requests shared fairly between users.
+        :param budget: Hourly token budget of the API.
+        """
+        if result_cache_ttl is not None:
+            cls._singleflight.ttl = result_cache_ttl
+        if selector is not None:
+            cls._selector = selector
+        if breaker is not None:
+            cls._breaker = breaker
+        if backend is not None:
+            cls._backend = backend
+        if scheduler is not None:
+            cls._scheduler = scheduler
+        if budget is not None:
+            cls.budget = budget
+
+    def cheapest_model(self, stage: str = STAGE_SUMMARY) -> str:
+        """Returns the cheapest configured model of a stage."""
+        return self._selector.cheapest(stage, self.model)
+
+    def _select_model(self, stage: str) -> str:
+        # Дайджест, которому не хватило бюджета, строится на самой дешёвой модели этапа
+        if current_labels().get("cheap_model"):
+            return self._selector.cheapest(stage, self.model)
+        return self._selector.select(stage, self.model)
+
+    @property
+    def backend(self) -> LLMBackend:
+        """The configured LLM provider, or the Mistral API."""
+        return Summarization._backend or self._default_backend
+
+    async def _mistral_request(self, prompt: str, max_retries: int = 5, response_format: Dict = None,
+                               stage: str = STAGE_SUMMARY) -> str:
+        """Makes request to the LLM backend. Concurrent identical requests (same model, stage, prompt and
+        response format) share one upstream call, see SingleFlight.
+        :param prompt: The prompt to be made and a number of retries
+        :param response_format: Optional response format, e.g. {"type": "json_object"}
+        :param stage: Pipeline stage, defines the model (see ModelSelector)"""
+        # Модель входит в ключ: запрос на дешёвой модели (бюджет) не получает ответ полной и наоборот
+        model = self._select_model(stage)
+        key = request_key("complete", model, stage, response_format, prompt)
+        return await Summarization._singleflight.do(
+            key, lambda: self._guarded(
+                lambda: self._mistral_call(prompt, max_retries, response_format, stage, model), stage
+            )
+        )
+
+    def _check_breaker(self, stage: str) -> None:
+        try:
+            Summarization._breaker.check()
+        except CircuitOpenError:
+            Summarization.metrics.record(stage, self._selector.select(stage, self.model), OUTCOME_CIRCUIT_OPEN, 0.0, 0)
+            raise
+
+    async def _guarded(self, call, stage: str):
+        """Runs an upstream call through the circuit breaker. Raises CircuitOpenError without
+        calling the API while the breaker is open."""
+        breaker = Summarization._breaker
+        self._check_breaker(stage)
+        try:
+            result = await call()
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return result
+
+    async def _guarded_stream(self, open_stream, stage: str) -> AsyncIterator[str]:
+        """Streaming version of _guarded."""
+        breaker = Summarization._breaker
+        self._check_breaker(stage)
+        try:
+            async for chunk in open_stream():
+                yield chunk
+        except Exception:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+
+    def _backoff_delay(self, e: Exception, retry_delay: float, attempt: int, max_retries: int) -> float:
+        # Учитываем Retry-After, если сервер его прислал
+        retry_after = getattr(e, 'retry_after', None) or retry_delay
+        delay = min(float(retry_after), 60)
+        logging.warning("Rate limit exceeded. Attempt %s/%s. Retrying in %s seconds...",
+                        attempt + 1, max_retries, delay)
+        return delay
+
+    def _record_call(self, stage: str, model: str, outcome: str, started: float, attempts: int,
+                     prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        record = Summarization.metrics.record(
+            stage, model, outcome, time.monotonic() - started, attempts, prompt_tokens, completion_tokens
+        )
+        logging.debug("LLM call: %s", record)
+        if Summarization.budget is not None:
+            Summarization.budget.spend(model, prompt_tokens, completion_tokens)
 
-    async def _mistral_request(self, prompt: str, max_retries: int = 5) -> str:
-        """Makes request to Mistral API with retry&backoff logic
-        :param prompt: The prompt to be made and a number of retries"""
+    async def _mistral_call(self, prompt: str, max_retries: int = 5, response_format: Dict = None,
+                            stage: str = STAGE_SUMMARY, model: str | None = None) -> str:
+        """Makes request to the LLM backend with retry&backoff logic. The model is selected
+        again before every retry, so a rate-limited model can be replaced by a lower tier.
+        :param prompt: The prompt to be made and a number of retries
+        :param response_format: Optional response format, e.g. {"type": "json_object"}
+        :param stage: Pipeline stage, defines the model (see ModelSelector)
+        :param model: Model of the first attempt, selected for the stage if not given"""
 
         retry_delay = 1
-        async with Mistral(api_key=self.api_key) as client:
-            for attempt in range(max_retries):
-                try:
-                    response = await client.chat.complete_async(
-                        model=self.model,
-                        messages=[{"role": "user", "content": prompt}]
-                    )
-                    return response.choices[0].message.content
-                except Exception as e:
-                    if "Status 429" in str(e):
-                        # Проверяем наличие заголовка Retry-After
-                        retry_after = getattr(e, 'headers', {}).get('Retry-After', retry_delay)
-                        retry_delay = min(float(retry_after), 60)
-                        logging.warning("Rate limit exceeded. Attempt %s/%s. Retrying in %s seconds...",
-                                        attempt + 1, max_retries, retry_delay)
-                        await asyncio.sleep(retry_delay + random.uniform(0, 1))
-                        retry_delay *= 2  # Увеличиваем задержку экспоненциально
-                    else:
-                        raise
-                raise Exception("Max retries exceeded")
-
-    async def summarize_news_items(self, news: List[Dict[str, Union[str, int]]]) -> str:
-        """
-        Generates a summarized version of provided news items, clustering similar ones together.
-
-        :param news: A list of dictionaries with keys:
-            {
-              'channel': channel name (without the '@')
-              'message': text of the news
-              'message_id': unique id of the message
-            }
-        :returns: A formatted summary string with links to the original news items.
+        waited = 0.0
+        started = time.monotonic()
+        # Очередь к API общая для всех пользователей, место в ней распределяется по пользователям (см. FairScheduler)
+        user, cost = current_labels().get("user_id"), estimate_tokens(prompt)
+        for attempt in range(max_retries):
+            if attempt or model is None:
+                model = self._select_model(stage)
+            attempt_started = time.monotonic()
+            try:
+                async with Summarization._scheduler.slot(user, cost) as queue_wait:
+                    waited += queue_wait
+                    attempt_started = time.monotonic()
+                    response = await self.backend.complete(model, prompt, response_format)
+            except RateLimitError as e:
+                self._selector.record_rate_limit(model)
+                retry_delay = self._backoff_delay(e, retry_delay, attempt, max_retries)
+                delay = retry_delay + random.uniform(0, 1)
+                await asyncio.sleep(delay)
+                waited += delay
+                retry_delay *= 2  # Увеличиваем задержку экспоненциально
+                continue
+            except Exception:
+                self._selector.record(model, time.monotonic() - attempt_started, waited)
+                self._record_call(stage, model, OUTCOME_ERROR, started, attempt + 1)
+                raise
+
+            self._selector.record(model, time.monotonic() - attempt_started, waited)
+            self._record_call(
+                stage, model, OUTCOME_OK, started, attempt + 1, response.prompt_tokens, response.completion_tokens
+            )
+            return response.content
+        self._record_call(stage, model, OUTCOME_RATE_LIMITED, started, max_retries)
+        raise Exception("Max retries exceeded")
+
+    def _mistral_stream(self, prompt: str, max_retries: int = 5, response_format: Dict = None,
+                        stage: str = STAGE_CLUSTER) -> AsyncIterator[str]:
+        """Streams the response of the LLM backend. Concurrent identical requests (same model, stage, prompt
+        and response format) share one upstream stream, see SingleFlight.stream.
+        :param prompt: The prompt to be made and a number of retries
+        :param response_format: Optional response format, e.g. {"type": "json_object"}
+        :param stage: Pipeline stage, defines the model (see ModelSelector)"""
+        model = self._select_model(stage)
+        key = request_key("stream", model, stage, response_format, prompt)
+        return Summarization._singleflight.stream(
+            key, lambda: self._guarded_stream(
+                lambda: self._mistral_stream_call(prompt, max_retries, response_format, stage, model), stage
+            )
+        )
+
+    async def _mistral_stream_call(self, prompt: str, max_retries: int = 5, response_format: Dict = None,
+                                   stage: str = STAGE_CLUSTER, model: str | None = None) -> AsyncIterator[str]:
+        """Streams the response of the LLM backend chunk by chunk. Rate limit errors are retried
+        with backoff as long as nothing has been received yet.
+        :param prompt: The prompt to be made and a number of retries
+        :param response_format: Optional response format, e.g. {"type": "json_object"}
+        :param stage: Pipeline stage, defines the model (see ModelSelector)
+        :param model: Model of the first attempt, selected for the stage if not given"""
+
+        retry_delay = 1
+        waited = 0.0
+        started = time.monotonic()
+        # Очередь к API общая для всех пользователей, место в ней распределяется по пользователям (см. FairScheduler)
+        user, cost = current_labels().get("user_id"), estimate_tokens(prompt)
+        for attempt in range(max_retries):
+            if attempt or model is None:
+                model = self._select_model(stage)
+            attempt_started = time.monotonic()
+            received = False
+            prompt_tokens = completion_tokens = 0
+            try:
+                async with Summarization._scheduler.slot(user, cost) as queue_wait:
+                    waited += queue_wait
+                    attempt_started = time.monotonic()
+                    async for chunk in self.backend.stream(model, prompt, response_format):
+                        prompt_tokens += chunk.prompt_tokens
+                        completion_tokens += chunk.completion_tokens
+                        if chunk.content:
+                            received = True
+                            yield chunk.content
+            except RateLimitError as e:
+                if received:
+                    self._record_call(stage, model, OUTCOME_ERROR, started, attempt + 1)
+                    raise
+                self._selector.record_rate_limit(model)
+                retry_delay = self._backoff_delay(e, retry_delay, attempt, max_retries)
+                delay = retry_delay + random.uniform(0, 1)
+                await asyncio.sleep(delay)
+                waited += delay
+                retry_delay *= 2
+                continue
+            except Exception:
+                self._selector.record(model, time.monotonic() - attempt_started, waited)
+                self._record_call(stage, model, OUTCOME_ERROR, started, attempt + 1)
+                raise
+
+            self._selector.record(model, time.monotonic() - attempt_started, waited)
+            self._record_call(stage, model, OUTCOME_OK, started, attempt + 1, prompt_tokens, completion_tokens)
+            return
+        self._record_call(stage, model, OUTCOME_RATE_LIMITED, started, max_retries)
+        raise Exception("Max retries exceeded")
+
+    async def summarize_stories(self, stories: List[Dict[str, Union[str, int]]]) -> Dict[str, str]:
+        """
+        Summarizes a batch of stories with one request. Links are not requested from the model,
+        they are built locally from the posts of each story.
+
+        :param stories: A list of dictionaries with keys 'story_id', 'message' and 'channel_title'.
+        :returns: A dictionary mapping story id to its summary. If the API is unavailable, or the model
+            skipped some stories, their summaries are built locally from the lead sentence (see extractive_summary).
         """
-        if not news:
-            return "No news items provided."
+        if not stories:
+            return {}
 
+        items = [
+            {"id": story["story_id"], "channel_title": story["channel_title"], "message": story["message"]}
+            for story in stories
+        ]
         prompt = (
-            f'''You are provided with a list of news items.
-            Each news item is represented as a dictionary with keys 'channel', 'message', 'message_id' and 'channel_title' 
-            Here is the list: {news}. 
-            If some news items are similar in context, cluster them together and produce one summary for the cluster. 
-            Create a list where each line contains a summary in Russian (no longer than 150 characters) and, on the next line, 
-            attach the relevant link(s) to the original news item(s). No need to add any bullet numbers, bullets etc. 
-            Make sure that line with links is preceded with '<i>Источник: </i>' 
-            The link for each news item should be in the format:<a href="https://t.me/{{channel}}/{{message_id}}">{{channel_title}}</a>
-            If clustered, include all relevant links separated by spaces following this symbol | and space again. So this structure: link | link | link. 
-            Make sure to use the exact channel name provided (without a leading '@'). 
-            Structure the output so that each summary is followed on a new line by its corresponding link(s) and separated with \n'''
+            f'''You are provided with a list of news stories.
+            Each story is represented as a dictionary with keys 'id', 'channel_title' and 'message'.
+            Here is the list: {items}.
+            For every story write one summary in Russian, no longer than 150 characters.
+            Do not add links, bullets or numbering to the summaries.
+            Return only a JSON object of the following structure, keeping the story ids unchanged:
+            {{"summaries": [{{"id": "story id", "summary": "text"}}]}}'''
         )
 
         try:
-            return await self._mistral_request(prompt)
+            raw_summaries = await self._mistral_request(prompt, response_format={"type": "json_object"}, stage=STAGE_SUMMARY)
+            data = json.loads(raw_summaries)
         except Exception as e:
-            logging.error("Error during summarization: %s", e)
-            return "Failed to generate the summary."
+            logging.error("Error during story summarization, falling back to extractive summaries: %s", e)
+            return extractive_summaries(stories)
+
+        known_ids = {str(story["story_id"]): story["story_id"] for story in stories}
+        summaries = {}
+        for entry in data.get("summaries", []) if isinstance(data, dict) else []:
+            if not isinstance(entry, dict):
+                continue
+            story_id = known_ids.get(str(entry.get("id")))
+            summary = str(entry.get("summary") or "").replace("\n", " ").strip()
+            if story_id is not None and summary:
+                summaries[story_id] = summary
+
+        skipped = [story for story in stories if story["story_id"] not in summaries]
+        if skipped:
+            logging.warning("Model skipped %s stories, summarizing them extractively", len(skipped))
+            summaries.update(extractive_summaries(skipped))
+        return summaries
 
-    async def cluster_summaries(self, summaries_text: str) -> str:
+    @staticmethod
+    def _cluster_prompt(items: List[Dict[str, Union[str, int]]], previous_topics: List[Dict[str, str]] = None) -> str:
+        numbered_summaries = "\n".join(f"{item['id']}. {item['summary']}" for item in items)
+        previous = ""
+        if previous_topics:
+            labels = "; ".join(f"{topic.get('emoji', '')} {topic['topic']}".strip() for topic in previous_topics)
+            previous = (
+                f"The user's previous digest used these topics: {labels}. "
+                "Reuse the same label and emoji when a summary fits one of them, so the digest structure stays familiar."
+            )
+        return (
+            f''' Please categorize the following numbered news summaries into a maximum of 5 broad, topic-based clusters.
+                Each cluster should be grouped by similar topics. Ensure the topics are broad and general; limit the number of topics to 5.
+                The topic labels must be written in Russian. Each topic should have one relevant emoji.
+                Every summary number must belong to exactly one cluster.
+                {previous}
+                Return only a JSON object of the following structure, without any explanations:
+                {{"clusters": [{{"topic": "Topic label", "emoji": "📌", "items": [1, 2]}}]}}
+                Summaries: \n{numbered_summaries}
+         '''
+        )
+
+    async def stream_cluster_summaries(
+        self, summaries_text: str, previous_topics: List[Dict[str, str]] = None
+    ) -> AsyncIterator[str]:
         """
-        Clusters summarized news items based on similar topics.
+        Clusters summarized news items by topic and yields the rendered HTML block of every topic
+        as soon as the model finishes that cluster.
+
+        The model only receives numbered summaries (without links) and returns the clusters
+        as JSON with item ids, the HTML is rendered locally, so the links can't be corrupted.
+
+        If the stream breaks, the items that were not rendered yet are yielded under a fallback topic,
+        so the digest is never lost.
 
         :param summaries_text: A string containing summaries and their respective links.
-        :returns: A formatted string where similar topics are grouped together.
+        :param previous_topics: Topics of the user's previous digest, reused when they fit.
+        :returns: An async iterator over HTML blocks, one per topic.
         """
-        if not summaries_text or not summaries_text.strip():
-            return "No items available for clustering."
+        items = parse_summary_items(summaries_text or "")
+        if not items:
+            return
 
-        prompt = (
-            f''' Please categorize the following news summaries into a maximum of 5 broad, topic-based clusters.
-                Each cluster should be grouped by similar topics, and the summaries should remain in their original format with each followed by its relevant link(s). 
-                Each topics must be closed into HTML tags highlighting them bold: <b>Topic</b>. Don't use ** to highlight topics with bold! Never add ```html ```!
-                The topic labels must be written in Russian, and each topic must be followed by a new line.
-                Each topic should be introduced with a one relevant emoji. Emoji should only be placed in front of topic.
-                Ensure the topics are broad and general; limit the number of topics to 5.
-                Do not include bullet points, numbering, or other list formats. Keep it clean and structured as requested.
-                Summaries text: \n{summaries_text}. 
-                Make sure that the resulting output does not exceed 4000 characters. And ensure that the output is formatted in Russian.
-                The output must not have any additional symbols other than mentioned above.
-         '''
-        )
+        renderer = DigestRenderer(items)
+        parser = ClusterStreamParser()
         try:
-            return await self._mistral_request(prompt)
+            async for chunk in self._mistral_stream(
+                self._cluster_prompt(items, previous_topics), response_format={"type": "json_object"}, stage=STAGE_CLUSTER
+            ):
+                for cluster in parser.feed(chunk):
+                    block = renderer.add(cluster)
+                    if block:
+                        yield block
         except Exception as e:
-            logging.error("Error during clustering: %s", e)
-            return "Failed to produce the final digest."
+            logging.error("Error during streaming clustering: %s", e)
+
+        leftovers = renderer.leftovers()
+        if leftovers:
+            yield leftovers
+
+    async def local_digest(self, summaries_text: str) -> AsyncIterator[str]:
+        """
+        Renders the digest without the LLM, all items under the fallback topic.
+        Has the same interface as stream_cluster_summaries.
+
+        :param summaries_text: A string containing summaries and their respective links.
+        :returns: An async iterator over HTML blocks.
+        """
+        items = parse_summary_items(summaries_text or "")
+        if items:
+            yield render_digest([], items)
 
     async def determine_channel_topic(self, messages: List[Dict[str, Union[str, int]]]) -> List[str]:
         """
@@ -139,9 +423,90 @@ class Summarization:
         )
 
         try:
-            raw_topic = await self._mistral_request(prompt)
+            raw_topic = await self._mistral_request(prompt, stage=STAGE_TOPIC)
             list_topic = list(map(str.strip, raw_topic.split(',')))
             return list_topic
         except Exception as e:
             logging.error("\nError determining channel topic: %s\n", e)
-            return "Failed to determine channel topic."
+            return ["Общая тематика"]
+
+    def cached_channel_topic(self, channel: str) -> List[str] | None:
+        """
+        Returns the cached topic of a channel if it was determined less than topic_ttl seconds ago.
+
+        :param channel: Channel name (with the '@').
+        :returns: The topic as a list of strings or None.
+        """
+        cached = Summarization._topic_cache.get(channel)
+        if cached and time.monotonic() - cached[0] < self.topic_ttl:
+            return cached[1]
+        return None
+
+    async def determine_channel_topics(
+        self, samples: Dict[str, List[Dict[str, Union[str, int]]]], batch_size: int = 10, max_message_length: int = 300
+    ) -> Dict[str, List[str]]:
+        """
+        Determines topics of several channels, batching up to batch_size channels into one request.
+        Results are cached per channel for topic_ttl seconds.
+
+        :param samples: Channel name -> latest messages of the channel (as returned by scrape_messages_long_term).
+        :param batch_size: Maximum number of channels per request.
+        :param max_message_length: Messages are truncated to this length, the beginning is enough to detect the topic.
+        :returns: Channel name -> topic as a list of strings. Channels without messages get ["Общая тематика"].
+        """
+        topics = {}
+        pending = {}
+        for channel, messages in samples.items():
+            cached = self.cached_channel_topic(channel)
+            if cached:
+                topics[channel] = cached
+            elif not messages:
+                topics[channel] = ["Общая тематика"]
+            else:
+                pending[channel] = [(msg.get("message") or "")[:max_message_length] for msg in messages]
+
+        channels = list(pending)
+        batches = [channels[i:i + batch_size] for i in range(0, len(channels), batch_size)]
+        results = await asyncio.gather(
+            *(self._determine_topics_batch({channel: pending[channel] for channel in batch}) for batch in batches)
+        )
+        for batch_topics in results:
+            for channel, topic in batch_topics.items():
+                Summarization._topic_cache[channel] = (time.monotonic(), topic)
+            topics.update(batch_topics)
+
+        for channel in channels:
+            topics.setdefault(channel, ["Общая тематика"])
+        return topics
+
+    async def _determine_topics_batch(self, samples: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """
+        Determines topics of a batch of channels with one request.
+
+        :param samples: Channel name -> texts of the latest messages.
+        :returns: Channel name -> topic as a list of strings. Channels the model skipped are missing.
+        """
+        prompt = (
+            f'''Analyze the latest messages of several Telegram channels: {samples}.
+                The keys are channel names, the values are lists of the channel's latest messages.
+                For every channel determine its main topic and return it as a brief, specific, and clear formulation.
+                The topic should consist of a maximum of three words (you can use commas or conjunctions if necessary).
+                The topic should be in Russian.
+                If the messages contain special terms like "AI", "IT", "ML" or company/brand/enterprise names in any language (Russian, Spanish, French, etc.), keep them in their original form if they are part of the final topic of the channel.
+                Do not add any explanations or reasoning.
+                Return only a JSON object mapping each channel name exactly as given to its topic:
+                {{"@channel_name": "topic"}}'''
+        )
+
+        try:
+            raw_topics = await self._mistral_request(prompt, response_format={"type": "json_object"}, stage=STAGE_TOPIC)
+            data = json.loads(raw_topics)
+        except Exception as e:
+            logging.error("\nError determining channel topics for %s: %s\n", list(samples), e)
+            return {}
+
+        topics = {}
+        for channel, topic in (data.items() if isinstance(data, dict) else []):
+            if channel in samples and isinstance(topic, str) and topic.strip():
+                topics[channel] = [word.strip().strip('"') for word in topic.split(',') if word.strip()]
+        return topics
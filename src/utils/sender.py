@@ -1,5 +1,5 @@
 import logging
-from typing import List, Union, Callable
+from typing import List, Union, Callable, Awaitable
 from aiogram import Bot
 from src.data.database import SupabaseDB
 
@@ -10,15 +10,10 @@ class AnnouncementSender:
         self.bot = bot
         self.db = db
 
-    def retrieve_current_users(self) -> List[int]:
+    async def retrieve_current_users(self) -> List[int]:
         """Получить ID всех активных пользователей из БД."""
         try:
-            response = (
-                self.db.client.table("users")
-                .select("user_id")
-                .eq("is_receiving_news", True)
-                .execute()
-            )
+            response = await self.db.retrieve_current_users()
             return [user["user_id"] for user in response.data]
         except Exception as e:
             logger.error(f"Ошибка: {e}")
@@ -27,14 +22,14 @@ class AnnouncementSender:
     async def send(
         self,
         message: str,
-        for_users: Union[List[int], Callable[[], List[int]]] = None
+        for_users: Union[List[int], Callable[[], Awaitable[List[int]]]] = None
     ):
         """Отправка сообщения пользователям"""
         # Определяем список получателей
         if for_users is None:
-            user_ids = self.retrieve_current_users()
+            user_ids = await self.retrieve_current_users()
         elif callable(for_users):
-            user_ids = for_users()
+            user_ids = await for_users()
         else:
             user_ids = for_users
 
@@ -65,11 +60,11 @@ class AnnouncementSender:
 if __name__ == "__main__":
     import asyncio
     from src.config import TELEGRAM_BOT_TOKEN
-    from src.data.database import supabase
+    from src.data.database import create_db
 
     async def main():
         bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        db = SupabaseDB(supabase)
+        db = create_db()
         sender = AnnouncementSender(bot, db)
 
         # Конфигурация ------------------------------------------
@@ -0,0 +1,41 @@
+import re
+from typing import List
+
+# Русские стоп-слова (список nltk, чтобы не тянуть nltk и загрузку корпусов в рантайм)
+RUSSIAN_STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от
+меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж
+вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед
+иногда лучше чуть том нельзя такой им более всегда конечно всю между это также которые который которая
+""".split())
+
+_WORD_PATTERN = re.compile(r"[0-9a-zа-яё]+")
+_URL_PATTERN = re.compile(r"https?://\S+|t\.me/\S+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Normalizes a post and splits it into words.
+
+    Lowercases the text, drops links, punctuation, emoji and Russian stopwords.
+
+    :param text: Raw post text.
+    :returns: A list of normalized tokens.
+    """
+    if not text:
+        return []
+    text = _URL_PATTERN.sub(" ", text.lower().replace("ё", "е"))
+    return [word for word in _WORD_PATTERN.findall(text) if word not in RUSSIAN_STOPWORDS and len(word) > 1]
+
+
+def preprocess(text: str) -> str:
+    """
+    Normalizes a post for similarity comparison (see tokenize).
+
+    :param text: Raw post text.
+    :returns: Normalized tokens joined with spaces.
+    """
+    return " ".join(tokenize(text))
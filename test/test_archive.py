@@ -0,0 +1,44 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.data.archive import compress_digest, decompress_digest, history_page, decode_cursor
+
+DIGEST = "\n\n".join(
+    f"💰 <b>Экономика</b>\nЦБ сохранил ключевую ставку, сообщил регулятор по итогам заседания.\n"
+    f"<i>Источник: </i><a href=\"https://t.me/rbc_news/{100 + index}\">РБК</a> | "
+    f"<a href=\"https://t.me/rian_ru/{200 + index}\">РИА Новости</a>"
+    for index in range(3)
+)
+
+
+def test_compression_round_trip_and_shared_dictionary():
+    blob = compress_digest(DIGEST)
+    assert decompress_digest(blob) == DIGEST
+    assert decompress_digest(compress_digest(DIGEST, version=0)) == DIGEST
+    # Словарь заметно помогает именно на коротких дайджестах
+    assert len(blob) < len(compress_digest(DIGEST, version=0)) < len(DIGEST.encode("utf-8"))
+    with pytest.raises(ValueError):
+        decompress_digest(bytes([255]) + blob[1:])
+
+
+def test_history_page_cursor_and_legacy_rows():
+    now = datetime(2025, 3, 1, 12, 0)
+    rows = [
+        {"digest_id": 3, "creation_timestamp": now, "digest_compressed": compress_digest("третий"), "digest_content": None},
+        {"digest_id": 2, "creation_timestamp": now - timedelta(hours=1), "digest_compressed": None, "digest_content": "второй"},
+        {"digest_id": 1, "creation_timestamp": now - timedelta(hours=2), "digest_compressed": None, "digest_content": "первый"},
+    ]
+
+    digests, cursor = history_page(rows, limit=2)
+    assert [digest["digest_content"] for digest in digests] == ["третий", "второй"]
+    assert decode_cursor(cursor) == (now - timedelta(hours=1), 2)
+
+    digests, cursor = history_page(rows[2:], limit=2)
+    assert [digest["digest_id"] for digest in digests] == [1] and cursor is None
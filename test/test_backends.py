@@ -0,0 +1,112 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import subprocess
+import pytest
+from src.llm.backends import FakeBackend, RateLimitError
+from src.llm.breaker import CircuitBreaker
+from src.llm.metrics import llm_context
+from src.llm.models import ModelSelector
+from src.llm.singleflight import SingleFlight
+from src.summarization import Summarization
+
+STORIES = [
+    {"story_id": "rbc/1", "channel_title": "РБК", "message": "Bybit взломали"},
+    {"story_id": "tass/7", "channel_title": "ТАСС", "message": "В Москве снег"},
+]
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    def install(**options):
+        backend = FakeBackend(latency=0, **options)
+        monkeypatch.setattr(Summarization, "_backend", backend)
+        monkeypatch.setattr(Summarization, "_singleflight", SingleFlight(ttl=0))
+        monkeypatch.setattr(Summarization, "_breaker", CircuitBreaker())
+        return backend
+    return install
+
+
+def test_fake_backend_is_deterministic_and_counts_tokens(fake_backend):
+    backend = fake_backend()
+    summarizer = Summarization(api_key="fake")
+
+    first = asyncio.run(summarizer.summarize_stories(STORIES))
+    second = asyncio.run(summarizer.summarize_stories(STORIES))
+
+    assert first == second and set(first) == {"rbc/1", "tass/7"}
+    assert backend.calls == 2
+    assert backend.usage["mistral-large-latest"]["prompt_tokens"] > 0
+
+
+def test_fake_backend_streams_clusters(fake_backend):
+    fake_backend()
+    summaries = "\n".join(f"Новость {i}\n<i>Источник: </i><a href=\"https://t.me/rbc/{i}\">РБК</a>" for i in range(6))
+
+    async def collect():
+        return [block async for block in Summarization(api_key="fake").stream_cluster_summaries(summaries)]
+
+    blocks = asyncio.run(collect())
+
+    assert sum(block.count("<a href") for block in blocks) == 6
+    assert not any(block.startswith("📰") for block in blocks)
+
+
+def test_cheap_and_full_requests_are_not_shared(fake_backend, monkeypatch):
+    backend = fake_backend()
+    backend.latency = 0.01  # запросы должны пересечься во времени
+    monkeypatch.setattr(Summarization, "_singleflight", SingleFlight(ttl=60))
+    monkeypatch.setattr(
+        Summarization, "_selector", ModelSelector({"summary": ["mistral-large-latest", "mistral-small-latest"]})
+    )
+    summarizer = Summarization(api_key="fake")
+
+    async def cheap():
+        with llm_context(cheap_model=True):
+            return await summarizer._mistral_request("Привет")
+
+    async def run():
+        await asyncio.gather(summarizer._mistral_request("Привет"), cheap(), summarizer._mistral_request("Привет"))
+
+    asyncio.run(run())
+
+    # Два одинаковых запроса полной модели объединены, запрос дешёвой модели идёт отдельно
+    assert backend.calls == 2
+    assert set(backend.usage) == {"mistral-large-latest", "mistral-small-latest"}
+
+
+def test_rate_limit_is_retried_with_retry_after(fake_backend, monkeypatch):
+    backend = fake_backend(rate_limit_probability=1.0, retry_after=3)
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        backend.rate_limit_probability = 0.0
+
+    monkeypatch.setattr("src.summarization.asyncio.sleep", fake_sleep)
+    result = asyncio.run(Summarization(api_key="fake")._mistral_request("Привет"))
+
+    assert result and backend.rate_limited == 1
+    assert 3 <= max(delays) < 4
+    with pytest.raises(RateLimitError):
+        asyncio.run(FakeBackend(latency=0, rate_limit_probability=1.0).complete("model", "Привет"))
+
+
+def test_backends_work_without_the_sdk():
+    # None в sys.modules делает импорт mistralai невозможным, как без установленного SDK
+    code = (
+        "import sys; sys.modules['mistralai'] = None\n"
+        "from src.llm.backends import FakeBackend, LLMBackend, estimate_tokens\n"
+        "from src.stories import StoryPool\n"
+        "try:\n"
+        "    LLMBackend()\n"
+        "except TypeError:\n"
+        "    print('ok')\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+    assert result.stdout.strip() == "ok", result.stderr
@@ -0,0 +1,52 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from src.llm.breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN
+from src.extractive import extractive_summary, split_sentences
+
+
+def test_breaker_opens_on_failure_rate_and_recovers_after_probe():
+    breaker = CircuitBreaker(failure_threshold=0.5, min_calls=4, reset_timeout=0.0)
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    breaker.check()  # reset_timeout прошёл - пропускаем пробный запрос
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.check()
+
+
+def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=60)
+    breaker.record_failure()
+
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_extractive_summary_takes_lead_sentence():
+    text = ("⚡️ Срочно\n"
+            "**Bybit** взломали на $1,4 млрд, хакеры вывели ETH. Биржа обещает компенсировать потери. "
+            "https://t.me/rbc/1 #крипта")
+
+    assert split_sentences(text)[0] == "⚡️ Срочно"
+    assert extractive_summary(text) == "Bybit взломали на $1,4 млрд, хакеры вывели ETH."
+
+
+def test_extractive_summary_is_cut_at_word_boundary():
+    summary = extractive_summary("Очень " * 60, max_length=50)
+
+    assert len(summary) <= 50
+    assert summary.endswith("Очень…")
@@ -0,0 +1,53 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llm.budget import TokenBudget, LEVEL_FULL, LEVEL_TOP_K, LEVEL_CHEAP_MODEL, LEVEL_EXTRACTIVE
+
+
+def test_plan_degrades_as_budget_runs_out():
+    budget = TokenBudget(10_000)
+
+    full = budget.plan("alice", [1000] * 5, overhead=500)
+    assert full.level == LEVEL_FULL and full.reserved == 5500
+    budget.release(full)
+    budget.spend("mistral-large-latest", 5000, 500)
+
+    # Осталось 4500: помещаются 4 сюжета из 5
+    top = budget.plan("alice", [1000] * 5, overhead=500)
+    assert top.level == LEVEL_TOP_K and top.max_items == 4
+    budget.release(top)
+
+    cheap = budget.plan("alice", [1000] * 20, cheap_model="mistral-small-latest")
+    assert cheap.level == LEVEL_CHEAP_MODEL
+    budget.release(cheap)
+
+    assert budget.plan("alice", [1000] * 20).level == LEVEL_EXTRACTIVE
+
+
+def test_fair_share_is_split_between_users_and_their_digests():
+    budget = TokenBudget(12_000)
+    budget.plan("alice", [])
+    budget.plan("alice", [])
+
+    assert budget.fair_share("bob") == 6000
+    assert budget.fair_share("alice") == 4000  # третий дайджест alice в этом окне
+
+    # Дешёвая модель расходует бюджет пропорционально цене
+    budget.spend("mistral-small-latest", 1000, 0)
+    assert budget.spent() == 1000 * budget.weight("mistral-small-latest") == 50
+
+
+def test_first_users_of_a_window_do_not_take_everything():
+    budget = TokenBudget(12_000)
+
+    alice = budget.plan("alice", [1000] * 10, expected_users=2)
+    bob = budget.plan("bob", [1000] * 10, expected_users=2)
+
+    assert alice.allowance == bob.allowance == 6000
+    assert alice.level == bob.level == LEVEL_TOP_K and alice.max_items == bob.max_items == 6
+
+    # Пользователей больше ожидаемого - делим между фактическими
+    assert budget.fair_share("carol", expected_users=2) == 4000
@@ -0,0 +1,100 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import pytest
+
+from src.data.cache import ReadThroughCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_read_through_ttl_and_invalidation(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("src.data.cache.time.monotonic", clock)
+    cache = ReadThroughCache({"user": 10})
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return len(loads)
+
+    async def get():
+        return await cache.get_or_load("user", 1, load)
+
+    assert asyncio.run(get()) == 1
+    assert asyncio.run(get()) == 1
+    clock.now += 11
+    assert asyncio.run(get()) == 2  # запись устарела
+    cache.invalidate("user", 1)
+    assert asyncio.run(get()) == 3
+    cache.invalidate("user")
+    assert asyncio.run(get()) == 4
+
+    report = cache.report()[0]
+    assert report["namespace"] == "user" and report["hits"] == 1 and report["misses"] == 4
+    assert report["hit_rate"] == 0.2 and report["size"] == 1
+
+
+def test_errors_and_uncached_namespaces_are_not_stored():
+    cache = ReadThroughCache({"user": 10}, max_entries=2)
+
+    async def fail():
+        raise ConnectionError("down")
+
+    async def value():
+        return "value"
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(cache.get_or_load("user", 1, fail))
+    assert cache.get("user", 1) == (False, None)
+
+    asyncio.run(cache.get_or_load("interval", 1, value))  # TTL не задан - не кэшируется
+    assert cache.get("interval", 1) == (False, None)
+
+    for key in range(3):
+        cache.put("user", key, key)
+    assert cache.get("user", 0) == (False, None)  # вытеснена самая старая запись
+    assert cache.get("user", 2) == (True, 2)
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = ReadThroughCache({"interval": 60})
+    values = iter([3600, 7200])
+
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_load():
+            value = next(values)  # читаем строку до записи
+            started.set()
+            await release.wait()
+            return value
+
+        load = asyncio.create_task(cache.get_or_load("interval", 1, slow_load))
+        await started.wait()
+        cache.invalidate("interval", 1)  # запись нового интервала во время загрузки
+        release.set()
+        stale = await load
+
+        async def fresh_load():
+            return next(values)
+
+        return stale, await cache.get_or_load("interval", 1, fresh_load)
+
+    assert asyncio.run(run()) == (3600, 7200)
+    assert cache.get("interval", 1) == (True, 7200)
+
+    generation = cache.generation("interval", 2)
+    cache.invalidate("interval")
+    cache.put("interval", 2, 60, generation)  # массовая загрузка, начатая до сброса
+    assert cache.get("interval", 2) == (False, None)
@@ -0,0 +1,270 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Клиент supabase создаётся при импорте, но в этих тестах запросы в сеть не уходят
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.x")
+
+import time
+import asyncio
+import threading
+from datetime import datetime
+
+from src.data.database import SupabaseDB
+from src.data.cache import ReadThroughCache
+
+
+class SlowQuery:
+    """Query builder stand-in whose execute blocks like an HTTP round trip."""
+
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, data, delay=0.05):
+        self.data = data
+        self.delay = delay
+
+    def execute(self):
+        with SlowQuery.lock:
+            SlowQuery.running += 1
+            SlowQuery.max_running = max(SlowQuery.max_running, SlowQuery.running)
+        time.sleep(self.delay)
+        with SlowQuery.lock:
+            SlowQuery.running -= 1
+        return self.data
+
+
+def test_execute_does_not_block_the_event_loop():
+    async def main():
+        db = SupabaseDB(None)
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(heartbeat())
+        result = await db._execute(SlowQuery("ok", delay=0.2))
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(main())
+    assert result == "ok"
+    assert ticks >= 5
+
+
+def test_execute_bounds_concurrency(monkeypatch):
+    monkeypatch.setattr(SupabaseDB, "_semaphore", asyncio.Semaphore(3))
+
+    async def main():
+        db = SupabaseDB(None)
+        return await asyncio.gather(*(db._execute(SlowQuery(index)) for index in range(12)))
+
+    SlowQuery.max_running = 0
+    assert asyncio.run(main()) == list(range(12))
+    assert SlowQuery.max_running == 3
+
+
+def test_postgres_helpers():
+    from src.data.postgres import _timestamp, _affected
+
+    assert _timestamp("2025-03-01T15:00:00+03:00") == datetime(2025, 3, 1, 12, 0)
+    assert _timestamp(datetime(2025, 3, 1, 12, 0)) == datetime(2025, 3, 1, 12, 0)
+    assert _timestamp(None) is None
+    assert _affected("UPDATE 3") == 3 and _affected("") == 0
+
+
+class FakeQuery:
+    """Chainable stand-in for a supabase query builder: records the chain, returns canned rows."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.calls = [("table", table)]
+        client.queries.append(self.calls)
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append((name, *args))
+            return self
+        return call
+
+    def execute(self):
+        return type("Response", (), {"data": self.client.rows})()
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+def test_fetch_user_channels_is_one_query(monkeypatch):
+    monkeypatch.setattr(SupabaseDB, "cache", ReadThroughCache({}))
+    rows = [
+        {"user_id": 1, "channel_id": 10, "channels": {"channel_name": "@news", "channel_topic": ["Политика"]}},
+        {"user_id": 1, "channel_id": 11, "channels": {"channel_name": "@old", "channel_topic": "Экономика"}},
+        {"user_id": 2, "channel_id": 10, "channels": {"channel_name": "@news", "channel_topic": None}},
+    ]
+    client = FakeClient(rows)
+    db = SupabaseDB(client)
+
+    channels = asyncio.run(db.fetch_user_channels(1))
+    assert len(client.queries) == 1
+    assert channels[1] == {"channel_name": "@old", "channel_id": 11, "channel_topic": ["Экономика"]}
+
+    users = asyncio.run(db.fetch_users_channels([1, 2, 3]))
+    assert len(client.queries) == 2
+    assert [channel["channel_id"] for channel in users[1]] == [10, 11]
+    assert users[2][0]["channel_topic"] == [] and users[3] == []
+
+
+def test_save_channel_news_batch_is_one_idempotent_upsert():
+    client = FakeClient([])
+    db = SupabaseDB(client)
+    now = datetime(2025, 3, 1, 12, 0)
+    news = [
+        {"message_id": 1, "message": "first", "message_date": now},
+        {"message_id": 2, "message": "second", "message_date": now},
+        {"message_id": 1, "message": "first", "message_date": now},
+    ]
+
+    assert asyncio.run(db.save_channel_news_batch(10, news))
+    assert asyncio.run(db.save_channel_news_batch(10, []))
+    assert len(client.queries) == 1
+    _, (method, values) = client.queries[0]
+    assert method == "upsert" and [value["message_id"] for value in values] == [1, 2]
+
+
+def test_cached_reads_and_invalidation(monkeypatch):
+    monkeypatch.setattr(SupabaseDB, "cache", ReadThroughCache({"interval": 60, "user_channels": 60}))
+    client = FakeClient([{"check_interval": 7200}])
+    db = SupabaseDB(client)
+
+    async def run():
+        first = await db.get_user_interval(1)
+        second = await SupabaseDB(client).get_user_interval(1)  # кэш общий для всех экземпляров
+        await db.set_user_interval(1, 600)
+        client.rows = [{"check_interval": 600}]
+        return first, second, await db.get_user_interval(1)
+
+    assert asyncio.run(run()) == (7200, 7200, 600)
+    assert len(client.queries) == 3  # чтение, запись, чтение после сброса
+    assert SupabaseDB.cache.stats["interval"] == {"hits": 1, "misses": 2, "invalidations": 1}
+
+
+def test_ensure_user_channels_handles_mixed_lists(monkeypatch):
+    monkeypatch.setattr(SupabaseDB, "cache", ReadThroughCache({"channel_id": 60}))
+    client = FakeClient([{"channel_id": 5, "channel_name": "@known"}])  # старый id, не хэш имени
+    db = SupabaseDB(client)
+    detected = []
+
+    async def detect_topics(channels):
+        detected.append(channels)
+        return {channel: ["Технологии"] for channel in channels}
+
+    linked = asyncio.run(db.ensure_user_channels(1, ["@known", "@new", "@known"], detect_topics))
+
+    new_id = asyncio.run(SupabaseDB.generate_channel_hash("@new"))
+    assert linked == {"@known": 5, "@new": new_id}
+    assert detected == [["@new"]]
+    assert len(client.queries) == 3  # поиск известных, новые каналы, привязки
+    _, (_, channels) = client.queries[1]
+    assert [(row["channel_name"], row["channel_topic"]) for row in channels] == [("@new", ["Технологии"])]
+    _, (_, links) = client.queries[2]
+    assert sorted(row["channel_id"] for row in links) == sorted([5, new_id])
+    assert asyncio.run(db.fetch_channel_id("@new")) == new_id and len(client.queries) == 3
+
+
+def test_delete_user_channels_resolves_names_once(monkeypatch):
+    monkeypatch.setattr(SupabaseDB, "cache", ReadThroughCache({"channel_id": 60}))
+    SupabaseDB.cache.put("channel_id", "@cached", 3)
+    client = FakeClient([{"channel_id": 5, "channel_name": "@known", "user_id": 1}])
+    db = SupabaseDB(client)
+
+    assert asyncio.run(db.delete_user_channels(1, ["@cached", "@known", "@missing"]))
+    assert len(client.queries) == 2  # один запрос имён (только не закэшированных) и одно обновление
+    assert ("in_", "channel_name", ["@known", "@missing"]) in client.queries[0]
+    assert ("in_", "channel_id", [3, 5]) in client.queries[1]
+
+    assert asyncio.run(db.deactivate_channels(["@known"])) == 1
+    assert len(client.queries) == 3  # имя уже в кэше
+    assert not any(call[:2] == ("in_", "user_id") for call in client.queries[2])
+
+
+def test_digest_history_is_keyset_paginated():
+    from src.data.archive import compress_digest, encode_cursor
+
+    now = datetime(2025, 3, 1, 12, 0)
+    rows = [
+        {"digest_id": 5, "creation_timestamp": now.isoformat(), "digest_content": None,
+         "digest_compressed": "\\x" + compress_digest("новый").hex()},
+        {"digest_id": 4, "creation_timestamp": "2025-03-01T11:00:00+00:00", "digest_content": "старый",
+         "digest_compressed": None},
+    ]
+    client = FakeClient(rows)
+    db = SupabaseDB(client)
+
+    digests, cursor = asyncio.run(db.fetch_digest_history(1, limit=1))
+    assert [digest["digest_content"] for digest in digests] == ["новый"]
+    assert cursor == encode_cursor(now, 5)
+
+    asyncio.run(db.fetch_digest_history(1, limit=1, before=cursor))
+    assert ("or_", "creation_timestamp.lt.2025-03-01T12:00:00,"
+                   "and(creation_timestamp.eq.2025-03-01T12:00:00,digest_id.lt.5)") in client.queries[-1]
+    assert ("limit", 2) in client.queries[-1]
+
+    assert asyncio.run(db.save_user_digests([{"user_id": 1, "digest_content": "новый", "creation_timestamp": now.isoformat()}]))
+    _, (method, values) = client.queries[-1]
+    assert method == "insert" and "digest_content" not in values[0]
+    assert bytes.fromhex(values[0]["digest_compressed"][2:]) == compress_digest("новый")
+
+
+class PagingQuery(FakeQuery):
+    """Applies in_/range like PostgREST and cuts every response to the server's max-rows."""
+
+    def execute(self):
+        client = self.client
+        user_ids = next(call[2] for call in self.calls if call[0] == "in_")
+        if client.fail_user in user_ids:
+            raise RuntimeError("timeout")
+        rows = [row for row in client.rows if row["user_id"] in user_ids]
+        start, end = next(call[1:] for call in self.calls if call[0] == "range")
+        return type("Response", (), {"data": rows[start:end + 1][:client.max_rows]})()
+
+
+class PagingClient(FakeClient):
+    def __init__(self, rows, max_rows, fail_user=None):
+        super().__init__(rows)
+        self.max_rows = max_rows
+        self.fail_user = fail_user
+
+    def table(self, name):
+        return PagingQuery(self, name)
+
+
+def test_fetch_users_channels_pages_through_truncated_responses(monkeypatch):
+    monkeypatch.setattr(SupabaseDB, "cache", ReadThroughCache({"user_channels": 60}))
+    rows = [
+        {"user_id": user_id, "channel_id": channel_id, "channels": {"channel_name": f"@c{channel_id}", "channel_topic": None}}
+        for user_id in (1, 2, 3) for channel_id in range(user_id * 10, user_id * 10 + 3)
+    ]
+    client = PagingClient(rows, max_rows=2, fail_user=3)
+    db = SupabaseDB(client)
+    db.page_size, db.in_chunk_size = 2, 2
+
+    channels = asyncio.run(db.fetch_users_channels([1, 2, 3, 4]))
+    # Пользователи 1 и 2 прочитаны тремя страницами, пачка с пользователем 3 упала и не вернулась
+    assert [channel["channel_id"] for channel in channels[1]] == [10, 11, 12]
+    assert [channel["channel_id"] for channel in channels[2]] == [20, 21, 22]
+    assert 3 not in channels and 4 not in channels
+    assert SupabaseDB.cache.get("user_channels", 2)[0]
+    assert not SupabaseDB.cache.get("user_channels", 3)[0]
@@ -0,0 +1,36 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from src.utils.text import tokenize
+
+BYBIT_1 = ("Криптобиржу Bybit хакнули на $1,4 млрд. Хакеры обошли систему безопасности, подменив данные "
+           "транзакции, и вывели средства с холодного кошелька Ethereum.")
+BYBIT_2 = ("Хакеры взломали криптобиржу Bybit и вывели средства с холодного кошелька Ethereum, "
+           "подменив данные транзакции. Хакеры обошли систему безопасности.")
+WEATHER = "В Москве ожидается снег и гололедица, синоптики советуют пересесть на метро."
+
+
+def test_tokenize_drops_stopwords_links_and_punctuation():
+    assert tokenize("Это ВСЁ про Bybit: https://t.me/rbc/1 !!!") == ["bybit"]
+
+
+def test_deduplicate_news_merges_same_story_across_channels():
+    pytest.importorskip("sklearn")
+    from src.dedup import deduplicate_news
+
+    news = [
+        {"channel": "rbc", "message": BYBIT_1, "message_id": 1, "channel_title": "РБК"},
+        {"channel": "weather", "message": WEATHER, "message_id": 7, "channel_title": "Погода"},
+        {"channel": "tass", "message": BYBIT_2, "message_id": 2, "channel_title": "ТАСС"},
+        {"channel": "tass", "message": None, "message_id": 3, "channel_title": "ТАСС"},
+    ]
+
+    deduplicated = deduplicate_news(news)
+
+    assert len(deduplicated) == 3
+    bybit = next(item for item in deduplicated if "Bybit" in (item["message"] or ""))
+    assert {source["channel"] for source in bybit["sources"]} == {"rbc", "tass"}
@@ -0,0 +1,75 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from src.digest import parse_summary_items, parse_clusters, render_digest, block_topic, ClusterStreamParser
+
+SUMMARIES = (
+    "Bybit взломали на $1,4 млрд\n"
+    '<i>Источник: </i><a href="https://t.me/rbc/1">РБК</a> | <a href="https://t.me/tass/2">ТАСС</a>\n'
+    "\n"
+    "ЦБ сохранил ключевую ставку\n"
+    '<i>Источник: </i><a href="https://t.me/rbc/3">РБК</a>\n'
+    "Вышел новый сезон сериала\n"
+    '<i>Источник: </i><a href="https://t.me/kino/4">Кино</a>\n'
+)
+
+
+def test_parse_summary_items():
+    items = parse_summary_items(SUMMARIES)
+
+    assert [item["id"] for item in items] == [1, 2, 3]
+    assert items[0]["summary"] == "Bybit взломали на $1,4 млрд"
+    assert items[0]["links"].count("<a href") == 2
+
+
+def test_parse_clusters_accepts_fenced_json_and_coerces_ids():
+    raw = '```json\n{"clusters": [{"topic": "Финансы", "emoji": "💰", "items": ["1", 2, "x"]}, {"items": [3]}]}\n```'
+
+    clusters = parse_clusters(raw)
+
+    assert clusters == [{"topic": "Финансы", "emoji": "💰", "items": [1, 2]}]
+
+
+def test_parse_clusters_rejects_invalid_json():
+    with pytest.raises(ValueError):
+        parse_clusters("Финансы: 1, 2")
+
+
+def test_render_digest_keeps_links_and_unassigned_items():
+    items = parse_summary_items(SUMMARIES)
+    clusters = [{"topic": "Финансы", "emoji": "💰", "items": [1, 2, 1, 42]}]
+
+    digest = render_digest(clusters, items)
+
+    assert digest.startswith("💰 <b>Финансы</b>\nBybit")
+    assert digest.count("Bybit") == 1
+    assert "📰 <b>Разное</b>\nВышел новый сезон сериала" in digest
+    assert '<a href="https://t.me/kino/4">Кино</a>' in digest
+    assert [block_topic(block) for block in digest.split("\n\n")] == [
+        {"topic": "Финансы", "emoji": "💰"}, {"topic": "Разное", "emoji": "📰"}
+    ]
+
+
+def test_emoji_from_the_model_is_escaped():
+    items = parse_summary_items(SUMMARIES)
+    clusters = [{"topic": "Финансы", "emoji": "<b>&", "items": [1, 2, 3, 4]}]
+
+    digest = render_digest(clusters, items)
+
+    assert digest.startswith("&lt;b&gt;&amp; <b>Финансы</b>\n")
+    assert block_topic(digest) == {"topic": "Финансы", "emoji": "<b>&"}
+
+
+def test_cluster_stream_parser_emits_clusters_as_soon_as_they_close():
+    raw = ('{"clusters": [{"topic": "Финансы {и} \\"крипта\\"", "emoji": "💰", "items": [1, 2]}, '
+           '{"topic": "Кино", "emoji": "🎬", "items": [3]}]}')
+    parser = ClusterStreamParser()
+
+    emitted = [(position, cluster) for position in range(len(raw)) for cluster in parser.feed(raw[position])]
+
+    assert [cluster["topic"] for _, cluster in emitted] == ['Финансы {и} "крипта"', "Кино"]
+    assert emitted[0][0] == raw.index("]}") + 1
@@ -0,0 +1,54 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+from src.llm.metrics import LLMMetrics, Histogram, llm_context, current_labels, OUTCOME_OK, OUTCOME_ERROR
+
+
+def test_histogram_quantiles_use_bucket_bounds():
+    histogram = Histogram(bounds=(1.0, 5.0))
+    for value in (0.5, 0.7, 3.0, 10.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.75) == 5.0
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_records_are_broken_down_by_user_and_digest():
+    metrics = LLMMetrics()
+
+    async def user(user_id, wall_time):
+        with llm_context(user_id=user_id, digest_id=f"{user_id}:1"):
+            await asyncio.sleep(0)
+            metrics.record("summary", "mistral-small-latest", OUTCOME_OK, wall_time, 1, 1_000_000, 0)
+            await asyncio.create_task(asyncio.sleep(0))
+            metrics.record("cluster", "mistral-small-latest", OUTCOME_ERROR, wall_time, 3)
+
+    async def run():
+        await asyncio.gather(user(1, 2.0), user(2, 0.5))
+
+    asyncio.run(run())
+
+    assert current_labels() == {}
+    assert metrics.digest("1:1")["calls"] == 2 and metrics.digest("1:1")["wall_time"] == 4.0
+    assert [user_id for user_id, _ in metrics.top_users()] == [1, 2]
+    rows = {row["stage"]: row for row in metrics.summary()}
+    assert rows["summary"]["ok"] == 2 and rows["summary"]["cost"] == 0.2
+    assert rows["cluster"]["error"] == 2 and rows["cluster"]["avg_attempts"] == 3
+
+
+def test_shared_work_is_not_charged_to_the_triggering_user():
+    metrics = LLMMetrics()
+    with llm_context(user_id=1, digest_id="1:1"):
+        metrics.record("summary", "mistral-small-latest", OUTCOME_OK, 1.0, 1, 1_000_000, 0)
+        with llm_context(shared=True):
+            metrics.record("summary", "mistral-small-latest", OUTCOME_OK, 3.0, 1, 1_000_000, 0)
+
+    assert metrics.by_user[1]["calls"] == 1 and metrics.digest("1:1")["wall_time"] == 1.0
+    assert metrics.shared["calls"] == 1 and metrics.shared["cost"] == 0.1
+    assert {row["stage"]: row for row in metrics.summary()}["summary"]["ok"] == 2
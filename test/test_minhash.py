@@ -0,0 +1,49 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+import pytest
+
+pytest.importorskip("numpy")
+from src.minhash import StoryIndex, MinHasher, shingles
+
+STORY = ("Криптобиржу Bybit взломали: хакеры обошли систему безопасности, подменив данные транзакции, "
+         "и вывели 1,4 млрд долларов с холодного кошелька Ethereum")
+REPOST = STORY + ". Подробности у нас в канале"
+OTHER = "Синоптики обещают в Москве снег и гололедицу до конца недели, водителей просят пересесть на метро"
+
+
+def test_signature_similarity_estimates_jaccard():
+    hasher = MinHasher(num_perm=256)
+    first, second = shingles(STORY), shingles(REPOST)
+    jaccard = len(first & second) / len(first | second)
+
+    estimate = MinHasher.similarity(hasher.signature(first), hasher.signature(second))
+
+    assert abs(estimate - jaccard) < 0.15
+
+
+def test_story_index_assigns_reposts_to_one_story():
+    index = StoryIndex(threshold=0.5)
+
+    story_id = index.add(("rbc", 1), STORY)
+
+    assert index.add(("tass", 5), REPOST) == story_id
+    assert index.add(("weather", 2), OTHER) != story_id
+    assert index.add(("rbc", 1), OTHER) == story_id
+    assert index.posts(story_id) == [("rbc", 1), ("tass", 5)]
+    assert len(index) == 2
+
+
+def test_story_index_prunes_stale_stories():
+    index = StoryIndex(ttl=timedelta(hours=1))
+    now = datetime.utcnow()
+    index.add(("rbc", 1), STORY, timestamp=now - timedelta(hours=2))
+    index.add(("weather", 2), OTHER, timestamp=now)
+
+    assert index.prune(now) == 1
+    assert index.story_of(("rbc", 1)) is None
+    assert index.add(("tass", 5), REPOST) == "tass/5"
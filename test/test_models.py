@@ -0,0 +1,40 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.llm.models import ModelSelector, estimate_cost, STAGE_SUMMARY, STAGE_TOPIC
+
+
+def test_select_uses_default_for_unconfigured_stage():
+    selector = ModelSelector({STAGE_SUMMARY: ["mistral-large-latest", "mistral-small-latest"]})
+
+    assert selector.select(STAGE_SUMMARY, "default") == "mistral-large-latest"
+    assert selector.select(STAGE_TOPIC, "default") == "default"
+
+
+def test_rate_limited_model_falls_back_to_next_tier():
+    selector = ModelSelector({STAGE_SUMMARY: ["mistral-large-latest", "mistral-small-latest"]}, min_samples=3)
+
+    selector.record("mistral-large-latest", latency=1.0)
+    selector.record_rate_limit("mistral-large-latest")
+    assert selector.select(STAGE_SUMMARY, "default") == "mistral-large-latest"
+
+    selector.record_rate_limit("mistral-large-latest")
+    assert selector.select(STAGE_SUMMARY, "default") == "mistral-small-latest"
+
+
+def test_slow_model_is_degraded_until_window_passes():
+    selector = ModelSelector({STAGE_SUMMARY: ["a", "b"]}, latency_threshold=10, min_samples=1)
+    selector.record("a", latency=15.0)
+
+    assert selector.select(STAGE_SUMMARY, "default") == "b"
+
+    selector.window = 0
+    assert selector.select(STAGE_SUMMARY, "default") == "a"
+
+
+def test_estimate_cost_uses_prices_per_million_tokens():
+    assert estimate_cost("mistral-small-latest", 1_000_000, 0) == 0.1
+    assert estimate_cost("unknown-model", 1_000_000, 1_000_000) == 0.0
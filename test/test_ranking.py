@@ -0,0 +1,68 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+
+from src.ranking import StoryRanker, top_k
+
+NOW = datetime(2025, 3, 1, 12, 0)
+TEXT = "Центробанк сохранил ключевую ставку на прежнем уровне и пообещал держать её высокой ещё как минимум полгода"
+
+
+def post(channel_id, message_id, views=100, forwards=0, age=timedelta(hours=1), message=TEXT):
+    return {
+        "channel": f"channel{channel_id}", "channel_id": channel_id, "message_id": message_id, "message": message,
+        "message_date": NOW - age, "views": views, "forwards": forwards,
+    }
+
+
+def story(story_id, *posts):
+    return {"story_id": story_id, "posts": list(posts)}
+
+
+def order(stories):
+    return [item["story_id"] for item in stories]
+
+
+def test_engagement_is_relative_to_the_channel():
+    ranker = StoryRanker()
+    stories = [
+        story("big-usual", post(1, 1, views=10000)),
+        story("big-other", post(1, 2, views=10000)),
+        story("small-viral", post(2, 1, views=500, forwards=40)),
+        story("small-usual", post(2, 2, views=100)),
+    ]
+    ranked = order(ranker.rank(stories, now=NOW))
+    assert ranked[0] == "small-viral"
+    assert ranked[-1] == "small-usual"
+
+
+def test_coverage_novelty_and_length():
+    ranker = StoryRanker()
+    stories = [story("old", post(1, 1, age=timedelta(hours=20))), story("fresh", post(1, 2))]
+    assert order(ranker.rank(stories, now=NOW)) == ["fresh", "old"]
+
+    stories = [story("single", post(1, 1)), story("covered", post(1, 2))]
+    assert order(ranker.rank(stories, coverage={"single": 1, "covered": 5}, now=NOW)) == ["covered", "single"]
+
+    stories = [story("teaser", post(1, 1, message="Подробности по ссылке")), story("news", post(1, 2))]
+    assert order(ranker.rank(stories, now=NOW)) == ["news", "teaser"]
+
+
+def test_topic_interest():
+    channel_topics = {1: ["Экономика"], 2: ["Экономика", "Финансы"], 3: ["Спорт"]}
+    interest = StoryRanker.topic_interest(channel_topics)
+    assert interest["Экономика"] == 2 / 3 and interest["Спорт"] == 1 / 3
+
+    ranker = StoryRanker()
+    stories = [story("sport", post(3, 1)), story("economy", post(1, 1))]
+    assert order(ranker.rank(stories, channel_topics=channel_topics, now=NOW)) == ["economy", "sport"]
+
+
+def test_top_k():
+    stories = [story(str(index), post(1, index)) for index in range(5)]
+    assert len(top_k(stories, 3)) == 3
+    assert top_k(stories, None) == stories and top_k(stories, 0) == stories
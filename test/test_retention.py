@@ -0,0 +1,48 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+from datetime import datetime, timedelta
+
+from src.data.retention import enforce_retention
+
+
+class FakeDB:
+    def __init__(self, expired, fail=()):
+        self.expired = dict(expired)
+        self.fail = set(fail)
+        self.calls = []
+
+    async def purge_expired(self, table, cutoff, batch_size):
+        self.calls.append((table, cutoff, batch_size))
+        if table in self.fail:
+            return -1
+        count = min(batch_size, self.expired[table])
+        self.expired[table] -= count
+        return count
+
+
+def test_deletes_in_bounded_batches():
+    db = FakeDB({"channels_news": 25, "digests": 3})
+    deleted = asyncio.run(enforce_retention(
+        db, {"channels_news": 1, "digests": 30}, batch_size=10, max_batches=2, pause=0
+    ))
+    # За один запуск не больше max_batches запросов на таблицу, остаток удалит следующий запуск
+    assert deleted == {"channels_news": 20, "digests": 3}
+    assert [call[0] for call in db.calls] == ["channels_news", "channels_news", "digests"]
+    assert db.calls[0][1] < datetime.utcnow() - timedelta(days=1) + timedelta(minutes=1)
+    assert db.calls[2][1] < datetime.utcnow() - timedelta(days=29)
+
+    deleted = asyncio.run(enforce_retention(
+        db, {"channels_news": 1, "digests": 30}, batch_size=10, max_batches=2, pause=0
+    ))
+    assert deleted == {"channels_news": 5, "digests": 0}
+
+
+def test_failed_table_does_not_stop_the_others():
+    db = FakeDB({"digests": 1}, fail={"channels_news"})
+    deleted = asyncio.run(enforce_retention(db, {"channels_news": 1, "digests": 30}, pause=0))
+    assert deleted == {"channels_news": 0, "digests": 1}
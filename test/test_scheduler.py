@@ -0,0 +1,54 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+from src.llm.scheduler import FairScheduler
+
+
+def run_queued(scheduler, requests, cancel=()):
+    """Occupies the only slot, queues `requests` ((user, cost) pairs) behind it and returns the start order."""
+    order = []
+
+    async def request(user, cost, gate=None):
+        async with scheduler.slot(user, cost):
+            order.append(user)
+            if gate:
+                await gate.wait()
+            await asyncio.sleep(0)
+
+    async def run():
+        gate = asyncio.Event()
+        blocker = asyncio.create_task(request("busy", 1, gate))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(request(user, cost)) for user, cost in requests]
+        cancelled = [asyncio.create_task(request(user, cost)) for user, cost in cancel]
+        await asyncio.sleep(0)
+        for task in cancelled:
+            task.cancel()
+        gate.set()
+        await asyncio.gather(blocker, *tasks)
+
+    asyncio.run(run())
+    return order
+
+
+def test_heavy_user_does_not_block_light_users():
+    scheduler = FairScheduler(concurrency=1, quantum=1000)
+
+    order = run_queued(scheduler, [("heavy", 3000)] * 3 + [(f"light{i}", 500) for i in range(3)])
+
+    # Тяжёлому пользователю нужно три хода, чтобы накопить кредит, лёгкие проходят раньше
+    assert order == ["busy", "light0", "light1", "light2", "heavy", "heavy", "heavy"]
+
+
+def test_weights_and_cancellation():
+    scheduler = FairScheduler(concurrency=1, quantum=100)
+    scheduler.set_weight("premium", 3)
+
+    order = run_queued(scheduler, [("free", 100)] * 3 + [("premium", 100)] * 3, cancel=[("gone", 100)])
+
+    assert order == ["busy", "free", "premium", "premium", "premium", "free", "free"]
+    assert scheduler.waiting == 0 and scheduler._running == 0
@@ -0,0 +1,74 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import pytest
+from src.llm.singleflight import SingleFlight, request_key
+
+
+def test_concurrent_identical_requests_share_one_call():
+    flight = SingleFlight(ttl=60)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "digest"
+
+    async def run():
+        key = request_key("mistral-large-latest", "prompt")
+        results = await asyncio.gather(*(flight.do(key, call) for _ in range(5)))
+        late = await flight.do(key, call)
+        return results, late
+
+    results, late = asyncio.run(run())
+
+    assert results == ["digest"] * 5 and late == "digest"
+    assert len(calls) == 1
+    assert flight.stats == {"calls": 6, "upstream": 1, "coalesced": 4, "cache_hits": 1}
+
+
+def test_errors_are_shared_but_not_cached():
+    flight = SingleFlight(ttl=60)
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Status 500")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("key", failing) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.do("key", failing)
+        return results
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(calls) == 2
+
+
+def test_stream_is_replayed_to_every_consumer():
+    flight = SingleFlight(ttl=60)
+    opened = []
+
+    async def upstream():
+        opened.append(1)
+        for chunk in ["{\"clusters\"", ": []", "}"]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def consume():
+        return "".join([chunk async for chunk in flight.stream("key", upstream)])
+
+    async def run():
+        results = await asyncio.gather(consume(), consume())
+        results.append(await consume())
+        return results
+
+    assert asyncio.run(run()) == ['{"clusters": []}'] * 3
+    assert len(opened) == 1
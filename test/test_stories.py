@@ -0,0 +1,92 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+
+pytest.importorskip("sklearn")
+from src.minhash import StoryIndex
+from src.stories import StoryPool
+
+STORY = ("Криптобиржу Bybit взломали: хакеры обошли систему безопасности, подменив данные транзакции, "
+         "и вывели 1,4 млрд долларов с холодного кошелька Ethereum")
+OTHER = "Синоптики обещают в Москве снег и гололедицу до конца недели, водителей просят пересесть на метро"
+
+
+class FakeDB:
+    def __init__(self):
+        self.saved = []
+
+    async def save_channel_news_batch(self, channel_id, news):
+        self.saved.append([(channel_id, msg["message_id"]) for msg in news])
+        return True
+
+
+class FakeScraper:
+    def __init__(self, channels):
+        self.channels = channels
+        self.db = FakeDB()
+        self.writes = self.db
+        self.scraped = []
+
+    async def scrape_messages(self, entity_name, limit=100):
+        self.scraped.append(entity_name)
+        now = datetime.now(timezone.utc)
+        return [
+            {"message_id": message_id, "message": text, "message_date": now, "channel_title": entity_name}
+            for message_id, text in self.channels[entity_name]
+        ]
+
+
+class FakeSummarizer:
+    def __init__(self):
+        self.calls = []
+
+    async def summarize_stories(self, stories):
+        self.calls.append([story["story_id"] for story in stories])
+        return {story["story_id"]: f"summary of {story['story_id']}" for story in stories}
+
+
+def test_story_pool_shares_scrapes_and_summaries_between_users(monkeypatch):
+    async def no_sleep(_):
+        return None
+
+    monkeypatch.setattr("src.stories.asyncio.sleep", no_sleep)
+    scraper = FakeScraper({"@rbc": [(1, STORY)], "@tass": [(7, STORY + " Подробности позже."), (8, OTHER)]})
+    summarizer = FakeSummarizer()
+    pool = StoryPool(StoryIndex())
+    since = datetime.utcnow() - timedelta(hours=1)
+    first_user = [{"channel_name": "@rbc", "channel_id": 1}, {"channel_name": "@tass", "channel_id": 2}]
+    second_user = [{"channel_name": "@tass", "channel_id": 2}]
+
+    async def run():
+        first = await pool.collect(scraper, first_user, since)
+        await pool.summarize(first, summarizer)
+        second = await pool.collect(scraper, second_user, since)
+        await pool.summarize(second, summarizer)
+        return pool.render_summaries(first), pool.render_summaries(second)
+
+    first_digest, second_digest = asyncio.run(run())
+
+    assert scraper.scraped == ["@rbc", "@tass"]
+    assert [len(batch) for batch in scraper.db.saved] == [1, 2]  # одна запись на канал, только новые посты
+    assert sum(len(call) for call in summarizer.calls) == 2
+    assert first_digest.count("summary of rbc/1") == 1
+    assert 'https://t.me/rbc/1' in first_digest and 'https://t.me/tass/7' in first_digest
+    assert "summary of rbc/1" in second_digest and "https://t.me/rbc/1" not in second_digest
+
+
+def test_unseen_drops_delivered_posts_and_stories():
+    pool = StoryPool(StoryIndex())
+    stories = [
+        {"story_id": "rbc/1", "posts": [{"channel": "rbc", "message_id": 1}, {"channel": "tass", "message_id": 7}]},
+        {"story_id": "tass/8", "posts": [{"channel": "tass", "message_id": 8}, {"channel": "ria", "message_id": 3}]},
+        {"story_id": "ria/4", "posts": [{"channel": "ria", "message_id": 4}]},
+    ]
+    delivered = {("tass", 8): "rbc/1", ("ria", 3): "tass/8"}
+
+    assert pool.unseen(stories, delivered) == [{"story_id": "ria/4", "posts": [{"channel": "ria", "message_id": 4}]}]
@@ -0,0 +1,93 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import re
+import json
+import time
+import asyncio
+import pytest
+from src.summarization import Summarization
+
+CHANNEL_KEY = re.compile(r"'(@\w+)': \[")
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    monkeypatch.setattr(Summarization, "_topic_cache", {})
+    summarizer = Summarization(api_key="fake", topic_ttl=60)
+    summarizer.prompts = []
+
+    async def mistral_request(prompt, max_retries=3, response_format=None, stage=None):
+        summarizer.prompts.append(prompt)
+        return json.dumps(summarizer.answer(CHANNEL_KEY.findall(prompt)), ensure_ascii=False)
+
+    summarizer.answer = lambda channels: {channel: f"Тема {channel}" for channel in channels}
+    monkeypatch.setattr(summarizer, "_mistral_request", mistral_request)
+    return summarizer
+
+
+def messages(count=2):
+    return [{"message": f"новость {i}"} for i in range(count)]
+
+
+def test_one_request_per_batch(summarizer):
+    samples = {f"@channel{i}": messages() for i in range(5)}
+    samples["@empty"] = []
+
+    topics = asyncio.run(summarizer.determine_channel_topics(samples, batch_size=2))
+
+    assert len(summarizer.prompts) == 3
+    assert [CHANNEL_KEY.findall(prompt) for prompt in summarizer.prompts] == [
+        ["@channel0", "@channel1"], ["@channel2", "@channel3"], ["@channel4"]
+    ]
+    assert topics["@channel3"] == ["Тема @channel3"]
+    # Канал без сообщений не попадает в запрос
+    assert topics["@empty"] == ["Общая тематика"]
+
+
+def test_missing_and_unknown_keys(summarizer):
+    summarizer.answer = lambda channels: {
+        "@news": "Политика, Экономика",
+        "@unknown": "Спорт",
+        "@blank": "  ",
+    }
+    samples = {"@news": messages(), "@skipped": messages(), "@blank": messages()}
+
+    topics = asyncio.run(summarizer.determine_channel_topics(samples))
+
+    assert topics == {
+        "@news": ["Политика", "Экономика"],
+        "@skipped": ["Общая тематика"],
+        "@blank": ["Общая тематика"],
+    }
+    # Кэшируются только темы, которые вернула модель
+    assert set(Summarization._topic_cache) == {"@news"}
+
+
+def test_malformed_answer_falls_back_without_caching(summarizer):
+    summarizer.answer = lambda channels: ["не словарь"]
+
+    topics = asyncio.run(summarizer.determine_channel_topics({"@news": messages()}))
+
+    assert topics == {"@news": ["Общая тематика"]}
+    assert Summarization._topic_cache == {}
+
+
+def test_topic_is_cached_for_ttl(summarizer, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    samples = {"@news": messages()}
+
+    asyncio.run(summarizer.determine_channel_topics(samples))
+    now[0] += 59
+    assert summarizer.cached_channel_topic("@news") == ["Тема @news"]
+    asyncio.run(summarizer.determine_channel_topics(samples))
+    assert len(summarizer.prompts) == 1
+
+    now[0] += 2
+    assert summarizer.cached_channel_topic("@news") is None
+    asyncio.run(summarizer.determine_channel_topics(samples))
+    assert len(summarizer.prompts) == 2
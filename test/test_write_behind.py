@@ -0,0 +1,131 @@
+import sys
+import os
+
+# Добавляем корневую директорию проекта в sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+from datetime import datetime
+
+from src.data.write_behind import WriteBehindBuffer
+
+
+class FakeDB:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+
+    async def _write(self, *call):
+        self.calls.append(call)
+        if self.failures:
+            self.failures -= 1
+            return False
+        return True
+
+    async def save_user_digests(self, digests):
+        return await self._write("digests", [digest["user_id"] for digest in digests])
+
+    async def save_channel_news_batch(self, channel_id, news):
+        return await self._write("news", channel_id, sorted(msg["message_id"] for msg in news))
+
+    async def set_users_receiving_news(self, user_ids, is_receiving):
+        return await self._write("receiving", sorted(user_ids), is_receiving)
+
+
+def post(message_id):
+    return {"message_id": message_id, "message": "текст", "message_date": datetime(2025, 1, 1)}
+
+
+def test_writes_are_coalesced_and_flushed_in_batches():
+    db = FakeDB()
+    buffer = WriteBehindBuffer(db, flush_interval=60)
+
+    async def run():
+        await buffer.save_user_digest(1, "дайджест", "2025-01-01T00:00:00")
+        await buffer.save_user_digest(2, "дайджест", "2025-01-01T00:00:00")
+        await buffer.save_channel_news_batch(10, [post(1), post(2)])
+        await buffer.save_channel_news_batch(10, [post(2), post(3)])
+        await buffer.set_user_receiving_news(1, True)
+        await buffer.set_user_receiving_news(1, False)
+        await buffer.set_user_receiving_news(2, False)
+        assert db.calls == []  # ничего не записано на пути вызова
+        await buffer.drain()
+
+    asyncio.run(run())
+    assert db.calls == [
+        ("digests", [1, 2]),
+        ("news", 10, [1, 2, 3]),
+        ("receiving", [1, 2], False),
+    ]
+    assert buffer.pending == 0
+    assert buffer.stats["coalesced"] == 2
+
+
+def test_size_threshold_triggers_flush():
+    db = FakeDB()
+    buffer = WriteBehindBuffer(db, max_batch=2, flush_interval=60)
+
+    async def run():
+        await buffer.save_user_digest(1, "a", "2025-01-01T00:00:00")
+        await buffer.save_user_digest(2, "b", "2025-01-01T00:00:00")
+        await asyncio.sleep(0.01)
+        calls = list(db.calls)
+        await buffer.drain()
+        return calls
+
+    assert asyncio.run(run()) == [("digests", [1, 2])]
+
+
+def test_failed_batches_are_retried_then_dropped():
+    db = FakeDB(failures=1)
+    buffer = WriteBehindBuffer(db, flush_interval=60, retry_delay=0)
+
+    async def run():
+        await buffer.save_user_digest(1, "a", "2025-01-01T00:00:00")
+        await buffer.drain()
+
+    asyncio.run(run())
+    assert db.calls == [("digests", [1]), ("digests", [1])]
+    assert buffer.stats["flushed"] == 1
+
+    db = FakeDB(failures=10)
+    buffer = WriteBehindBuffer(db, flush_interval=60, max_retries=2, retry_delay=0)
+    asyncio.run(buffer.set_user_receiving_news(1, True))
+    asyncio.run(buffer.drain())
+    assert len(db.calls) == 3
+    assert buffer.pending == 0
+    assert buffer.stats["dropped"] == 1
+
+
+def test_pending_writes_of_all_kinds_are_bounded():
+    db = FakeDB(failures=10)
+    buffer = WriteBehindBuffer(db, flush_interval=60, max_pending=4, max_retries=10)
+
+    async def run():
+        await buffer.save_channel_news_batch(10, [post(1), post(2), post(3)])
+        await buffer.save_user_digest(1, "a", "2025-01-01T00:00:00")
+        await buffer.set_user_receiving_news(1, False)
+        assert buffer.pending == 4
+        assert list(buffer._news[10]) == [2, 3]  # отброшен самый старый пост
+        await buffer.save_channel_news_batch(11, [post(4), post(5), post(6)])
+        assert buffer.pending == 4 and 10 not in buffer._news
+        await buffer.flush()  # неудачная пачка возвращается в очередь, лимит сохраняется
+        assert buffer.pending == 4
+        buffer._task.cancel()
+
+    asyncio.run(run())
+    assert buffer.stats["overflow"] == 4
+
+
+def test_discarded_flag_is_not_written():
+    db = FakeDB()
+    buffer = WriteBehindBuffer(db, flush_interval=60)
+
+    async def run():
+        await buffer.set_user_receiving_news(1, False)
+        await buffer.set_user_receiving_news(2, False)
+        buffer.discard_receiving_news(1)  # пользователь сам включил рассылку
+        await buffer.drain()
+
+    asyncio.run(run())
+    assert db.calls == [("receiving", [2], False)]